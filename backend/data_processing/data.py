@@ -1,28 +1,114 @@
 import pandas as pd
+import numpy as np
 from pathlib import Path
 import glob
+import hashlib
+import json
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-def load_data():
-    """
-    Đọc và chuẩn hóa dữ liệu từ các file gốc:
-    - customers_vietnam.xlsx
-    - depots_vietnam.xlsx
-    - vehicles_vietnam.xlsx
-    - roads/*.csv
-    """
-    BASE_DIR = Path(__file__).resolve().parent / "LMDO data_3i"
-    DATA_DIR = BASE_DIR / "roads"
-    OUTPUT_DIR = BASE_DIR / "processed"
-    os.makedirs(OUTPUT_DIR, exist_ok=True) 
+from backend.instrumentation import timed
 
-    # === Đọc dữ liệu chính ===
-    df_customers = pd.read_excel(BASE_DIR / "customers_vietnam.xlsx")
-    df_depots = pd.read_excel(BASE_DIR / "depots_vietnam.xlsx")
-    df_vehicles = pd.read_excel(BASE_DIR / "vehicles_vietnam.xlsx")
+# Giá trị điền cho các cặp node không có cung đường trong dữ liệu roads
+MISSING_TIME_MIN = 10**7
+MISSING_DISTANCE_KM = 1e6
 
-    print("✅ Đã đọc xong file customers, depots, và vehicles.")
+# Giới hạn bộ nhớ (MB) cho một cặp ma trận chi phí dày (thời gian + quãng đường, float32 N×N).
+# Vượt giới hạn thì build_cost_matrices trả về SparseCostMatrix (chỉ lưu các cung có trong roads).
+# Ghi đè bằng biến môi trường LASTMILE_MAX_MATRIX_MB.
+MAX_DENSE_MATRIX_MB = float(os.environ.get("LASTMILE_MAX_MATRIX_MB", 2048))
+
+# Cache dạng Parquet cho dữ liệu đã chuẩn hóa (nằm trong processed/cache)
+CACHE_VERSION = 1
+CACHE_FRAMES = ("customers", "depots", "vehicles", "roads")
+
+# Thư mục dữ liệu gốc mặc định của load_data
+DEFAULT_BASE_DIR = Path(__file__).resolve().parent / "LMDO data_3i"
+
+# Thư mục dữ liệu đã tách theo thành phố (split_by_city.py, filter_roads_by_city.py)
+DEFAULT_PROCESS_DIR = Path(__file__).resolve().parents[2] / "data" / "process"
+
+# Kiểu dữ liệu cố định cho các file road (tránh suy luận kiểu trên từng file)
+ROAD_DTYPES = {
+    "Origin_Node_ID": "str",
+    "Destination_Node_ID": "str",
+    "Distance_km": "float64",
+    "Travel_Time_min": "float64",
+    "Traffic_Level": "str",
+    "Road_Restrictions": "str",
+}
+
+# Giá trị cột Road_Restrictions và các loại xe bị cấm trên cung "No Heavy Trucks"
+RESTRICTION_NO_HEAVY = "No Heavy Trucks"
+RESTRICTION_ONE_WAY = "One-Way"
+HEAVY_VEHICLE_TYPES = ("Van", "EV Van", "Truck")
+
+# Hệ số thời gian di chuyển tĩnh theo Traffic_Level (khóa dạng .title() như sau khi chuẩn hóa)
+TRAFFIC_MULTIPLIERS = {"Low": 1.0, "Medium": 1.5, "High": 2.0}
+
+# Khung giờ (phút bắt đầu của mỗi band trong ngày) và hệ số thời gian theo Traffic_Level × band:
+# đêm, cao điểm sáng (7h-9h), ban ngày, cao điểm chiều (16h-19h), tối
+TIME_BAND_STARTS = (0, 7 * 60, 9 * 60, 16 * 60, 19 * 60)
+TRAFFIC_PROFILES = {
+    "Low": (1.0, 1.2, 1.0, 1.2, 1.0),
+    "Medium": (1.2, 1.8, 1.5, 1.8, 1.2),
+    "High": (1.5, 2.5, 2.0, 2.5, 1.5),
+}
 
+try:
+    import pyarrow  # noqa: F401
+    ROAD_CSV_ENGINE = "pyarrow"
+except ImportError:
+    ROAD_CSV_ENGINE = "c"
+
+
+def _source_signature(files):
+    """Khóa cache tính từ đường dẫn, mtime và kích thước của các file nguồn."""
+    h = hashlib.sha1(f"v{CACHE_VERSION}".encode())
+    for f in sorted(str(f) for f in files):
+        st = os.stat(f)
+        h.update(f"{f}|{st.st_mtime_ns}|{st.st_size}\n".encode())
+    return h.hexdigest()
+
+
+def _read_cache(cache_dir, key):
+    """Trả về 4 DataFrame từ cache nếu khóa khớp, ngược lại None."""
+    manifest_file = cache_dir / "manifest.json"
+    if not manifest_file.exists():
+        return None
+    try:
+        with open(manifest_file, encoding="utf-8") as fh:
+            manifest = json.load(fh)
+        if manifest.get("key") != key:
+            return None
+        return tuple(pd.read_parquet(cache_dir / f"{name}.parquet") for name in CACHE_FRAMES)
+    except ImportError:
+        return None
+    except Exception as e:
+        print(f"⚠️ Không đọc được cache, sẽ đọc lại dữ liệu gốc: {str(e)}")
+        return None
+
+
+def _write_cache(cache_dir, key, frames):
+    """Ghi 4 DataFrame ra Parquet; manifest được ghi sau cùng để cache luôn nhất quán."""
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_file = cache_dir / "manifest.json"
+    try:
+        if manifest_file.exists():
+            manifest_file.unlink()
+        for name, df in zip(CACHE_FRAMES, frames):
+            df.to_parquet(cache_dir / f"{name}.parquet", index=False)
+        with open(manifest_file, "w", encoding="utf-8") as fh:
+            json.dump({"key": key, "frames": list(CACHE_FRAMES)}, fh)
+    except ImportError:
+        print("⚠️ Chưa cài pyarrow, bỏ qua việc ghi cache Parquet.")
+    except Exception as e:
+        print(f"⚠️ Không ghi được cache: {str(e)}")
+
+
+def _normalize_frames(df_customers, df_depots, df_vehicles):
+    """Chuẩn hóa (tại chỗ) kiểu số, ID và khung giờ của customers, depots, vehicles."""
     # --- Chuẩn hóa VEHICLES ---
     for col in ["Capacity_Volume", "Fixed_Cost", "Variable_Cost"]:
         df_vehicles[col] = (
@@ -57,22 +143,89 @@ def load_data():
         df_customers["Time_Start"] = pd.to_datetime(df_customers["Time_Start"], format="%H:%M", errors="coerce")
         df_customers["Time_End"] = pd.to_datetime(df_customers["Time_End"], format="%H:%M", errors="coerce")
 
-    # --- Đọc & gộp roads ---
+
+def _read_road_file(f):
+    """Đọc và chuẩn hóa một file road; chỉ tạo bản sao khi thực sự có dòng cần loại bỏ."""
+    try:
+        df = pd.read_csv(f, dtype=ROAD_DTYPES, engine=ROAD_CSV_ENGINE)
+    except ValueError:
+        # Cột số có giá trị lỗi -> đọc dạng chuỗi rồi ép kiểu với errors="coerce"
+        df = pd.read_csv(f, dtype=str, engine=ROAD_CSV_ENGINE)
+    return _normalize_roads(df)
+
+
+def _normalize_roads(df):
+    """Chuẩn hóa ID node và cột số của bảng road, loại dòng thiếu dữ liệu bắt buộc."""
+    df["Origin_Node_ID"] = df["Origin_Node_ID"].astype("str").str.strip().str.upper()
+    df["Destination_Node_ID"] = df["Destination_Node_ID"].astype("str").str.strip().str.upper()
+    df["Distance_km"] = pd.to_numeric(df["Distance_km"], errors="coerce")
+    df["Travel_Time_min"] = pd.to_numeric(df["Travel_Time_min"], errors="coerce")
+    subset = ["Origin_Node_ID", "Destination_Node_ID", "Distance_km"]
+    if df[subset].isna().any(axis=None):
+        df = df.dropna(subset=subset)
+    return df
+
+
+def read_road_files(road_files, workers=None):
+    """
+    Đọc nhiều file road song song bằng ThreadPoolExecutor.
+    Engine pyarrow (nếu có) nhả GIL khi parse nên các luồng chạy song song thực sự.
+    Trả về danh sách DataFrame theo đúng thứ tự road_files.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(road_files) <= 1:
+        return [_read_road_file(f) for f in road_files]
+    with ThreadPoolExecutor(max_workers=min(workers, len(road_files))) as executor:
+        return list(executor.map(_read_road_file, road_files))
+
+
+@timed()
+def load_data(base_dir=None, use_cache=True, export_csv=False, road_workers=None):
+    """
+    Đọc và chuẩn hóa dữ liệu từ các file gốc:
+    - customers_vietnam.xlsx
+    - depots_vietnam.xlsx
+    - vehicles_vietnam.xlsx
+    - roads/*.csv
+    Kết quả chuẩn hóa được cache dạng Parquet trong processed/cache, khóa theo mtime và
+    kích thước các file nguồn; lần gọi sau đọc thẳng từ cache nếu dữ liệu gốc không đổi.
+    export_csv=True để xuất thêm các file *_clean.csv như trước.
+    road_workers: số luồng đọc file roads song song (mặc định = số CPU).
+    """
+    BASE_DIR = Path(base_dir) if base_dir is not None else DEFAULT_BASE_DIR
+    DATA_DIR = BASE_DIR / "roads"
+    OUTPUT_DIR = BASE_DIR / "processed"
+    CACHE_DIR = OUTPUT_DIR / "cache"
+    os.makedirs(OUTPUT_DIR, exist_ok=True) 
+
+    source_files = [BASE_DIR / "customers_vietnam.xlsx", BASE_DIR / "depots_vietnam.xlsx", BASE_DIR / "vehicles_vietnam.xlsx"]
     road_files = glob.glob(str(DATA_DIR / "roads_*/*.csv"))
     if not road_files:
         raise FileNotFoundError("❌ Không tìm thấy bất kỳ file road nào trong thư mục /roads/")
-    
-    list_of_road_dfs = []
-    for f in road_files:
-        df = pd.read_csv(f)
-        df["Origin_Node_ID"] = df["Origin_Node_ID"].astype(str).str.strip().str.upper()
-        df["Destination_Node_ID"] = df["Destination_Node_ID"].astype(str).str.strip().str.upper()
-        df["Distance_km"] = pd.to_numeric(df["Distance_km"], errors="coerce")
-        df["Travel_Time_min"] = pd.to_numeric(df["Travel_Time_min"], errors="coerce")
-        df = df.dropna(subset=["Origin_Node_ID", "Destination_Node_ID", "Distance_km"])
-        list_of_road_dfs.append(df)
+
+    cache_key = _source_signature(source_files + road_files)
+    if use_cache:
+        cached = _read_cache(CACHE_DIR, cache_key)
+        if cached is not None:
+            print(f"⚡ Đã đọc dữ liệu chuẩn hóa từ cache: {CACHE_DIR}")
+            if export_csv:
+                _export_clean_csv(OUTPUT_DIR, *cached)
+            return cached
+
+    # === Đọc dữ liệu chính ===
+    df_customers = pd.read_excel(BASE_DIR / "customers_vietnam.xlsx")
+    df_depots = pd.read_excel(BASE_DIR / "depots_vietnam.xlsx")
+    df_vehicles = pd.read_excel(BASE_DIR / "vehicles_vietnam.xlsx")
+
+    print("✅ Đã đọc xong file customers, depots, và vehicles.")
+
+    _normalize_frames(df_customers, df_depots, df_vehicles)
+
+    # --- Đọc & gộp roads (song song, mỗi file một luồng) ---
+    list_of_road_dfs = read_road_files(road_files, workers=road_workers)
 
     df_roads_full = pd.concat(list_of_road_dfs, ignore_index=True)
+    del list_of_road_dfs
     print(f"✅ Đã gộp xong {len(road_files)} file roads ({len(df_roads_full):,} cung đường).")
 
     # --- Kiểm tra tính toàn vẹn ---
@@ -83,26 +236,75 @@ def load_data():
     missing_customers = set(df_customers["Customer_ID"]) - set(df_roads_full["Destination_Node_ID"])
     if missing_customers:
         print(f"⚠️ Một số khách hàng không có cung đường: {list(missing_customers)[:10]} ...")
-    # --- Lưu file chuẩn hóa ---
-    df_customers.to_csv(OUTPUT_DIR / "customers_clean.csv", index=False)
-    df_depots.to_csv(OUTPUT_DIR / "depots_clean.csv", index=False)
-    df_vehicles.to_csv(OUTPUT_DIR / "vehicles_clean.csv", index=False)
-    df_roads_full.to_csv(OUTPUT_DIR / "roads_clean.csv", index=False)
+    # --- Lưu cache & file chuẩn hóa ---
+    if use_cache:
+        _write_cache(CACHE_DIR, cache_key, (df_customers, df_depots, df_vehicles, df_roads_full))
+    if export_csv:
+        _export_clean_csv(OUTPUT_DIR, df_customers, df_depots, df_vehicles, df_roads_full)
+    return df_customers, df_depots, df_vehicles, df_roads_full
+
 
-    print(f"💾 Đã lưu 4 file dữ liệu chuẩn hóa vào thư mục: {OUTPUT_DIR}")
+def _export_clean_csv(output_dir, df_customers, df_depots, df_vehicles, df_roads_full):
+    df_customers.to_csv(output_dir / "customers_clean.csv", index=False)
+    df_depots.to_csv(output_dir / "depots_clean.csv", index=False)
+    df_vehicles.to_csv(output_dir / "vehicles_clean.csv", index=False)
+    df_roads_full.to_csv(output_dir / "roads_clean.csv", index=False)
+
+    print(f"💾 Đã lưu 4 file dữ liệu chuẩn hóa vào thư mục: {output_dir}")
     print("📂 Bao gồm: customers_clean.csv, depots_clean.csv, vehicles_clean.csv, roads_clean.csv")
+
+
+@timed()
+def load_city_data(city, process_dir=None):
+    """
+    Đọc dữ liệu đã tách theo thành phố trong data/process/<city>/ (do split_by_city.py
+    và filter_roads_by_city.py tạo ra) và chuẩn hóa giống load_data.
+    Ưu tiên file .parquet, nếu không có thì đọc file .xlsx cũ.
+    Trả về (df_customers, df_depots, df_vehicles, df_roads_full).
+    """
+    process_dir = Path(process_dir) if process_dir is not None else DEFAULT_PROCESS_DIR
+    city_dir = process_dir / city
+    if not city_dir.is_dir():
+        raise FileNotFoundError(f"❌ Không tìm thấy thư mục thành phố: {city_dir}")
+
+    df_customers = read_city_table(city_dir, "customers")
+    df_depots = read_city_table(city_dir, "depots")
+    df_vehicles = read_city_table(city_dir, "vehicles")
+    df_roads_full = read_city_table(city_dir, "roads")
+    if df_customers is None or df_depots is None or df_vehicles is None:
+        raise FileNotFoundError(f"❌ Thiếu file customers/depots/vehicles trong: {city_dir}")
+    if df_roads_full is None:
+        df_roads_full = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in ROAD_DTYPES.items()})
+
+    _normalize_frames(df_customers, df_depots, df_vehicles)
+    df_roads_full = _normalize_roads(df_roads_full).reset_index(drop=True)
+
+    print(f"✅ Đã đọc dữ liệu {city}: {len(df_customers):,} customers, {len(df_depots)} depots, "
+          f"{len(df_vehicles)} vehicles, {len(df_roads_full):,} cung đường.")
     return df_customers, df_depots, df_vehicles, df_roads_full
 
 
+def read_city_table(city_dir, name):
+    """Đọc <name>.parquet (hoặc <name>.xlsx nếu chưa có parquet); trả về None nếu không có file."""
+    parquet_file = Path(city_dir) / f"{name}.parquet"
+    excel_file = Path(city_dir) / f"{name}.xlsx"
+    if parquet_file.exists():
+        return pd.read_parquet(parquet_file)
+    if excel_file.exists():
+        return pd.read_excel(excel_file)
+    return None
+
+
 if __name__ == "__main__":
     load_data()
 
+@timed()
 def build_cost_lookup(df_roads_full, df_depots, df_customers, mode="time"):
     """
     Tạo từ điển lookup chi phí (hoặc thời gian) giữa các node.
     mode = 'time' hoặc 'distance'
     """
-    traffic_multipliers = {"LOW": 1.0, "MEDIUM": 1.5, "HIGH": 2.0}
+    traffic_multipliers = TRAFFIC_MULTIPLIERS
 
     # Làm sạch dữ liệu roads
     df_roads_full["Traffic_Level"] = df_roads_full["Traffic_Level"].astype(str).str.strip().str.title()
@@ -132,3 +334,489 @@ def build_cost_lookup(df_roads_full, df_depots, df_customers, mode="time"):
 
     print(f"🔹 Đã tạo cost lookup cho {len(cost_lookup):,} cung đường (2 chiều).")
     return cost_lookup, all_nodes
+
+
+def dense_matrix_mb(num_nodes, count=1, itemsize=4):
+    """Bộ nhớ (MB) của count ma trận dày N×N với itemsize byte mỗi phần tử."""
+    return count * num_nodes * num_nodes * itemsize / 2**20
+
+
+class SparseCostMatrix:
+    """
+    Ma trận chi phí N×N dạng thưa: chỉ lưu các cung có giá trị (khóa i*N + j tăng dần + giá trị
+    float32, ~12 byte/cung); mọi cặp khác nhận fill (MISSING_*), đường chéo = 0.
+    Dùng thay mảng NumPy N×N khi N lớn; hỗ trợ các cách truy cập mà pipeline dùng:
+    - m[i, j] với i, j là số/mảng broadcast được (kể cả np.ix_) -> mảng float32 cùng shape
+    - m[rows] (chỉ số/list/slice dòng) -> các dòng dạng dày len(rows)×N
+    - take(idx): ma trận con (vẫn thưa) trên các node idx; arcs(): (rows, cols, values) của các cung
+    """
+
+    __slots__ = ("num_nodes", "keys", "values", "fill", "_indptr")
+    ndim = 2
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, num_nodes, keys, values, fill):
+        self.num_nodes = int(num_nodes)
+        self.keys = keys
+        self.values = values
+        self.fill = float(fill)
+        self._indptr = None
+
+    @staticmethod
+    def from_arcs(num_nodes, rows, cols, values, fill):
+        """Dựng từ các cung (rows, cols, values); cặp trùng thì cung ghi sau đè cung trước, bỏ đường chéo."""
+        keys = np.asarray(rows, dtype=np.int64) * num_nodes + np.asarray(cols, dtype=np.int64)
+        # np.unique lấy lần xuất hiện đầu tiên -> duyệt ngược để giữ cung ghi sau cùng
+        keys, last = np.unique(keys[::-1], return_index=True)
+        values = np.asarray(values, dtype=np.float32)[::-1][last]
+        off_diagonal = keys // num_nodes != keys % num_nodes
+        return SparseCostMatrix(num_nodes, keys[off_diagonal], values[off_diagonal], fill)
+
+    def __reduce__(self):
+        return SparseCostMatrix, (self.num_nodes, np.asarray(self.keys), np.asarray(self.values), self.fill)
+
+    @property
+    def shape(self):
+        return (self.num_nodes, self.num_nodes)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes
+
+    def __len__(self):
+        return self.num_nodes
+
+    def __repr__(self):
+        return f"SparseCostMatrix({self.num_nodes:,}×{self.num_nodes:,}, {len(self.keys):,} cung)"
+
+    def lookup(self, rows, cols):
+        """Giá trị của các cặp (rows, cols) (broadcast), dạng float32."""
+        rows, cols = np.broadcast_arrays(np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))
+        query = rows * self.num_nodes + cols
+        pos = np.minimum(np.searchsorted(self.keys, query), max(len(self.keys) - 1, 0))
+        if len(self.keys):
+            found = self.keys[pos] == query
+            result = np.where(found, self.values[pos], np.float32(self.fill)).astype(np.float32)
+        else:
+            result = np.full(query.shape, self.fill, dtype=np.float32)
+        result[rows == cols] = 0
+        return result
+
+    def _row_bounds(self):
+        if self._indptr is None:
+            self._indptr = np.searchsorted(self.keys, np.arange(self.num_nodes + 1, dtype=np.int64) * self.num_nodes)
+        return self._indptr
+
+    def row_entries(self, rows):
+        """Các cung xuất phát từ rows: (vị trí dòng trong rows, cột, giá trị)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        indptr = self._row_bounds()
+        starts, counts = indptr[rows], indptr[rows + 1] - indptr[rows]
+        local = np.repeat(np.arange(len(rows)), counts)
+        pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        return local, self.keys[pos] % self.num_nodes, self.values[pos]
+
+    def dense_rows(self, rows):
+        """Các dòng rows dạng mảng dày float32 len(rows)×N."""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.full((len(rows), self.num_nodes), self.fill, dtype=np.float32)
+        local, cols, values = self.row_entries(rows)
+        out[local, cols] = values
+        out[np.arange(len(rows)), rows] = 0
+        return out
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            rows, cols = (np.arange(self.num_nodes)[i] if isinstance(i, slice) else i for i in index)
+            return self.lookup(rows, cols)
+        rows = np.arange(self.num_nodes)[index]
+        if np.ndim(rows) == 0:
+            return self.dense_rows([int(rows)])[0]
+        return self.dense_rows(rows)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.dense_rows(np.arange(self.num_nodes))
+        return dense if dtype is None else dense.astype(dtype)
+
+    def arcs(self):
+        """(rows, cols, values) của mọi cung đang lưu."""
+        return self.keys // self.num_nodes, self.keys % self.num_nodes, self.values
+
+    def take(self, idx):
+        """Ma trận con trên các node idx (chỉ số cục bộ theo thứ tự idx), vẫn dạng thưa."""
+        idx = np.asarray(idx, dtype=np.int64)
+        remap = np.full(self.num_nodes, -1, dtype=np.int64)
+        remap[idx] = np.arange(len(idx))
+        rows, cols, values = self.arcs()
+        rows, cols = remap[rows], remap[cols]
+        keep = (rows >= 0) & (cols >= 0)
+        return SparseCostMatrix.from_arcs(len(idx), rows[keep], cols[keep], values[keep], self.fill)
+
+    def equals(self, other):
+        return (isinstance(other, SparseCostMatrix) and self.num_nodes == other.num_nodes
+                and self.fill == other.fill and np.array_equal(self.keys, other.keys)
+                and np.array_equal(self.values, other.values))
+
+    def tobytes(self):
+        """Nội dung dạng bytes (dùng để hash dữ liệu đầu vào)."""
+        return np.float64(self.fill).tobytes() + np.asarray(self.keys).tobytes() + np.asarray(self.values).tobytes()
+
+
+def cost_matrices_equal(a, b):
+    """So sánh hai ma trận chi phí (mảng NumPy hoặc SparseCostMatrix) mà không dựng bản dày."""
+    if a is b:
+        return True
+    if isinstance(a, SparseCostMatrix) or isinstance(b, SparseCostMatrix):
+        return isinstance(a, SparseCostMatrix) and a.equals(b)
+    return np.array_equal(a, b)
+
+
+def cost_matrix_bytes(matrix):
+    """Bytes của ma trận chi phí (dày hoặc thưa) để đưa vào hash."""
+    if isinstance(matrix, SparseCostMatrix):
+        return matrix.tobytes()
+    return np.ascontiguousarray(matrix).tobytes()
+
+
+def _road_arcs(df_roads_full, all_nodes, forbidden_restrictions=(), one_way=False):
+    """
+    Chuyển bảng roads thành các cung có hướng theo chỉ số all_nodes, theo đúng thứ tự ghi
+    (xen kẽ (i, j), (j, i) từng dòng để "ghi sau đè ghi trước").
+    Trả về (rows, cols, travel_time, distance, traffic_level) — travel_time chưa nhân hệ số,
+    traffic_level là chuỗi Traffic_Level đã .title().
+    """
+    # Ánh xạ ID -> chỉ số bằng categorical codes (-1 nếu node không thuộc bài toán)
+    categories = pd.Index(all_nodes)
+    origin = pd.Categorical(df_roads_full["Origin_Node_ID"], categories=categories).codes
+    dest = pd.Categorical(df_roads_full["Destination_Node_ID"], categories=categories).codes
+
+    distance = pd.to_numeric(df_roads_full["Distance_km"], errors="coerce").to_numpy(np.float32)
+    travel_time = pd.to_numeric(df_roads_full["Travel_Time_min"], errors="coerce").to_numpy(np.float32)
+    traffic_level = df_roads_full["Traffic_Level"].astype(str).str.strip().str.title().to_numpy(object)
+
+    valid = (origin >= 0) & (dest >= 0) & ~np.isnan(distance) & ~np.isnan(travel_time)
+    if "Road_Restrictions" in df_roads_full.columns:
+        restriction = df_roads_full["Road_Restrictions"].astype(str).str.strip().to_numpy()
+    else:
+        restriction = np.full(len(df_roads_full), "nan", dtype=object)
+    if forbidden_restrictions:
+        valid &= ~np.isin(restriction, list(forbidden_restrictions))
+    origin, dest = origin[valid], dest[valid]
+
+    rows = np.column_stack([origin, dest]).ravel()
+    cols = np.column_stack([dest, origin]).ravel()
+    travel_time = np.repeat(travel_time[valid], 2)
+    distance = np.repeat(distance[valid], 2)
+    traffic_level = np.repeat(traffic_level[valid], 2)
+    if one_way:
+        # Bỏ chiều ngược (j, i) của các cung một chiều
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1::2] = restriction[valid] != RESTRICTION_ONE_WAY
+        rows, cols = rows[keep], cols[keep]
+        travel_time, distance, traffic_level = travel_time[keep], distance[keep], traffic_level[keep]
+    return rows, cols, travel_time, distance, traffic_level
+
+
+@timed()
+def build_cost_matrices(df_roads_full, df_depots, df_customers,
+                        missing_time=MISSING_TIME_MIN, missing_distance=MISSING_DISTANCE_KM,
+                        forbidden_restrictions=(), one_way=False, sparse=None):
+    """
+    Tạo ma trận thời gian (phút) và quãng đường (km) N×N trong một lần duyệt roads.
+    - Node được đánh chỉ số theo thứ tự all_nodes = depots + customers (giống build_cost_lookup).
+    - Thời gian = Travel_Time_min × TRAFFIC_MULTIPLIERS[Traffic_Level] (mặc định 1.0).
+    - Cặp node không có cung đường nhận giá trị missing_time / missing_distance, đường chéo = 0.
+    - Mỗi cung được ghi 2 chiều; nếu trùng cặp thì dòng xuất hiện sau ghi đè (giống bản dict).
+    - forbidden_restrictions: các giá trị Road_Restrictions bị bỏ qua (vd. "No Heavy Trucks" cho xe nặng)
+    - one_way=True: cung "One-Way" chỉ được ghi theo chiều Origin -> Destination
+    - sparse: True/False = ép dạng thưa/dày; None = tự chọn: dạng thưa (SparseCostMatrix) khi hai ma
+      trận dày cần quá MAX_DENSE_MATRIX_MB (kiểm tra trước khi cấp phát)
+    Trả về (time_matrix, distance_matrix, all_nodes) với kiểu float32.
+    """
+    all_nodes = list(df_depots["Depot_ID"]) + list(df_customers["Customer_ID"])
+    num_nodes = len(all_nodes)
+
+    rows, cols, travel_time, distance, traffic_level = _road_arcs(
+        df_roads_full, all_nodes, forbidden_restrictions=forbidden_restrictions, one_way=one_way
+    )
+    factor = pd.Series(traffic_level).map(TRAFFIC_MULTIPLIERS).fillna(1.0).to_numpy(np.float32)
+
+    dense_mb = dense_matrix_mb(num_nodes, count=2)
+    if sparse is None:
+        sparse = dense_mb > MAX_DENSE_MATRIX_MB
+    if sparse:
+        time_matrix = SparseCostMatrix.from_arcs(num_nodes, rows, cols, travel_time * factor, missing_time)
+        # Cùng tập cung với ma trận thời gian nên dùng chung mảng khóa
+        distance_matrix = SparseCostMatrix.from_arcs(num_nodes, rows, cols, distance, missing_distance)
+        distance_matrix.keys = time_matrix.keys
+        print(f"🔹 Đã tạo ma trận chi phí thưa {num_nodes:,}×{num_nodes:,} từ {len(rows):,} cung đường có hướng "
+              f"({(time_matrix.nbytes + distance_matrix.values.nbytes) / 2**20:,.1f} MB thay vì {dense_mb:,.0f} MB).")
+        return time_matrix, distance_matrix, all_nodes
+
+    time_matrix = np.full((num_nodes, num_nodes), missing_time, dtype=np.float32)
+    distance_matrix = np.full((num_nodes, num_nodes), missing_distance, dtype=np.float32)
+    time_matrix[rows, cols] = travel_time * factor
+    distance_matrix[rows, cols] = distance
+    np.fill_diagonal(time_matrix, 0)
+    np.fill_diagonal(distance_matrix, 0)
+
+    print(f"🔹 Đã tạo ma trận chi phí {num_nodes:,}×{num_nodes:,} từ {len(rows):,} cung đường có hướng.")
+    return time_matrix, distance_matrix, all_nodes
+
+
+def build_time_band_matrices(df_roads_full, df_depots, df_customers, band_starts=TIME_BAND_STARTS,
+                             profiles=TRAFFIC_PROFILES, missing_time=MISSING_TIME_MIN):
+    """
+    Tạo mảng thời gian di chuyển phụ thuộc khung giờ dạng [band, i, j] (float32, B×N×N):
+    time[b, i, j] = Travel_Time_min × profiles[Traffic_Level][b]. Cùng thứ tự node và quy tắc
+    ghi đè với build_cost_matrices; cặp không có cung = missing_time, đường chéo = 0.
+    Band của thời điểm t (phút) là chỉ số lớn nhất b với band_starts[b] <= t.
+    """
+    all_nodes = list(df_depots["Depot_ID"]) + list(df_customers["Customer_ID"])
+    num_nodes = len(all_nodes)
+    num_bands = len(band_starts)
+
+    band_mb = dense_matrix_mb(num_nodes, count=num_bands)
+    if band_mb > MAX_DENSE_MATRIX_MB:
+        raise MemoryError(
+            f"Ma trận theo khung giờ {num_bands}×{num_nodes:,}×{num_nodes:,} cần ~{band_mb:,.0f} MB (giới hạn "
+            f"{MAX_DENSE_MATRIX_MB:,.0f} MB, LASTMILE_MAX_MATRIX_MB). Hãy tắt time_dependent hoặc giải theo cụm."
+        )
+
+    rows, cols, travel_time, _, traffic_level = _road_arcs(df_roads_full, all_nodes)
+    levels = list(profiles)
+    profile_table = np.vstack([np.asarray(profiles[lv], dtype=np.float32) for lv in levels]
+                              + [np.ones(num_bands, dtype=np.float32)])
+    level_code = pd.Categorical(traffic_level, categories=levels).codes.astype(np.int64)
+    level_code[level_code < 0] = len(levels)  # mức lạ -> hệ số 1.0
+
+    band_matrices = np.full((num_bands, num_nodes, num_nodes), missing_time, dtype=np.float32)
+    for b in range(num_bands):
+        band_matrices[b, rows, cols] = travel_time * profile_table[level_code, b]
+        np.fill_diagonal(band_matrices[b], 0)
+
+    print(f"🔹 Đã tạo ma trận thời gian theo khung giờ {num_bands}×{num_nodes:,}×{num_nodes:,}.")
+    return band_matrices, all_nodes
+
+
+def vehicle_classes(df_vehicles):
+    """
+    Chia đội xe thành các lớp có chung ma trận chi phí theo Vehicle_Type:
+    "light" (đi được mọi cung) và "heavy" (HEAVY_VEHICLE_TYPES, cấm cung "No Heavy Trucks").
+    Trả về (class_restrictions, vehicle_class): dict tên lớp -> các Road_Restrictions bị cấm
+    (chỉ gồm lớp có xe, lớp nhẹ đứng đầu) và list chỉ số lớp của từng xe.
+    """
+    vehicle_type = df_vehicles["Vehicle_Type"].astype(str).str.strip()
+    is_heavy = vehicle_type.isin(HEAVY_VEHICLE_TYPES).to_numpy()
+    class_restrictions = {}
+    if not is_heavy.all():
+        class_restrictions["light"] = ()
+    if is_heavy.any():
+        class_restrictions["heavy"] = (RESTRICTION_NO_HEAVY,)
+    names = list(class_restrictions)
+    vehicle_class = [names.index("heavy" if h else "light") for h in is_heavy]
+    return class_restrictions, vehicle_class
+
+
+def build_knn_neighbors(time_matrix, k, candidate_nodes, missing_time=MISSING_TIME_MIN, block_rows=1024):
+    """
+    Với mỗi node, chọn k node gần nhất (theo thời gian) trong candidate_nodes mà có cung khả thi
+    (thời gian < missing_time, khác chính nó). Duyệt theo khối block_rows dòng để bộ nhớ tạm
+    chỉ tỉ lệ block_rows × len(candidate_nodes). Với SparseCostMatrix, chọn thẳng trên các cung
+    đang lưu (cặp không có cung luôn >= missing_time nên không bao giờ là láng giềng).
+    Trả về mảng int32 (N, k) chỉ số node, sắp tăng dần theo thời gian; ô trống = -1.
+    """
+    candidate_nodes = np.asarray(candidate_nodes, dtype=np.int64)
+    num_nodes = time_matrix.shape[0]
+    k = min(int(k), len(candidate_nodes))
+    neighbors = np.full((num_nodes, max(k, 0)), -1, dtype=np.int32)
+    if k == 0:
+        return neighbors
+
+    if isinstance(time_matrix, SparseCostMatrix):
+        rows, cols, values = time_matrix.arcs()
+        is_candidate = np.zeros(num_nodes, dtype=bool)
+        is_candidate[candidate_nodes] = True
+        keep = is_candidate[cols] & (values < missing_time)
+        order = np.lexsort((values[keep], rows[keep]))  # theo dòng, trong dòng tăng dần theo thời gian
+        rows, cols = rows[keep][order], cols[keep][order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        first_k = rank < k
+        neighbors[rows[first_k], rank[first_k]] = cols[first_k]
+        print(f"🔹 Đã tạo đồ thị k-láng giềng (k={k}) cho {num_nodes:,} node.")
+        return neighbors
+
+    for start in range(0, num_nodes, block_rows):
+        rows = np.arange(start, min(start + block_rows, num_nodes))
+        block = time_matrix[np.ix_(rows, candidate_nodes)].astype(np.float32)
+        block[block >= missing_time] = np.inf
+        block[rows[:, None] == candidate_nodes[None, :]] = np.inf
+        part = np.argpartition(block, k - 1, axis=1)[:, :k]
+        part_time = np.take_along_axis(block, part, axis=1)
+        order = np.argsort(part_time, axis=1)
+        part = np.take_along_axis(part, order, axis=1)
+        part_time = np.take_along_axis(part_time, order, axis=1)
+        neighbors[rows] = np.where(np.isfinite(part_time), candidate_nodes[part], -1)
+
+    print(f"🔹 Đã tạo đồ thị k-láng giềng (k={k}) cho {num_nodes:,} node.")
+    return neighbors
+
+
+def _shortest_path_rows(graph, sources):
+    """Dijkstra từ các node sources trên đồ thị CSR (chạy được trong worker process)."""
+    from scipy.sparse.csgraph import shortest_path
+
+    return shortest_path(graph, method="D", directed=True, indices=sources)
+
+
+def _all_pairs_shortest_paths(weights, missing_value, workers=1, block_rows=512):
+    """Đường đi ngắn nhất mọi cặp trên đồ thị có cung = các ô của weights khác missing_value."""
+    from scipy.sparse import csr_matrix
+
+    num_nodes = weights.shape[0]
+    rows, cols = np.nonzero(weights < missing_value)
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+    # csgraph coi trọng số 0 là "không có cung" -> thay bằng số dương rất nhỏ
+    values = np.maximum(weights[rows, cols].astype(np.float64), 1e-9)
+    graph = csr_matrix((values, (rows, cols)), shape=(num_nodes, num_nodes))
+
+    chunks = [np.arange(i, min(i + block_rows, num_nodes)) for i in range(0, num_nodes, block_rows)]
+    if workers and workers > 1 and len(chunks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_shortest_path_rows, [graph] * len(chunks), chunks))
+    else:
+        parts = [_shortest_path_rows(graph, chunk) for chunk in chunks]
+    return np.vstack(parts)
+
+
+@timed()
+def complete_cost_matrices(time_matrix, distance_matrix, missing_time=MISSING_TIME_MIN,
+                           missing_distance=MISSING_DISTANCE_KM, cache_dir=None, workers=1):
+    """
+    Điền các cặp node thiếu cung đường (giá trị missing_*) bằng đường đi ngắn nhất qua đồ thị
+    road (Dijkstra của scipy.sparse.csgraph, chia theo khối nguồn, song song bằng process pool
+    nếu workers > 1). Thời gian và quãng đường được tính trên hai đồ thị riêng.
+    Cặp vẫn không tới được giữ giá trị missing_*. Các cung có sẵn giữ nguyên.
+    cache_dir: nếu có, kết quả được lưu/đọc lại từ paths_<hash>.npz theo hash của ma trận đầu vào.
+    Kết quả là ma trận dày nên SparseCostMatrix chỉ được nhận khi hai ma trận dày không vượt
+    MAX_DENSE_MATRIX_MB; ngược lại báo MemoryError trước khi cấp phát.
+    Trả về (time_matrix, distance_matrix) mới (float32).
+    """
+    num_nodes = time_matrix.shape[0]
+    dense_mb = dense_matrix_mb(num_nodes, count=2)
+    if dense_mb > MAX_DENSE_MATRIX_MB:
+        raise MemoryError(
+            f"complete_paths cần ma trận dày {num_nodes:,}×{num_nodes:,} (~{dense_mb:,.0f} MB, giới hạn "
+            f"{MAX_DENSE_MATRIX_MB:,.0f} MB, LASTMILE_MAX_MATRIX_MB). Hãy tắt complete_paths hoặc giải theo cụm."
+        )
+    time_matrix, distance_matrix = np.asarray(time_matrix), np.asarray(distance_matrix)
+    cache_file = None
+    if cache_dir is not None:
+        h = hashlib.sha1(f"{missing_time}|{missing_distance}|{time_matrix.shape}".encode())
+        h.update(np.ascontiguousarray(time_matrix).tobytes())
+        h.update(np.ascontiguousarray(distance_matrix).tobytes())
+        cache_file = Path(cache_dir) / f"paths_{h.hexdigest()}.npz"
+        if cache_file.exists():
+            with np.load(cache_file) as cached:
+                print(f"⚡ Đã đọc ma trận đường đi ngắn nhất từ cache: {cache_file}")
+                return cached["time_matrix"], cached["distance_matrix"]
+
+    completed = []
+    for matrix, missing_value in ((time_matrix, missing_time), (distance_matrix, missing_distance)):
+        shortest = _all_pairs_shortest_paths(matrix, missing_value, workers=workers)
+        fill = (matrix >= missing_value) & np.isfinite(shortest)
+        result = matrix.astype(np.float32, copy=True)
+        result[fill] = shortest[fill]
+        completed.append(result)
+        del shortest
+    time_full, distance_full = completed
+
+    filled = int(((time_matrix >= missing_time) & (time_full < missing_time)).sum())
+    print(f"🔹 Đã bổ sung {filled:,} cặp node bằng đường đi ngắn nhất.")
+    if cache_file is not None:
+        os.makedirs(cache_file.parent, exist_ok=True)
+        np.savez(cache_file, time_matrix=time_full, distance_matrix=distance_full)
+        print(f"💾 Đã lưu cache đường đi ngắn nhất: {cache_file}")
+    return time_full, distance_full
+
+
+def matrix_store_key(df_roads_full, all_nodes, **options):
+    """Khóa của kho ma trận: hash nội dung bảng road, danh sách node và các tùy chọn dựng ma trận."""
+    h = hashlib.sha1(json.dumps([list(map(str, all_nodes)), sorted(options.items()), TRAFFIC_MULTIPLIERS],
+                                default=str).encode())
+    h.update(pd.util.hash_pandas_object(df_roads_full, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _replace_atomic(path, write):
+    """
+    Ghi file path qua một file tạm tên duy nhất trong cùng thư mục rồi os.replace, để nhiều process
+    cùng ghi một file (vd. các worker batch dùng chung kho ma trận) không ghi đè file tạm của nhau.
+    write(fh) ghi nội dung vào file nhị phân fh.
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write(fh)
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+def save_matrix_store(store_dir, time_matrix, distance_matrix, all_nodes, key=None):
+    """
+    Lưu ma trận thời gian/quãng đường thành time.npy, distance.npy (float32) kèm file
+    nodes.json (thứ tự node + khóa). SparseCostMatrix được lưu thành <tên>.keys.npy/<tên>.values.npy
+    (giá trị fill ghi trong nodes.json). Mỗi file được ghi qua file tạm riêng rồi thay thế nguyên tử;
+    nodes.json được ghi sau cùng nên kho chỉ hợp lệ khi đã ghi đủ các ma trận.
+    """
+    store_dir = Path(store_dir)
+    os.makedirs(store_dir, exist_ok=True)
+    sidecar = store_dir / "nodes.json"
+    sidecar.unlink(missing_ok=True)
+    sparse_fill = {}
+    for name, matrix in (("time", time_matrix), ("distance", distance_matrix)):
+        if isinstance(matrix, SparseCostMatrix):
+            sparse_fill[name] = matrix.fill
+            for part, array in (("keys", matrix.keys), ("values", matrix.values)):
+                _replace_atomic(store_dir / f"{name}.{part}.npy", lambda fh, array=array: np.save(fh, array))
+        else:
+            _replace_atomic(store_dir / f"{name}.npy",
+                            lambda fh, matrix=matrix: np.save(fh, np.asarray(matrix, dtype=np.float32)))
+    meta = json.dumps({"key": key, "all_nodes": list(map(str, all_nodes)), "sparse": sparse_fill})
+    _replace_atomic(sidecar, lambda fh: fh.write(meta.encode("utf-8")))
+    print(f"💾 Đã lưu kho ma trận chi phí: {store_dir}")
+
+
+def load_matrix_store(store_dir, key=None, mmap=True):
+    """
+    Đọc kho ma trận của save_matrix_store. Với mmap=True, ma trận được mở bằng
+    np.load(mmap_mode="r") nên nhiều process dùng chung một bản trong page cache của OS.
+    Trả về (time_matrix, distance_matrix, all_nodes), hoặc None nếu chưa có hay khóa không khớp.
+    """
+    store_dir = Path(store_dir)
+    sidecar = store_dir / "nodes.json"
+    if not sidecar.exists():
+        return None
+    with open(sidecar, encoding="utf-8") as fh:
+        meta = json.load(fh)
+    if key is not None and meta.get("key") != key:
+        return None
+    mode = "r" if mmap else None
+    num_nodes = len(meta["all_nodes"])
+    sparse_fill = meta.get("sparse") or {}
+    matrices = []
+    for name in ("time", "distance"):
+        if name in sparse_fill:
+            matrices.append(SparseCostMatrix(num_nodes, np.load(store_dir / f"{name}.keys.npy", mmap_mode=mode),
+                                             np.load(store_dir / f"{name}.values.npy", mmap_mode=mode),
+                                             sparse_fill[name]))
+        else:
+            matrices.append(np.load(store_dir / f"{name}.npy", mmap_mode=mode))
+    return matrices[0], matrices[1], meta["all_nodes"]
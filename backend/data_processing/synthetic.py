@@ -0,0 +1,165 @@
+# synthetic.py
+"""
+Sinh bộ dữ liệu VRPTW giả lập theo đúng schema mà load_data đọc (customers/depots/vehicles
+dạng xlsx + roads/roads_Dxxx_Dyyy/roads_Dxxx_k.csv), dùng cho benchmark ở nhiều kích thước.
+"""
+from pathlib import Path
+import os
+
+import numpy as np
+import pandas as pd
+
+# Tâm và bán kính (độ) vùng phục vụ giả lập (quanh Cần Thơ)
+CENTER_LAT, CENTER_LON = 10.03, 105.77
+RADIUS_DEG = 0.15
+
+# Vehicle_Type -> (Capacity_Weight, Capacity_Volume, Fixed_Cost, Variable_Cost, Max_Distance)
+VEHICLE_SPECS = {
+    "Bike": (30, 0.3, 9.5, 0.04, 40),
+    "Motorbike": (80, 0.6, 12.0, 0.08, 150),
+    "Cargo Trike": (200, 1.5, 20.0, 0.12, 80),
+    "EV Van": (800, 8.0, 45.0, 0.15, 200),
+    "Van": (1100, 14.0, 58.0, 0.27, 290),
+}
+
+# Tốc độ trung bình (km/h) theo Traffic_Level và tỉ lệ xuất hiện
+TRAFFIC_SPEEDS = {"Low": 35.0, "Medium": 25.0, "High": 15.0}
+TRAFFIC_SHARES = (0.4, 0.4, 0.2)
+# Tỉ lệ Road_Restrictions giống dữ liệu thật (~10% mỗi loại)
+RESTRICTION_SHARES = {"No Heavy Trucks": 0.1, "One-Way": 0.1}
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+def _random_points(rng, n):
+    radius = RADIUS_DEG * np.sqrt(rng.random(n))
+    angle = rng.random(n) * 2 * np.pi
+    return CENTER_LAT + radius * np.sin(angle), CENTER_LON + radius * np.cos(angle)
+
+
+def _road_frame(rng, origin_ids, dest_ids, distance_km):
+    """Bảng road cho các cặp (origin, dest) với quãng đường đã tính (có hệ số đường vòng)."""
+    n = len(origin_ids)
+    distance_km = np.round(distance_km * 1.3 + 0.2, 3)
+    traffic = rng.choice(list(TRAFFIC_SPEEDS), size=n, p=TRAFFIC_SHARES)
+    speed = pd.Series(traffic).map(TRAFFIC_SPEEDS).to_numpy()
+    restriction = np.full(n, None, dtype=object)
+    draw = rng.random(n)
+    low = 0.0
+    for label, share in RESTRICTION_SHARES.items():
+        restriction[(draw >= low) & (draw < low + share)] = label
+        low += share
+    return pd.DataFrame({
+        "Origin_Node_ID": origin_ids,
+        "Destination_Node_ID": dest_ids,
+        "Distance_km": distance_km,
+        "Travel_Time_min": np.round(distance_km / speed * 60.0, 1),
+        "Traffic_Level": traffic,
+        "Road_Restrictions": restriction,
+    })
+
+
+def generate_instance(out_dir, num_customers, num_depots=None, num_vehicles=None,
+                      customer_neighbors=8, seed=0):
+    """
+    Ghi một bộ dữ liệu giả lập vào out_dir (dùng làm base_dir của load_data):
+    - num_depots: mặc định max(2, num_customers // 2000); depot ID dạng D001_1, D001_2, ...
+    - num_vehicles: mặc định max(num_depots, num_customers // 20), loại xe ngẫu nhiên theo VEHICLE_SPECS
+    - roads: mỗi depot nối tới mọi khách hàng (giống dữ liệu gốc), thêm customer_neighbors
+      cung tới các khách hàng gần nhất để lộ trình có thể đi qua nhiều điểm
+    Trả về dict thống kê số dòng của từng bảng.
+    """
+    out_dir = Path(out_dir)
+    rng = np.random.default_rng(seed)
+    num_depots = num_depots or max(2, num_customers // 2000)
+    num_vehicles = num_vehicles or max(num_depots, num_customers // 20)
+
+    # --- Depots: mỗi nhóm 5 depot có chung tiền tố D00x như dữ liệu gốc ---
+    depot_ids = [f"D{g // 5 + 1:03d}_{g % 5 + 1}" for g in range(num_depots)]
+    depot_lat, depot_lon = _random_points(rng, num_depots)
+    df_depots = pd.DataFrame({
+        "Depot_ID": depot_ids,
+        "City": "Synthetic",
+        "Latitude": depot_lat,
+        "Longitude": depot_lon,
+        "Capacity_Storage": rng.integers(2000, 10000, num_depots),
+        "Operating_Hours": "06:00-22:00",
+    })
+
+    # --- Customers ---
+    customer_ids = [f"C{i + 1:06d}" for i in range(num_customers)]
+    cust_lat, cust_lon = _random_points(rng, num_customers)
+    start_min = rng.integers(14, 33, num_customers) * 30          # 07:00 .. 16:00
+    end_min = np.minimum(start_min + rng.integers(4, 9, num_customers) * 30, 22 * 60)
+    df_customers = pd.DataFrame({
+        "Customer_ID": customer_ids,
+        "Latitude": cust_lat,
+        "Longitude": cust_lon,
+        "City": "Synthetic",
+        "Order_Weight": np.round(rng.gamma(2.0, 8.0, num_customers), 2),
+        "Order_Volume": np.round(rng.gamma(2.0, 0.03, num_customers), 3),
+        "Time_Window_Start": [f"{m // 60:02d}:{m % 60:02d}" for m in start_min],
+        "Time_Window_End": [f"{m // 60:02d}:{m % 60:02d}" for m in end_min],
+        "Service_Time": rng.choice([5, 10, 15], num_customers),
+        "Priority_Level": rng.integers(1, 4, num_customers),
+        "Delivery_Type": "Home",
+        "Return_Flag": rng.random(num_customers) < 0.1,
+    })
+
+    # --- Vehicles ---
+    types = rng.choice(list(VEHICLE_SPECS), size=num_vehicles)
+    specs = np.array([VEHICLE_SPECS[t] for t in types])
+    home = rng.integers(0, num_depots, num_vehicles)
+    df_vehicles = pd.DataFrame({
+        "Vehicle_ID": [f"V{i + 1:04d}" for i in range(num_vehicles)],
+        "Vehicle_Type": types,
+        "Capacity_Weight": specs[:, 0].astype(int),
+        "Capacity_Volume": specs[:, 1],
+        "Fixed_Cost": specs[:, 2],
+        "Variable_Cost": specs[:, 3],
+        "Max_Distance": specs[:, 4].astype(int),
+        "Max_Working_Hours": 8,
+        "Start_Depot_ID": [depot_ids[h] for h in home],
+        "End_Depot_ID": [depot_ids[h] for h in home],
+    })
+
+    os.makedirs(out_dir, exist_ok=True)
+    df_customers.to_excel(out_dir / "customers_vietnam.xlsx", index=False)
+    df_depots.to_excel(out_dir / "depots_vietnam.xlsx", index=False)
+    df_vehicles.to_excel(out_dir / "vehicles_vietnam.xlsx", index=False)
+
+    # --- Roads: depot -> mọi khách hàng, ghi theo file của từng depot ---
+    num_roads = 0
+    customer_ids = np.asarray(customer_ids, dtype=object)
+    neighbor_frame = None
+    if customer_neighbors and num_customers > 1:
+        from scipy.spatial import cKDTree
+
+        k = min(customer_neighbors, num_customers - 1)
+        _, nearest = cKDTree(np.column_stack([cust_lat, cust_lon])).query(
+            np.column_stack([cust_lat, cust_lon]), k=k + 1
+        )
+        origin = np.repeat(np.arange(num_customers), k)
+        dest = nearest[:, 1:].ravel()
+        neighbor_frame = _road_frame(rng, customer_ids[origin], customer_ids[dest],
+                                     _haversine_km(cust_lat[origin], cust_lon[origin], cust_lat[dest], cust_lon[dest]))
+
+    for d, depot_id in enumerate(depot_ids):
+        group = d // 5 // 2 * 2 + 1
+        folder = out_dir / "roads" / f"roads_D{group:03d}_D{group + 1:03d}"
+        os.makedirs(folder, exist_ok=True)
+        df_roads = _road_frame(rng, np.full(num_customers, depot_id, dtype=object), customer_ids,
+                               _haversine_km(depot_lat[d], depot_lon[d], cust_lat, cust_lon))
+        if neighbor_frame is not None:
+            # Cung giữa các khách hàng được chia đều vào file của các depot
+            df_roads = pd.concat([df_roads, neighbor_frame.iloc[d::num_depots]], ignore_index=True)
+        df_roads.to_csv(folder / f"roads_{depot_id}.csv", index=False)
+        num_roads += len(df_roads)
+
+    print(f"🧪 Đã sinh dữ liệu giả lập: {num_customers:,} customers, {num_depots} depots, "
+          f"{num_vehicles} vehicles, {num_roads:,} cung đường -> {out_dir}")
+    return {"customers": num_customers, "depots": num_depots, "vehicles": num_vehicles, "roads": num_roads}
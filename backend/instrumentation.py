@@ -0,0 +1,179 @@
+# instrumentation.py
+"""
+Đo thời gian và bộ nhớ theo từng bước của pipeline, ghi ra log JSON lines (mỗi dòng một bản ghi).
+- stage(name): context manager đo wall/CPU time, RSS tăng thêm trong bước (rss_delta_mb), đỉnh RSS
+  của cả process tới cuối bước (process_peak_rss_mb) và (tùy chọn) đỉnh tracemalloc của bước
+- timed(name): decorator tương đương cho cả một hàm
+- record(name, **fields): ghi một bản ghi tùy ý (vd. bộ đếm của solver)
+Mặc định tắt hoàn toàn (chỉ tốn một phép kiểm tra); bật bằng configure(...) hoặc biến môi trường
+(bất kỳ tùy chọn nào dưới đây cũng bật đo đạc):
+  LASTMILE_METRICS_LOG=<file.jsonl>, LASTMILE_TRACE_MEMORY=1, LASTMILE_PROFILE_DIR=<thư mục .prof>,
+  LASTMILE_SLOW_STAGE_S=<giây> (bước chạy lâu hơn được đánh dấu "slow" và cảnh báo qua logging).
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+_config = {
+    "log_path": os.environ.get("LASTMILE_METRICS_LOG") or None,
+    "trace_memory": os.environ.get("LASTMILE_TRACE_MEMORY", "") not in ("", "0"),
+    "profile_dir": os.environ.get("LASTMILE_PROFILE_DIR") or None,
+    "slow_stage_s": float(os.environ["LASTMILE_SLOW_STAGE_S"]) if os.environ.get("LASTMILE_SLOW_STAGE_S") else None,
+}
+if _config["trace_memory"] and not tracemalloc.is_tracing():
+    tracemalloc.start()
+_run_id = uuid.uuid4().hex[:12]
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def configure(log_path=None, trace_memory=None, profile_dir=None, slow_stage_s=None):
+    """Bật/đổi cấu hình đo đạc (tham số None = giữ nguyên). log_path=False để tắt ghi log."""
+    for key, value in (("log_path", log_path), ("trace_memory", trace_memory),
+                       ("profile_dir", profile_dir), ("slow_stage_s", slow_stage_s)):
+        if value is not None:
+            _config[key] = value or None if key == "log_path" else value
+    if _config["trace_memory"] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def enabled():
+    return bool(_config["log_path"] or _config["profile_dir"] or _config["trace_memory"]
+                or _config["slow_stage_s"] is not None)
+
+
+def process_peak_rss_mb():
+    """
+    Đỉnh bộ nhớ thường trú (RSS) của cả process từ lúc khởi động (ru_maxrss), MB (None nếu không hỗ trợ).
+    Đây không phải đỉnh của riêng một bước: xem rss_delta_mb / tracemalloc_peak_mb trong stage().
+    """
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def current_rss_mb():
+    """RSS hiện tại của process, MB (đọc /proc/self/statm; None nếu không có, vd. macOS/Windows)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def record(name, **fields):
+    """Ghi một bản ghi JSON (kèm run_id, pid, thời điểm) vào log nếu đang bật."""
+    if not _config["log_path"]:
+        return
+    entry = {"ts": datetime.now().isoformat(timespec="milliseconds"), "run_id": _run_id,
+             "pid": os.getpid(), "name": name, **fields}
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    with _write_lock:
+        Path(_config["log_path"]).parent.mkdir(parents=True, exist_ok=True)
+        with open(_config["log_path"], "a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Đo một bước: yield dict fields để bổ sung số liệu trước khi kết thúc (vd. fields["rows"] = n).
+    Bước lồng nhau được đặt tên dạng "cha/con". Khi có profile_dir, bước được chạy dưới cProfile
+    và thống kê được ghi ra <profile_dir>/<tên bước>.prof.
+    """
+    if not enabled():
+        yield fields
+        return
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+        _local.peaks = []
+    peaks = _local.peaks
+    full_name = "/".join(stack + [name])
+    tracing = _config["trace_memory"] and tracemalloc.is_tracing()
+    if tracing:
+        # Giữ lại đỉnh hiện tại của bước cha trước khi reset cho bước này
+        if peaks:
+            peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    stack.append(name)
+    peaks.append(0)
+
+    profiler = None
+    if _config["profile_dir"] and len(stack) == 1:
+        profiler = cProfile.Profile()
+    rss0 = current_rss_mb()
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    status = "ok"
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield fields
+    except BaseException as e:
+        status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        stack.pop()
+        child_peak = peaks.pop()
+        wall = time.perf_counter() - wall0
+        metrics = {
+            "stage": full_name,
+            "status": status,
+            "wall_s": round(wall, 4),
+            "cpu_s": round(time.process_time() - cpu0, 4),
+            "process_peak_rss_mb": process_peak_rss_mb(),
+        }
+        rss1 = current_rss_mb()
+        if rss0 is not None and rss1 is not None:
+            metrics["rss_delta_mb"] = round(rss1 - rss0, 1)
+        if tracing:
+            # Bước con gọi reset_peak nên đỉnh = max(đỉnh hiện tại, đỉnh đã lưu trước/trong các bước con)
+            peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+            metrics["tracemalloc_peak_mb"] = round(peak / 2**20, 1)
+            if not _config["log_path"]:
+                logger.info("Bước %s: đỉnh tracemalloc %.1f MB", full_name, metrics["tracemalloc_peak_mb"])
+        slow = _config["slow_stage_s"]
+        if slow is not None and wall > slow:
+            metrics["slow"] = True
+            logger.warning("Bước %s chạy %.1fs (ngưỡng %.1fs)", full_name, wall, slow)
+        if profiler is not None:
+            os.makedirs(_config["profile_dir"], exist_ok=True)
+            prof_path = Path(_config["profile_dir"]) / f"{full_name.replace('/', '.')}.{os.getpid()}.prof"
+            profiler.dump_stats(prof_path)
+            metrics["profile"] = str(prof_path)
+        record("stage", **metrics, **fields)
+
+
+def timed(name=None):
+    """Decorator: chạy cả hàm trong stage(name) (mặc định tên hàm)."""
+    def decorator(fn):
+        stage_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
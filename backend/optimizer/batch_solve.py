@@ -0,0 +1,220 @@
+# batch_solve.py
+"""
+Giải song song nhiều thành phố: mỗi folder trong data/process là một bài toán VRPTW độc lập,
+được giải trong một process riêng rồi gộp kết quả vào một bản tổng kết.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import json
+import math
+import os
+import time
+
+from backend.data_processing.data import DEFAULT_PROCESS_DIR, read_city_table
+from backend.optimizer.decompose import solve_decomposed
+from backend.optimizer.solve_vrp_ortools import MAX_TRANSIT_MEMORY_MB, build_problem, solve, transit_memory_mb
+
+
+def list_city_folders(process_dir=None):
+    """Danh sách tên thành phố (folder con của process_dir có file customers)."""
+    process_dir = Path(process_dir) if process_dir is not None else DEFAULT_PROCESS_DIR
+    cities = []
+    for folder in sorted(process_dir.iterdir()):
+        if folder.is_dir() and any((folder / f"customers.{ext}").exists() for ext in ("parquet", "xlsx")):
+            cities.append(folder.name)
+    return cities
+
+
+def _table_rows(folder, name):
+    """Số dòng của bảng <name> trong folder thành phố (parquet chỉ đọc metadata); None nếu không có file."""
+    parquet_file = folder / f"{name}.parquet"
+    if parquet_file.exists():
+        import pyarrow.parquet as pq
+
+        return pq.read_metadata(parquet_file).num_rows
+    df = read_city_table(folder, name)
+    return None if df is None else len(df)
+
+
+def empty_city_reason(process_dir, city):
+    """Lý do thành phố không thể giải (thiếu/rỗng customers, depots, vehicles hoặc roads), None nếu đủ dữ liệu."""
+    folder = Path(process_dir) / city
+    for name in ("customers", "depots", "vehicles", "roads"):
+        try:
+            rows = _table_rows(folder, name)
+        except Exception as e:
+            return f"không đọc được {name}: {type(e).__name__}: {e}"
+        if not rows:
+            return f"không có dữ liệu {name}"
+    return None
+
+
+def _city_size(process_dir, city):
+    """Ước lượng kích thước bài toán theo dung lượng file customers + roads (để xếp lịch)."""
+    folder = Path(process_dir) / city
+    return sum(f.stat().st_size for f in folder.iterdir() if f.stem in ("customers", "roads"))
+
+
+def _solve_city(city, process_dir, time_limit, matrix_store=None, knn=None, decompose=None):
+    """
+    Hàm chạy trong worker process: giải một thành phố và trả về kết quả dạng dict.
+    decompose=None: tự chọn — thành phố có transit N×N vượt MAX_TRANSIT_MEMORY_MB được giải bằng
+    solve_decomposed (chia cụm theo depot, mỗi cụm đủ nhỏ để transit nằm trong giới hạn),
+    còn lại giải nguyên bài toán bằng solve.
+    """
+    t0 = time.perf_counter()
+    mode = None
+    try:
+        data = build_problem(city=city, process_dir=process_dir, knn=knn, matrix_store=matrix_store)
+        transit_mb = transit_memory_mb(data)
+        if decompose is None:
+            decompose = transit_mb > MAX_TRANSIT_MEMORY_MB
+        mode = "decomposed" if decompose else "single"
+        if decompose:
+            # Transit tỉ lệ N²: cụm có ~N·sqrt(giới hạn/ước tính) node (trừ các depot) vừa giới hạn
+            max_cluster_size = None
+            if transit_mb > MAX_TRANSIT_MEMORY_MB:
+                num_depots = len(set(data["starts"].tolist()))
+                max_cluster_size = max(1, int(data["num_nodes"] * math.sqrt(MAX_TRANSIT_MEMORY_MB / transit_mb))
+                                       - num_depots)
+            # Các thành phố đã chạy song song nên mỗi thành phố giải tuần tự các cụm của mình
+            result = solve_decomposed(data=data, time_limit=time_limit, max_cluster_size=max_cluster_size,
+                                      max_workers=1, verbose=False)
+        else:
+            result = solve(data=data, time_limit=time_limit, verbose=False)
+        status = "ok" if result is not None else "no_solution"
+        error = None
+    except Exception as e:
+        result = None
+        status = "error"
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "city": city,
+        "status": status,
+        "mode": mode,
+        "error": error,
+        "time_limit_s": time_limit,
+        "wall_time_s": round(time.perf_counter() - t0, 3),
+        "result": result,
+    }
+
+
+def solve_all_cities(process_dir=None, cities=None, time_limit=180, city_time_limits=None,
+                     max_workers=None, summary_path=None, matrix_store_dir=None, knn=None, decompose=None):
+    """
+    Giải tất cả thành phố trong process_dir, mỗi thành phố một worker process.
+    - time_limit: giới hạn mặc định (giây) cho mỗi thành phố
+    - city_time_limits: {city: giây} để ghi đè giới hạn cho từng thành phố
+    - max_workers: số process chạy đồng thời (mặc định = số CPU)
+    - summary_path: nếu có, ghi bản tổng kết ra file JSON
+    - matrix_store_dir: nếu có, ma trận chi phí của mỗi thành phố được lưu/mở (memory-map)
+      tại matrix_store_dir/<city> để các lần chạy sau dùng lại
+    - knn: chỉ giữ k cung gần nhất mỗi khách hàng (xem build_problem)
+    - decompose: True/False để ép chia cụm/giải nguyên; None = chia cụm khi transit quá lớn
+    Thành phố lớn được đưa vào hàng đợi trước để tổng thời gian gần bằng thành phố lớn nhất.
+    """
+    process_dir = Path(process_dir) if process_dir is not None else DEFAULT_PROCESS_DIR
+    cities = list(cities) if cities is not None else list_city_folders(process_dir)
+    city_time_limits = city_time_limits or {}
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if not cities:
+        print(f"❌ Không tìm thấy thành phố nào trong: {process_dir}")
+        return None
+
+    # Thành phố thiếu dữ liệu được ghi nhận là "skipped" thay vì gửi sang worker rồi lỗi
+    t0 = time.perf_counter()
+    city_results = {}
+    for city in cities:
+        reason = empty_city_reason(process_dir, city)
+        if reason is not None:
+            print(f"   - ⚠️ {city}: bỏ qua ({reason})")
+            city_results[city] = {"city": city, "status": "skipped", "mode": None, "error": reason,
+                                  "time_limit_s": None, "wall_time_s": 0.0, "result": None}
+    to_solve = [city for city in cities if city not in city_results]
+
+    to_solve.sort(key=lambda c: _city_size(process_dir, c), reverse=True)
+    print(f"🏙️ Giải {len(to_solve)} thành phố với tối đa {max_workers} process song song...")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _solve_city, city, str(process_dir), city_time_limits.get(city, time_limit),
+                str(Path(matrix_store_dir) / city) if matrix_store_dir is not None else None,
+                knn, decompose,
+            ): city
+            for city in to_solve
+        }
+        for future in as_completed(futures):
+            try:
+                item = future.result()
+            except Exception as e:
+                # Worker chết giữa chừng (vd. hết bộ nhớ): ghi nhận lỗi cho thành phố đó
+                city = futures[future]
+                item = {"city": city, "status": "error", "mode": None, "error": f"{type(e).__name__}: {e}",
+                        "time_limit_s": city_time_limits.get(city, time_limit),
+                        "wall_time_s": round(time.perf_counter() - t0, 3), "result": None}
+            city_results[item["city"]] = item
+            mode = f", {item['mode']}" if item["mode"] else ""
+            print(f"   - {'✅' if item['status'] == 'ok' else '⚠️'} {item['city']}: {item['status']} "
+                  f"({item['wall_time_s']:.1f}s{mode})")
+
+    solved = [r["result"] for r in city_results.values() if r["result"] is not None]
+    summary = {
+        "process_dir": str(process_dir),
+        "wall_time_s": round(time.perf_counter() - t0, 3),
+        "num_cities": len(cities),
+        "num_solved": len(solved),
+        "total_distance_km": sum(r["total_distance_km"] for r in solved),
+        "total_time_min": sum(r["total_time_min"] for r in solved),
+        "total_cost": sum(r["total_cost"] for r in solved),
+        "total_unserved": sum(len(r["unserved_customers"]) for r in solved),
+        "cities": {city: city_results[city] for city in cities},
+    }
+
+    print("\n--- TỔNG KẾT TOÀN QUỐC ---")
+    print(f"Số thành phố giải được: {summary['num_solved']} / {summary['num_cities']}")
+    print(f"Tổng chi phí ước tính: {summary['total_cost']:.2f}")
+    print(f"Số khách hàng chưa phục vụ: {summary['total_unserved']}")
+    print(f"Tổng thời gian chạy: {summary['wall_time_s']:.1f}s")
+
+    if summary_path is not None:
+        with open(summary_path, "w", encoding="utf-8") as fh:
+            json.dump(summary, fh, ensure_ascii=False, indent=2, default=str)
+        print(f"💾 Đã lưu tổng kết vào: {summary_path}")
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Giải VRPTW song song cho tất cả thành phố trong data/process")
+    parser.add_argument("--process-dir", help="Thư mục chứa các folder thành phố (mặc định data/process)")
+    parser.add_argument("--cities", nargs="*", help="Chỉ giải các thành phố này")
+    parser.add_argument("--time-limit", type=int, default=180, help="Giới hạn thời gian mặc định mỗi thành phố (giây)")
+    parser.add_argument("--city-time-limit", action="append", default=[], metavar="CITY=SECONDS",
+                        help="Ghi đè giới hạn thời gian cho một thành phố, có thể lặp lại")
+    parser.add_argument("--workers", type=int, help="Số process song song (mặc định = số CPU)")
+    parser.add_argument("--summary", help="Đường dẫn file JSON tổng kết")
+    parser.add_argument("--matrix-store-dir", help="Thư mục gốc kho ma trận .npy theo thành phố")
+    parser.add_argument("--knn", type=int, help="Chỉ giữ k cung gần nhất mỗi khách hàng")
+    parser.add_argument("--decompose", action=argparse.BooleanOptionalAction, default=None,
+                        help="Ép chia cụm theo depot (--no-decompose để giải nguyên); mặc định tự chọn "
+                             "theo LASTMILE_MAX_TRANSIT_MB")
+    args = parser.parse_args()
+
+    overrides = {}
+    for item in args.city_time_limit:
+        city, _, seconds = item.partition("=")
+        overrides[city] = int(seconds)
+    solve_all_cities(
+        process_dir=args.process_dir,
+        cities=args.cities,
+        time_limit=args.time_limit,
+        city_time_limits=overrides,
+        max_workers=args.workers,
+        summary_path=args.summary,
+        matrix_store_dir=args.matrix_store_dir,
+        knn=args.knn,
+        decompose=args.decompose,
+    )
@@ -0,0 +1,183 @@
+# benchmark.py
+"""
+Benchmark hiệu năng pipeline trên dữ liệu giả lập (backend/data_processing/synthetic.py):
+đo riêng từng bước load_data (lần đầu và từ cache), build_cost_matrices (kèm k-láng giềng /
+đường đi ngắn nhất nếu bật), build_problem, solve
+ở nhiều kích thước, ghi kết quả vào file JSON lịch sử và so sánh với lần chạy trước.
+"""
+from datetime import datetime
+from pathlib import Path
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+
+import numpy as np
+
+from backend.data_processing.data import build_cost_matrices, build_knn_neighbors, complete_cost_matrices, load_data
+from backend.data_processing.synthetic import generate_instance
+from backend.optimizer.solve_vrp_ortools import build_problem, solve
+
+# Kích thước mặc định: chạy hết trên máy thường. Kích thước lớn (vượt giới hạn bộ nhớ ma trận transit
+# của build_routing_model với một bài toán) chỉ chạy khi yêu cầu rõ (--large hoặc --sizes)
+BENCHMARK_SIZES = (100, 1_000, 5_000)
+LARGE_BENCHMARK_SIZES = (20_000,)
+DEFAULT_WORK_DIR = Path(__file__).resolve().parents[2] / "data" / "benchmark"
+DEFAULT_HISTORY = DEFAULT_WORK_DIR / "history.json"
+
+
+def _timed(stages, name, fn, *args, **kwargs):
+    """Chạy fn, ghi thời gian (giây) vào stages[name]; lỗi được ghi lại thay vì dừng cả benchmark."""
+    t0 = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        stages[f"{name}_error"] = f"{type(e).__name__}: {e}"
+        return None
+    finally:
+        stages[name] = round(time.perf_counter() - t0, 3)
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).resolve().parent, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def benchmark_instance(base_dir, time_limit=30, knn=None, complete_paths=False):
+    """
+    Đo các bước trên bộ dữ liệu trong base_dir. Trả về dict stages (giây) và chất lượng nghiệm.
+    Các bước dựng ma trận giống build_problem: build_cost_matrices, rồi complete_cost_matrices
+    (complete_paths, không dùng cache) và build_knn_neighbors (knn) nếu được bật.
+    """
+    shutil.rmtree(Path(base_dir) / "processed", ignore_errors=True)
+    stages = {}
+    frames = _timed(stages, "load_data", load_data, base_dir=base_dir)
+    _timed(stages, "load_data_cached", load_data, base_dir=base_dir)
+    if frames is not None:
+        df_customers, df_depots, _, df_roads_full = frames
+        matrices = _timed(stages, "build_cost_matrices", build_cost_matrices, df_roads_full, df_depots, df_customers)
+        if matrices is not None and complete_paths:
+            completed = _timed(stages, "complete_cost_matrices", complete_cost_matrices, *matrices[:2])
+            matrices = None if completed is None else (*completed, matrices[2])
+        if matrices is not None and knn:
+            customer_nodes = np.arange(len(df_depots), len(matrices[2]))
+            _timed(stages, "build_knn_neighbors", build_knn_neighbors, matrices[0], knn, customer_nodes)
+        del matrices
+    data = _timed(stages, "build_problem", build_problem, base_dir=base_dir, knn=knn, complete_paths=complete_paths)
+    result = None
+    if data is not None:
+        result = _timed(stages, "solve", solve, data=data, time_limit=time_limit, verbose=False)
+
+    record = {"stages": stages, "objective": None, "total_cost": None, "served": None, "unserved": None}
+    if result is not None:
+        num_customers = data["num_customers"]
+        record.update({
+            "objective": result["objective"],
+            "total_cost": round(result["total_cost"], 3),
+            "served": num_customers - len(result["unserved_customers"]),
+            "unserved": len(result["unserved_customers"]),
+            "vehicles_used": len(result["routes"]),
+        })
+    return record
+
+
+def _previous_run(history, size, label):
+    for run in reversed(history):
+        if run.get("label") == label:
+            for item in run["results"]:
+                if item["size"] == size:
+                    return item
+    return None
+
+
+def _print_comparison(item, previous):
+    """In thời gian từng bước, kèm tỉ lệ so với lần chạy trước (nếu có)."""
+    print(f"\n📊 {item['size']:,} khách hàng: phục vụ {item['served']}, chi phí {item['total_cost']}")
+    for stage, seconds in item["stages"].items():
+        if stage.endswith("_error"):
+            print(f"   ⚠️ {stage}: {seconds}")
+            continue
+        line = f"   - {stage}: {seconds:.3f}s"
+        before = (previous or {}).get("stages", {}).get(stage)
+        if isinstance(before, (int, float)) and before > 0:
+            ratio = seconds / before
+            line += f" (x{ratio:.2f} so với lần trước{' ⚠️' if ratio > 1.2 else ''})"
+        print(line)
+
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, work_dir=None, history_path=None, time_limit=30, knn=None,
+                   complete_paths=False, seed=0, label="default", keep_data=True):
+    """
+    Sinh (nếu chưa có) dữ liệu giả lập cho từng kích thước trong work_dir/synthetic_<n>,
+    đo các bước và ghi thêm một lần chạy vào history_path (JSON list).
+    - label: tên cấu hình để so sánh với lần chạy trước cùng label (vd. "knn16")
+    - keep_data=False: xóa dữ liệu giả lập sau khi đo
+    """
+    work_dir = Path(work_dir) if work_dir is not None else DEFAULT_WORK_DIR
+    history_path = Path(history_path) if history_path is not None else work_dir / "history.json"
+    history = []
+    if history_path.exists():
+        with open(history_path, encoding="utf-8") as fh:
+            history = json.load(fh)
+
+    run = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "label": label,
+        "commit": _git_commit(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "params": {"time_limit": time_limit, "knn": knn, "complete_paths": complete_paths, "seed": seed},
+        "results": [],
+    }
+    for size in sizes:
+        base_dir = work_dir / f"synthetic_{size}_seed{seed}"
+        if not (base_dir / "customers_vietnam.xlsx").exists():
+            generate_instance(base_dir, size, seed=seed)
+        item = {"size": size, **benchmark_instance(base_dir, time_limit=time_limit, knn=knn, complete_paths=complete_paths)}
+        item["wall_time_s"] = round(sum(v for k, v in item["stages"].items() if not k.endswith("_error")), 3)
+        run["results"].append(item)
+        _print_comparison(item, _previous_run(history, size, label))
+        if not keep_data:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    history.append(run)
+    os.makedirs(history_path.parent, exist_ok=True)
+    with open(history_path, "w", encoding="utf-8") as fh:
+        json.dump(history, fh, ensure_ascii=False, indent=2, default=str)
+    print(f"💾 Đã ghi kết quả benchmark vào: {history_path}")
+    return run
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark pipeline VRPTW trên dữ liệu giả lập")
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(BENCHMARK_SIZES), help="Số khách hàng")
+    parser.add_argument("--large", action="store_true",
+                        help=f"Chạy thêm các kích thước lớn {list(LARGE_BENCHMARK_SIZES)} (cần nhiều RAM)")
+    parser.add_argument("--work-dir", help="Thư mục chứa dữ liệu giả lập (mặc định data/benchmark, không commit)")
+    parser.add_argument("--history", help="File JSON lịch sử (mặc định <work-dir>/history.json)")
+    parser.add_argument("--time-limit", type=int, default=30, help="Giới hạn thời gian solve (giây)")
+    parser.add_argument("--knn", type=int, help="Truyền knn cho build_problem")
+    parser.add_argument("--complete-paths", action="store_true", help="Điền cặp thiếu cung bằng đường đi ngắn nhất")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="default", help="Tên cấu hình để so sánh giữa các lần chạy")
+    parser.add_argument("--no-keep-data", action="store_true", help="Xóa dữ liệu giả lập sau khi đo")
+    args = parser.parse_args()
+    sizes = args.sizes + [n for n in LARGE_BENCHMARK_SIZES if args.large and n not in args.sizes]
+    run_benchmarks(
+        sizes=sizes,
+        work_dir=args.work_dir,
+        history_path=args.history,
+        time_limit=args.time_limit,
+        knn=args.knn,
+        complete_paths=args.complete_paths,
+        seed=args.seed,
+        label=args.label,
+        keep_data=not args.no_keep_data,
+    )
@@ -0,0 +1,166 @@
+# decompose.py
+"""
+Chia bài toán VRPTW lớn (vd. Hà Nội) thành các cụm theo depot, giải các cụm song song
+như các bài toán con độc lập, sau đó chạy một lượt sửa (repair) ngắn cho khách hàng
+còn sót bằng các xe chưa dùng ở bất kỳ cụm nào.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+import time
+
+import numpy as np
+
+from backend.optimizer.evaluate import evaluate_plan
+from backend.optimizer.solve_vrp_ortools import build_problem, solve, subset_problem
+
+
+def cluster_customers(data, max_cluster_size=None):
+    """
+    Gán mỗi khách hàng cho depot xuất phát gần nhất (theo ma trận thời gian) và gom các xe
+    theo depot xuất phát. Cụm lớn hơn max_cluster_size được chia tiếp theo góc quét quanh
+    depot (sweep), số xe chia đều cho các cụm con.
+    Trả về danh sách (mảng node khách hàng, danh sách chỉ số xe).
+    """
+    starts = np.asarray(data["starts"])
+    depot_nodes = np.unique(starts)
+    customer_nodes = np.array(
+        [i for i, node in enumerate(data["all_nodes"]) if str(node).startswith("C")], dtype=np.int64
+    )
+    if len(customer_nodes) == 0 or len(depot_nodes) == 0:
+        return []
+
+    nearest = depot_nodes[data["time_matrix"][np.ix_(depot_nodes, customer_nodes)].argmin(axis=0)]
+    coords = data["coordinates"]
+
+    clusters = []
+    for depot in depot_nodes:
+        customers = customer_nodes[nearest == depot]
+        vehicles = [int(v) for v in np.flatnonzero(starts == depot)]
+        if len(customers) == 0:
+            continue
+
+        parts = 1
+        if max_cluster_size:
+            parts = min(math.ceil(len(customers) / max_cluster_size), len(vehicles))
+        if parts <= 1:
+            clusters.append((customers, vehicles))
+            continue
+
+        # Sắp khách hàng theo góc quanh depot (hoặc theo thời gian đi nếu thiếu tọa độ)
+        if coords is not None and not np.isnan(coords[customers]).any():
+            delta = coords[customers] - coords[depot]
+            order = np.argsort(np.arctan2(delta[:, 0], delta[:, 1]))
+        else:
+            order = np.argsort(data["time_matrix"][depot, customers])
+        vehicles.sort(key=lambda v: data["vehicle_capacities"][v], reverse=True)
+        for k, chunk in enumerate(np.array_split(customers[order], parts)):
+            clusters.append((chunk, vehicles[k::parts]))
+    return clusters
+
+
+def _solve_subproblem(sub, time_limit):
+    """Hàm chạy trong worker process: giải một bài toán con, không in lộ trình."""
+    return solve(data=sub, time_limit=time_limit, verbose=False)
+
+
+def _merge_routes(result, sub, routes):
+    """Đổi chỉ số xe cục bộ của bài toán con về chỉ số gốc và thêm vào routes."""
+    if result is None:
+        return
+    for r in result["routes"]:
+        r = dict(r)
+        r["vehicle_index"] = sub["vehicle_map"][r["vehicle_index"]]
+        routes.append(r)
+
+
+def solve_decomposed(city=None, process_dir=None, data=None, time_limit=60, max_cluster_size=None,
+                     max_workers=None, repair=True, repair_time_limit=30, verbose=True):
+    """
+    Giải VRPTW bằng cách chia cụm theo depot (xem cluster_customers) và giải song song.
+    - time_limit: giới hạn thời gian (giây) cho mỗi cụm
+    - max_cluster_size: số khách hàng tối đa mỗi cụm (None = mỗi depot một cụm)
+    - repair: sau khi gộp, giải thêm một bài toán con gồm khách hàng chưa phục vụ
+      và các xe chưa dùng (của mọi cụm), giới hạn repair_time_limit giây
+    Trả về dict cùng cấu trúc với solve().
+    """
+    t0 = time.perf_counter()
+    if data is None:
+        data = build_problem(city=city, process_dir=process_dir)
+
+    clusters = cluster_customers(data, max_cluster_size=max_cluster_size)
+    subproblems = [subset_problem(data, customers, vehicles) for customers, vehicles in clusters]
+    if verbose:
+        sizes = [len(customers) for customers, _ in clusters]
+        print(f"🧩 Chia thành {len(clusters)} cụm (khách hàng/cụm: tối đa {max(sizes, default=0)}, "
+              f"trung bình {np.mean(sizes) if sizes else 0:.0f})")
+
+    routes = []
+    max_workers = max_workers or os.cpu_count() or 1
+    if subproblems:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(subproblems))) as executor:
+            results = list(executor.map(_solve_subproblem, subproblems, [time_limit] * len(subproblems)))
+        for sub, result in zip(subproblems, results):
+            _merge_routes(result, sub, routes)
+
+    all_nodes = data["all_nodes"]
+    served = {n for r in routes for n in r["route"] if str(n).startswith("C")}
+    unserved_nodes = [i for i, node in enumerate(all_nodes) if str(node).startswith("C") and node not in served]
+
+    # --- Lượt sửa qua biên cụm: khách còn sót + xe chưa dùng ---
+    used = {r["vehicle_index"] for r in routes}
+    idle_vehicles = [v for v in range(data["num_vehicles"]) if v not in used]
+    if repair and unserved_nodes and idle_vehicles:
+        if verbose:
+            print(f"🔧 Repair: {len(unserved_nodes)} khách hàng chưa phục vụ, {len(idle_vehicles)} xe rảnh")
+        sub = subset_problem(data, unserved_nodes, idle_vehicles)
+        _merge_routes(_solve_subproblem(sub, repair_time_limit), sub, routes)
+
+    # --- Quãng đường, thời gian, chi phí trên dữ liệu gốc (cùng cách tính với solve) ---
+    routes.sort(key=lambda r: r["vehicle_index"])
+    evaluation = evaluate_plan(data, routes)
+    for i, r in enumerate(routes):
+        r["distance_m"] = int(evaluation["distance_m"][i])
+        r["time_min"] = int(evaluation["time_min"][i])
+    total_cost = evaluation["total_cost"]
+
+    result = {
+        "routes": routes,
+        "total_distance_km": evaluation["total_distance_km"],
+        "total_time_min": evaluation["total_time_min"],
+        "total_cost": total_cost,
+        "unserved_customers": evaluation["unserved_customers"],
+        "num_clusters": len(clusters),
+        "wall_time_s": round(time.perf_counter() - t0, 3),
+    }
+    if verbose:
+        print("\n--- TỔNG KẾT KẾT QUẢ (CHIA CỤM) ---")
+        print(f"Số xe được sử dụng: {len(routes)} / {data['num_vehicles']}")
+        print(f"Tổng quãng đường (km): {result['total_distance_km']:.2f}")
+        print(f"Tổng chi phí ước tính: {total_cost:.2f}")
+        print(f"Số khách hàng chưa phục vụ: {len(result['unserved_customers'])}")
+        print(f"Thời gian chạy: {result['wall_time_s']:.1f}s")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Giải VRPTW theo cụm depot, các cụm chạy song song")
+    parser.add_argument("--city", help="Tên folder thành phố trong data/process; bỏ trống = toàn quốc")
+    parser.add_argument("--process-dir", help="Thư mục chứa các folder thành phố (mặc định data/process)")
+    parser.add_argument("--time-limit", type=int, default=60, help="Giới hạn thời gian mỗi cụm (giây)")
+    parser.add_argument("--max-cluster-size", type=int, help="Số khách hàng tối đa mỗi cụm")
+    parser.add_argument("--workers", type=int, help="Số process song song (mặc định = số CPU)")
+    parser.add_argument("--no-repair", action="store_true", help="Bỏ lượt sửa qua biên cụm")
+    parser.add_argument("--repair-time-limit", type=int, default=30, help="Giới hạn thời gian lượt sửa (giây)")
+    args = parser.parse_args()
+    solve_decomposed(
+        city=args.city,
+        process_dir=args.process_dir,
+        time_limit=args.time_limit,
+        max_cluster_size=args.max_cluster_size,
+        max_workers=args.workers,
+        repair=not args.no_repair,
+        repair_time_limit=args.repair_time_limit,
+    )
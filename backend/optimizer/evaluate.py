@@ -0,0 +1,210 @@
+# evaluate.py
+"""
+Chấm điểm kế hoạch giao hàng bằng phép tra ma trận vector hóa (không cần OR-Tools):
+lộ trình là mảng chỉ số node (gồm depot xuất phát và kết thúc), mọi cung của mọi lộ trình
+được ghép thành một mảng phẳng rồi tính quãng đường, thời gian, tải trọng theo điểm dừng,
+vi phạm khung giờ / tải trọng và chi phí cùng lúc.
+Dùng cho extract_solution (nghiệm của solve) lẫn kế hoạch lập bên ngoài (file JSON cùng định dạng).
+"""
+import json
+
+import numpy as np
+
+from backend.optimizer.solve_vrp_ortools import (
+    build_problem,
+    class_cost_matrices,
+    departure_travel_times,
+)
+
+
+def routes_from_ids(data, routes):
+    """
+    Đổi kế hoạch dạng ID sang dạng chỉ số cho evaluate_routes.
+    routes: list dict {"vehicle_id", "route": [node ID, ...]} (định dạng kết quả của solve)
+    hoặc dict vehicle_id -> [node ID, ...]. Trả về (list mảng chỉ số node, list chỉ số xe).
+    """
+    if isinstance(routes, dict):
+        routes = [{"vehicle_id": vid, "route": nodes} for vid, nodes in routes.items()]
+    node_index = {node: i for i, node in enumerate(data["all_nodes"])}
+    vehicle_index = {vid: v for v, vid in enumerate(data["vehicle_ids"])}
+    index_routes, vehicles = [], []
+    for r in routes:
+        missing = [n for n in r["route"] if n not in node_index]
+        if missing or r["vehicle_id"] not in vehicle_index:
+            raise KeyError(f"Xe {r['vehicle_id']}: không có trong dữ liệu ({missing or r['vehicle_id']})")
+        index_routes.append(np.array([node_index[n] for n in r["route"]], dtype=np.int64))
+        vehicles.append(vehicle_index[r["vehicle_id"]])
+    return index_routes, vehicles
+
+
+def _leg_transits(data, origins, destinations, leg_vehicles, time_transit, distance_transit):
+    """Thời gian (phút, gồm phục vụ tại điểm đi) và quãng đường (mét) nguyên của từng cung."""
+    leg_time = np.zeros(len(origins), dtype=np.int64)
+    leg_distance = np.zeros(len(origins), dtype=np.int64)
+    leg_class = np.asarray(data["vehicle_classes"])[leg_vehicles]
+    service_times = np.asarray(data["service_times"], dtype=np.float64)
+    for c in np.unique(leg_class).tolist():
+        mask = leg_class == c
+        i, j = origins[mask], destinations[mask]
+        if time_transit is not None and distance_transit is not None:
+            # Ma trận transit của build_routing_model: kết quả khớp đúng với solver
+            leg_time[mask] = time_transit[c][i, j]
+            leg_distance[mask] = distance_transit[c][i, j]
+            continue
+        # Tra trực tiếp ma trận chi phí, cùng cách làm tròn với build_transit_matrices
+        time_matrix, distance_matrix = class_cost_matrices(data, c)
+        travel = np.asarray(time_matrix[i, j], dtype=np.float32)
+        if data.get("time_band_matrices") is not None:
+            travel = departure_travel_times(data, travel, i, j)
+        leg_time[mask] = np.rint(travel + service_times[i])
+        leg_distance[mask] = np.rint(np.asarray(distance_matrix[i, j], dtype=np.float64) * 1000.0)
+    return leg_time, leg_distance
+
+
+def evaluate_routes(data, routes, vehicles=None, time_transit=None, distance_transit=None):
+    """
+    Đánh giá mọi lộ trình cùng lúc.
+    - routes: list mảng chỉ số node (route[0] là depot xuất phát, route[-1] là depot kết thúc)
+    - vehicles: chỉ số xe của từng lộ trình (mặc định 0..len(routes)-1)
+    - time_transit / distance_transit: list ma trận transit theo lớp xe từ build_routing_model;
+      bỏ trống thì tra trực tiếp ma trận chi phí của data (kết quả giống nhau)
+    Lịch phục vụ là lịch sớm nhất: xe rời depot lúc mở cửa, đến sớm thì chờ tới đầu khung giờ.
+    Trả về dict mảng theo lộ trình (distance_m, time_min, duration_min, load_kg, volume_l,
+    overload_kg, overload_volume_l, late_min, late_stops, over_distance_km, cost), mảng theo
+    điểm dừng trong "stops" (phân đoạn bởi "offsets") và các tổng total_*, feasible.
+    """
+    vehicles = np.arange(len(routes)) if vehicles is None else np.asarray(vehicles, dtype=np.int64)
+    lengths = np.array([len(r) for r in routes], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    nodes = np.concatenate(routes).astype(np.int64) if len(routes) else np.zeros(0, dtype=np.int64)
+    route_of_stop = np.repeat(np.arange(len(routes)), lengths)
+    num_routes = len(routes)
+
+    # --- Cung: cặp điểm dừng liên tiếp trong cùng lộ trình ---
+    is_leg = np.ones(len(nodes), dtype=bool)
+    is_leg[offsets[1:] - 1] = False  # điểm cuối của lộ trình không có cung đi
+    leg_from = np.flatnonzero(is_leg)
+    leg_route = route_of_stop[leg_from]
+    leg_time, leg_distance = _leg_transits(
+        data, nodes[leg_from], nodes[leg_from + 1], vehicles[leg_route], time_transit, distance_transit
+    )
+    distance_m = np.bincount(leg_route, weights=leg_distance, minlength=num_routes).astype(np.int64)
+    time_min = np.bincount(leg_route, weights=leg_time, minlength=num_routes).astype(np.int64)
+
+    # --- Lịch phục vụ: start_p = S_p + max_{k<=p}(tw_start_k - S_k), S = thời gian cộng dồn ---
+    elapsed = np.zeros(len(nodes), dtype=np.int64)
+    elapsed[leg_from + 1] = leg_time
+    elapsed = np.cumsum(elapsed)
+    elapsed -= np.repeat(elapsed[offsets[:-1]], lengths)
+    time_windows = np.asarray(data["time_windows"], dtype=np.int64)
+    slack = time_windows[nodes, 0] - elapsed
+    # Cummax theo từng lộ trình: cộng độ lệch tăng dần theo lộ trình để các đoạn không lẫn nhau
+    shift = (int(slack.max() - slack.min()) + 1 if len(slack) else 0) * route_of_stop
+    arrival = elapsed + np.maximum.accumulate(slack + shift) - shift
+    stop_late = np.maximum(arrival - time_windows[nodes, 1], 0)
+    late_min = np.bincount(route_of_stop, weights=stop_late, minlength=num_routes).astype(np.int64)
+    late_stops = np.bincount(route_of_stop, weights=stop_late > 0, minlength=num_routes).astype(np.int64)
+    duration_min = arrival[offsets[1:] - 1] - arrival[offsets[:-1]] if num_routes else np.zeros(0, np.int64)
+
+    # --- Tải trọng: hàng còn trên xe sau mỗi điểm dừng (xuất phát với toàn bộ hàng của lộ trình) ---
+    def onboard(amounts):
+        per_stop = np.asarray(amounts, dtype=np.int64)[nodes]
+        total = np.bincount(route_of_stop, weights=per_stop, minlength=num_routes).astype(np.int64)
+        delivered = np.cumsum(per_stop)
+        delivered -= np.repeat(delivered[offsets[:-1]] - per_stop[offsets[:-1]], lengths)
+        return total, total[route_of_stop] - delivered
+
+    load_kg, stop_load = onboard(data["demands"])
+    overload_kg = np.maximum(load_kg - data["vehicle_capacities"][vehicles], 0)
+    volume_l = overload_volume_l = np.zeros(num_routes, dtype=np.int64)
+    stop_volume = np.zeros(len(nodes), dtype=np.int64)
+    if data.get("volumes") is not None:
+        volume_l, stop_volume = onboard(data["volumes"])
+        overload_volume_l = np.maximum(volume_l - data["vehicle_volume_capacities"][vehicles], 0)
+
+    # --- Chi phí: cố định + biến đổi theo km ---
+    distance_km = distance_m / 1000.0
+    over_distance_km = np.maximum(distance_km - data["vehicle_max_distance_km"][vehicles], 0.0)
+    cost = data["vehicle_fixed_costs"][vehicles] + data["vehicle_variable_costs"][vehicles] * distance_km
+
+    return {
+        "vehicle_index": vehicles,
+        "distance_m": distance_m,
+        "time_min": time_min,
+        "duration_min": duration_min,
+        "load_kg": load_kg,
+        "volume_l": volume_l,
+        "overload_kg": overload_kg,
+        "overload_volume_l": overload_volume_l,
+        "late_min": late_min,
+        "late_stops": late_stops,
+        "over_distance_km": over_distance_km,
+        "cost": cost,
+        "offsets": offsets,
+        "stops": {
+            "node": nodes,
+            "arrival_min": arrival,
+            "late_min": stop_late,
+            "load_kg": stop_load,
+            "volume_l": stop_volume,
+        },
+        "total_distance_km": float(distance_km.sum()),
+        "total_time_min": int(time_min.sum()),
+        "total_cost": float(cost.sum()),
+        "feasible": not (late_min.any() or overload_kg.any() or overload_volume_l.any() or over_distance_km.any()),
+    }
+
+
+def evaluate_plan(data, routes):
+    """Chấm kế hoạch dạng ID (xem routes_from_ids), kèm danh sách khách hàng chưa được phục vụ."""
+    index_routes, vehicles = routes_from_ids(data, routes)
+    evaluation = evaluate_routes(data, index_routes, vehicles)
+    served = set(evaluation["stops"]["node"].tolist())
+    evaluation["unserved_customers"] = [
+        node for i, node in enumerate(data["all_nodes"]) if str(node).startswith("C") and i not in served
+    ]
+    return evaluation
+
+
+def print_evaluation(data, evaluation):
+    """In KPI từng lộ trình và tổng kết."""
+    print("\n--- ĐÁNH GIÁ KẾ HOẠCH ---")
+    for r, v in enumerate(evaluation["vehicle_index"].tolist()):
+        issues = []
+        if evaluation["late_stops"][r]:
+            issues.append(f"trễ {evaluation['late_stops'][r]} điểm ({evaluation['late_min'][r]} phút)")
+        if evaluation["overload_kg"][r]:
+            issues.append(f"quá tải {evaluation['overload_kg'][r]} kg")
+        if evaluation["overload_volume_l"][r]:
+            issues.append(f"quá thể tích {evaluation['overload_volume_l'][r]} lít")
+        if evaluation["over_distance_km"][r] > 0:
+            issues.append(f"vượt {evaluation['over_distance_km'][r]:.2f} km")
+        print(f"🚚 {data['vehicle_ids'][v]}: {evaluation['distance_m'][r] / 1000.0:.2f} km, "
+              f"{evaluation['time_min'][r]} phút, {evaluation['load_kg'][r]} kg, "
+              f"chi phí {evaluation['cost'][r]:.2f}" + (f"  ⚠️ {', '.join(issues)}" if issues else ""))
+    print(f"\n📏 Tổng quãng đường: {evaluation['total_distance_km']:.2f} km")
+    print(f"⏱️ Tổng thời gian: {evaluation['total_time_min']} phút")
+    print(f"💰 Tổng chi phí: {evaluation['total_cost']:.2f}")
+    if "unserved_customers" in evaluation:
+        print(f"❌ Khách hàng chưa phục vụ: {len(evaluation['unserved_customers'])}")
+    print("✅ Kế hoạch khả thi" if evaluation["feasible"] else "⚠️ Kế hoạch vi phạm ràng buộc")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Chấm điểm kế hoạch giao hàng (file JSON) trên dữ liệu VRPTW")
+    parser.add_argument("plan", help='File JSON: list {"vehicle_id", "route": [node ID...]} hoặc kết quả của solve')
+    parser.add_argument("--city", help="Tên folder thành phố trong data/process (vd: Can_Tho); bỏ trống = toàn quốc")
+    parser.add_argument("--process-dir", help="Thư mục chứa các folder thành phố (mặc định data/process)")
+    parser.add_argument("--restrictions", action="store_true", help="Áp dụng Road_Restrictions theo lớp xe")
+    parser.add_argument("--time-dependent", action="store_true", help="Thời gian đi theo khung giờ xuất phát")
+    args = parser.parse_args()
+
+    with open(args.plan, encoding="utf-8") as fh:
+        plan = json.load(fh)
+    if isinstance(plan, dict) and "routes" in plan:
+        plan = plan["routes"]
+    data = build_problem(city=args.city, process_dir=args.process_dir,
+                         restrictions=args.restrictions, time_dependent=args.time_dependent)
+    print_evaluation(data, evaluate_plan(data, plan))
@@ -0,0 +1,185 @@
+# instance.py
+"""
+Dữ liệu bài toán VRPTW dạng gọn: VRPInstance chỉ giữ mảng NumPy (không giữ DataFrame) nên
+pickle nhanh khi gửi sang worker process và có thể lưu/đọc lại từ đĩa.
+Ma trận mở bằng memory-map từ kho ma trận (load_matrix_store) được pickle dưới dạng đường dẫn
+file .npy và mở lại bằng memory-map ở process nhận, nên worker dùng chung page cache thay vì
+nhận một bản sao.
+Vẫn hỗ trợ truy cập kiểu dict (data["time_matrix"], data["vehicle_capacities"], data.get(...))
+như dict cũ của build_problem.
+"""
+from collections import namedtuple
+from pathlib import Path
+import os
+import pickle
+
+import numpy as np
+
+# Thuộc tính xe dạng structured array (mỗi phần tử một xe)
+VEHICLE_DTYPE = np.dtype([
+    ("start", np.int32),
+    ("end", np.int32),
+    ("capacity", np.int64),
+    ("volume_capacity", np.int64),
+    ("max_distance_km", np.float64),
+    ("max_working_hours", np.float64),
+    ("fixed_cost", np.float64),
+    ("variable_cost", np.float64),
+    ("vehicle_class", np.int32),
+])
+
+# Khóa kiểu dict cũ -> trường trong VEHICLE_DTYPE
+VEHICLE_FIELD_KEYS = {
+    "starts": "start",
+    "ends": "end",
+    "vehicle_capacities": "capacity",
+    "vehicle_volume_capacities": "volume_capacity",
+    "vehicle_max_distance_km": "max_distance_km",
+    "vehicle_max_working_hours": "max_working_hours",
+    "vehicle_fixed_costs": "fixed_cost",
+    "vehicle_variable_costs": "variable_cost",
+    "vehicle_classes": "vehicle_class",
+}
+
+# Khóa suy ra (thuộc tính chỉ đọc), truy cập được như data["num_nodes"]
+DERIVED_KEYS = ("num_nodes", "num_vehicles", "num_customers")
+
+# Ma trận memory-map khi pickle: chỉ giữ đường dẫn file .npy
+MappedMatrix = namedtuple("MappedMatrix", ["path"])
+
+
+def _to_mapped(value):
+    """MappedMatrix nếu value là toàn bộ một file .npy mở bằng memory-map, ngược lại trả lại value."""
+    if not isinstance(value, np.memmap) or not value.filename:
+        return value
+    whole = np.load(value.filename, mmap_mode="r")
+    # Cùng shape/strides/dtype với cả file thì value không phải lát cắt con
+    if whole.shape != value.shape or whole.strides != value.strides or whole.dtype != value.dtype:
+        return value
+    return MappedMatrix(value.filename)
+
+
+def _from_mapped(value, opened):
+    """Mở lại MappedMatrix bằng memory-map (opened: cache đường dẫn -> mảng, giữ các tham chiếu chung)."""
+    if not isinstance(value, MappedMatrix):
+        return value
+    if value.path not in opened:
+        opened[value.path] = np.load(value.path, mmap_mode="r")
+    return opened[value.path]
+
+
+class VRPInstance:
+    """
+    Bài toán VRPTW đã dựng (xem build_problem):
+    - all_nodes: list ID node (depots + customers); node_map/vehicle_map: chỉ số gốc của bài toán con
+    - demands, volumes (int32, N; volumes None nếu không có thể tích), service_times (int32, N), time_windows (int32, N×2), coordinates (float64, N×2 hoặc None)
+    - time_matrix, distance_matrix (float32, N×N, hoặc SparseCostMatrix khi N lớn) và các ma trận theo lớp xe / khung giờ
+    - vehicles: structured array VEHICLE_DTYPE; vehicle_ids: list Vehicle_ID
+    data["starts"], data["vehicle_capacities"], ... trả về view của cột tương ứng trong vehicles;
+    data["num_nodes"], data["num_vehicles"], data["num_customers"] là các giá trị suy ra.
+    """
+
+    __slots__ = (
+        "all_nodes", "demands", "volumes", "service_times", "time_windows", "coordinates",
+        "time_matrix", "distance_matrix", "class_names", "class_time_matrices", "class_distance_matrices",
+        "time_band_matrices", "time_band_starts", "neighbors", "vehicles", "vehicle_ids",
+        "node_map", "vehicle_map",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError(f"Trường không hợp lệ cho VRPInstance: {sorted(fields)}")
+
+    @property
+    def num_nodes(self):
+        return len(self.all_nodes)
+
+    @property
+    def num_vehicles(self):
+        return len(self.vehicles)
+
+    @property
+    def num_customers(self):
+        return sum(1 for node in self.all_nodes if str(node).startswith("C"))
+
+    # --- Truy cập kiểu dict (tương thích dict cũ của build_problem) ---
+    def __getitem__(self, key):
+        if key in VEHICLE_FIELD_KEYS:
+            return self.vehicles[VEHICLE_FIELD_KEYS[key]]
+        if key in self.__slots__ or key in DERIVED_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in VEHICLE_FIELD_KEYS:
+            self.vehicles[VEHICLE_FIELD_KEYS[key]] = value
+        elif key in self.__slots__:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in VEHICLE_FIELD_KEYS or key in self.__slots__ or key in DERIVED_KEYS
+
+    def get(self, key, default=None):
+        value = self[key] if key in self else None
+        return default if value is None else value
+
+    def copy(self):
+        """Bản sao nông: các mảng dùng chung cho tới khi được gán lại."""
+        return VRPInstance(**{name: getattr(self, name) for name in self.__slots__})
+
+    # --- Pickle / lưu đĩa ---
+    def __getstate__(self):
+        state = []
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, list) and name in ("class_time_matrices", "class_distance_matrices"):
+                value = [_to_mapped(m) for m in value]
+            else:
+                value = _to_mapped(value)
+            state.append(value)
+        return tuple(state)
+
+    def __setstate__(self, state):
+        opened = {}
+        for name, value in zip(self.__slots__, state):
+            if isinstance(value, list) and name in ("class_time_matrices", "class_distance_matrices"):
+                value = [_from_mapped(m, opened) for m in value]
+            else:
+                value = _from_mapped(value, opened)
+            setattr(self, name, value)
+
+    def save(self, path):
+        """
+        Lưu bài toán ra file (pickle protocol mới nhất, mảng NumPy ghi thẳng dạng nhị phân).
+        Ma trận memory-map chỉ được lưu dưới dạng đường dẫn nên kho ma trận phải còn khi load.
+        """
+        path = Path(path)
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "wb") as fh:
+            pickle.dump(self, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as fh:
+            instance = pickle.load(fh)
+        if not isinstance(instance, VRPInstance):
+            raise TypeError(f"File không chứa VRPInstance: {path}")
+        return instance
+
+    def __repr__(self):
+        return (f"VRPInstance({self.num_nodes:,} node, {self.num_customers:,} khách hàng, "
+                f"{self.num_vehicles} xe, {len(self.class_names or [])} lớp xe)")
+
+
+def make_vehicles(num_vehicles, **columns):
+    """Tạo structured array VEHICLE_DTYPE từ các cột (tên trường -> mảng/list độ dài num_vehicles)."""
+    vehicles = np.zeros(num_vehicles, dtype=VEHICLE_DTYPE)
+    for name, values in columns.items():
+        vehicles[name] = values
+    return vehicles
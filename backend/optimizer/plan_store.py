@@ -0,0 +1,266 @@
+# plan_store.py
+"""
+Lưu kế hoạch giao hàng vào SQLite để điều phối cuốn chiếu (rolling horizon):
+mỗi lần giải được ghi lại cùng hash dữ liệu đầu vào và trạng thái từng điểm dừng
+(planned / in_progress / completed). Lần giải sau cố định phần đầu lộ trình đã cam kết
+và chỉ tối ưu phần đuôi còn lại.
+"""
+from datetime import datetime
+import hashlib
+import json
+import sqlite3
+
+import numpy as np
+
+from backend.data_processing.data import cost_matrix_bytes
+from backend.optimizer.evaluate import evaluate_plan, evaluate_routes
+from backend.optimizer.solve_vrp_ortools import (
+    DAY_MINUTES,
+    build_problem,
+    solve,
+    subset_problem,
+)
+
+STATUS_PLANNED = "planned"
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_COMPLETED = "completed"
+COMMITTED_STATUSES = (STATUS_IN_PROGRESS, STATUS_COMPLETED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    city TEXT,
+    created_at TEXT NOT NULL,
+    inputs_hash TEXT NOT NULL,
+    parent_plan_id INTEGER REFERENCES plans(plan_id),
+    result_json TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stops (
+    plan_id INTEGER NOT NULL REFERENCES plans(plan_id),
+    vehicle_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    node_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'planned',
+    PRIMARY KEY (plan_id, vehicle_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_plans_city ON plans(city, plan_id);
+"""
+
+
+def problem_hash(data):
+    """Hash SHA-1 của dữ liệu đầu vào mô hình (node, ma trận, nhu cầu, khung giờ, xe)."""
+    h = hashlib.sha1()
+    h.update(json.dumps(list(map(str, data["all_nodes"]))).encode())
+    for key in ("time_matrix", "distance_matrix"):
+        h.update(cost_matrix_bytes(data[key]))
+    if len(data["class_time_matrices"]) > 1:
+        # Ma trận của các lớp xe còn lại (lớp đầu chính là time_matrix/distance_matrix)
+        for key in ("class_time_matrices", "class_distance_matrices"):
+            for matrix in data[key][1:]:
+                h.update(cost_matrix_bytes(matrix))
+    if data.get("time_band_matrices") is not None:
+        h.update(json.dumps(data["time_band_starts"]).encode())
+        h.update(np.ascontiguousarray(data["time_band_matrices"]).tobytes())
+    for key in ("demands", "volumes", "service_times", "time_windows"):
+        if data.get(key) is not None:
+            h.update(np.ascontiguousarray(data[key]).tobytes())
+    # Toàn bộ thuộc tính xe (depot, tải trọng, giới hạn, lớp xe) nằm trong structured array vehicles
+    h.update(np.ascontiguousarray(data["vehicles"]).tobytes())
+    h.update(json.dumps(data["vehicle_ids"]).encode())
+    return h.hexdigest()
+
+
+class PlanStore:
+    """Kho kế hoạch SQLite: lưu kết quả solve(), trạng thái điểm dừng và phần lộ trình đã cam kết."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def save_plan(self, result, inputs_hash, city=None, parent_plan_id=None, statuses=None):
+        """
+        Ghi một kế hoạch; statuses: {(vehicle_id, node_id): status} cho các điểm dừng đã cam kết.
+        Trả về plan_id.
+        """
+        statuses = statuses or {}
+        with self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO plans (city, created_at, inputs_hash, parent_plan_id, result_json) VALUES (?, ?, ?, ?, ?)",
+                (city, datetime.now().isoformat(timespec="seconds"), inputs_hash, parent_plan_id,
+                 json.dumps(result, ensure_ascii=False, default=str)),
+            )
+            plan_id = cur.lastrowid
+            self._conn.executemany(
+                "INSERT INTO stops (plan_id, vehicle_id, seq, node_id, status) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (plan_id, r["vehicle_id"], seq, node, statuses.get((r["vehicle_id"], node), STATUS_PLANNED))
+                    for r in result["routes"]
+                    for seq, node in enumerate(r["route"])
+                ],
+            )
+        return plan_id
+
+    def latest_plan(self, city=None):
+        """Trả về (plan_id, inputs_hash, result) của kế hoạch mới nhất cho city, hoặc None."""
+        row = self._conn.execute(
+            "SELECT plan_id, inputs_hash, result_json FROM plans WHERE city IS ? ORDER BY plan_id DESC LIMIT 1",
+            (city,),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def set_stop_status(self, plan_id, vehicle_id, node_ids, status):
+        """Cập nhật trạng thái các điểm dừng node_ids trên lộ trình của xe vehicle_id."""
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE stops SET status = ? WHERE plan_id = ? AND vehicle_id = ? AND node_id = ?",
+                [(status, plan_id, vehicle_id, node) for node in node_ids],
+            )
+
+    def committed_prefixes(self, plan_id):
+        """
+        Phần đầu lộ trình đã cam kết của từng xe: {vehicle_id: [(node_id, status), ...]} gồm
+        các khách hàng liên tiếp từ đầu lộ trình có trạng thái in_progress hoặc completed.
+        """
+        rows = self._conn.execute(
+            "SELECT vehicle_id, node_id, status FROM stops WHERE plan_id = ? ORDER BY vehicle_id, seq",
+            (plan_id,),
+        ).fetchall()
+        prefixes = {}
+        open_vehicles = set()
+        for vehicle_id, node_id, status in rows:
+            if vehicle_id not in prefixes:
+                prefixes[vehicle_id] = []
+                open_vehicles.add(vehicle_id)
+                continue  # depot xuất phát
+            if vehicle_id not in open_vehicles or not str(node_id).startswith("C"):
+                continue
+            if status in COMMITTED_STATUSES:
+                prefixes[vehicle_id].append((node_id, status))
+            else:
+                open_vehicles.discard(vehicle_id)
+        return {v: p for v, p in prefixes.items() if p}
+
+
+def solve_rolling(store, city=None, process_dir=None, data=None, time_limit=60, now_min=None,
+                  strict_inputs=False, verbose=True):
+    """
+    Một chu kỳ điều phối cuốn chiếu:
+    1. Lấy kế hoạch mới nhất của city trong store và phần đầu lộ trình đã cam kết của từng xe
+    2. Bỏ các điểm đã cam kết khỏi bài toán; xe xuất phát từ điểm cam kết cuối cùng, không sớm hơn
+       giờ bắt đầu phục vụ điểm đó theo lịch của phần đầu, với tải trọng, quãng đường và giờ làm việc còn lại
+    3. Giải phần đuôi, ghép lại với phần đầu đã cam kết và lưu thành kế hoạch mới
+    - now_min: giờ hiện tại (phút kể từ 0h); nếu có, không xe nào xuất phát trước thời điểm này
+    - strict_inputs: dữ liệu đầu vào (problem_hash) khác kế hoạch trước thì báo ValueError thay vì
+      chỉ cảnh báo (vd. khi nhu cầu, đội xe hay ma trận đã đổi từ lần giải trước)
+    Quãng đường/thời gian/chi phí của kế hoạch ghép được tính lại bằng evaluate_routes.
+    Trả về (plan_id, result).
+    """
+    if data is None:
+        data = build_problem(city=city, process_dir=process_dir)
+    inputs_hash = problem_hash(data)
+
+    latest = store.latest_plan(city)
+    if latest is not None and latest[1] != inputs_hash:
+        message = (f"Dữ liệu đầu vào khác kế hoạch #{latest[0]} (hash {latest[1][:12]} -> {inputs_hash[:12]}): "
+                   f"phần đầu lộ trình đã cam kết được ghép vào bài toán đã thay đổi")
+        if strict_inputs:
+            raise ValueError(message)
+        print(f"⚠️ {message}")
+    prefixes = store.committed_prefixes(latest[0]) if latest is not None else {}
+    parent_plan_id = latest[0] if latest is not None else None
+
+    node_index = {node: i for i, node in enumerate(data["all_nodes"])}
+    vehicle_index = {vid: v for v, vid in enumerate(data["vehicle_ids"])}
+    prefix_nodes = {
+        vehicle_index[vid]: [node_index[n] for n, _ in stops if n in node_index]
+        for vid, stops in prefixes.items() if vid in vehicle_index
+    }
+    prefix_nodes = {v: nodes for v, nodes in prefix_nodes.items() if nodes}
+
+    # Điểm đã cam kết (trừ điểm cuối của mỗi xe, là điểm xuất phát mới) bị loại khỏi bài toán
+    committed = {n for nodes in prefix_nodes.values() for n in nodes}
+    new_starts = {v: nodes[-1] for v, nodes in prefix_nodes.items()}
+    removed = committed - set(new_starts.values())
+    keep_nodes = [i for i in range(data["num_nodes"]) if i not in removed]
+    sub = subset_problem(data, keep_nodes, range(data["num_vehicles"]))
+    local = {old: new for new, old in enumerate(sub["node_map"])}
+
+    # Lịch của phần đầu (depot -> điểm cam kết cuối) và chặng quay thẳng về depot kết thúc
+    prefix_vehicles = list(prefix_nodes)
+    prefix_eval = evaluate_routes(
+        data, [np.array([data["starts"][v]] + prefix_nodes[v]) for v in prefix_vehicles], prefix_vehicles
+    )
+    return_eval = evaluate_routes(
+        data, [np.array([prefix_nodes[v][-1], data["ends"][v]]) for v in prefix_vehicles], prefix_vehicles
+    )
+
+    # subset_problem trả về bản sao của demands/time_windows/vehicles nên có thể sửa trực tiếp
+    time_windows = sub["time_windows"]
+    if now_min is not None:
+        for depot in set(sub["starts"].tolist()):
+            time_windows[depot, 0] = max(int(time_windows[depot, 0]), int(now_min))
+    for r, v in enumerate(prefix_vehicles):
+        nodes = prefix_nodes[v]
+        start = local[nodes[-1]]
+        ready = int(prefix_eval["stops"]["arrival_min"][prefix_eval["offsets"][r + 1] - 1])
+        if now_min is not None:
+            ready = max(ready, int(now_min))
+        # Điểm xuất phát mới: bỏ khung giờ gốc của khách, xe chỉ rảnh từ giờ ready
+        time_windows[start] = (min(ready, DAY_MINUTES), DAY_MINUTES)
+        distance_km = prefix_eval["distance_m"][r] / 1000.0
+        worked_min = int(prefix_eval["duration_min"][r])
+        sub["starts"][v] = start
+        sub["demands"][local[nodes[-1]]] = 0
+        sub["vehicle_capacities"][v] = max(0, sub["vehicle_capacities"][v] - sum(data["demands"][n] for n in nodes))
+        if sub["volumes"] is not None:
+            sub["volumes"][local[nodes[-1]]] = 0
+            sub["vehicle_volume_capacities"][v] = max(
+                0, sub["vehicle_volume_capacities"][v] - sum(data["volumes"][n] for n in nodes)
+            )
+        # Phần còn lại không nhỏ hơn chặng quay thẳng về depot, để bài toán luôn khả thi
+        sub["vehicle_max_distance_km"][v] = max(return_eval["distance_m"][r] / 1000.0,
+                                                sub["vehicle_max_distance_km"][v] - distance_km)
+        sub["vehicle_max_working_hours"][v] = max(return_eval["time_min"][r] / 60.0,
+                                                  sub["vehicle_max_working_hours"][v] - worked_min / 60.0)
+
+    if verbose:
+        print(f"🔁 Giải cuốn chiếu: {len(committed)} điểm đã cam kết trên {len(prefix_nodes)} xe, "
+              f"bài toán còn {sub['num_nodes']:,} / {data['num_nodes']:,} node")
+    result = solve(data=sub, time_limit=time_limit, verbose=verbose)
+    if result is None:
+        return None
+
+    # --- Ghép phần đầu đã cam kết vào lộ trình mới ---
+    routes_by_vehicle = {r["vehicle_index"]: r for r in result["routes"]}
+    for v, nodes in prefix_nodes.items():
+        prefix_ids = [data["all_nodes"][n] for n in nodes]
+        r = routes_by_vehicle.get(v)
+        if r is None:
+            # Xe không nhận thêm điểm mới: chỉ còn quay về depot kết thúc
+            r = {"vehicle_index": v, "vehicle_id": data["vehicle_ids"][v],
+                 "route": [prefix_ids[-1], data["all_nodes"][data["ends"][v]]]}
+            result["routes"].append(r)
+        r["route"] = [data["all_nodes"][data["starts"][v]]] + prefix_ids[:-1] + r["route"]
+    result["routes"].sort(key=lambda r: r["vehicle_index"])
+
+    # --- Tổng quãng đường/thời gian/chi phí của kế hoạch ghép trên dữ liệu gốc ---
+    evaluation = evaluate_plan(data, result["routes"])
+    for i, r in enumerate(result["routes"]):
+        r["distance_m"] = int(evaluation["distance_m"][i])
+        r["time_min"] = int(evaluation["time_min"][i])
+    result["total_distance_km"] = evaluation["total_distance_km"]
+    result["total_time_min"] = evaluation["total_time_min"]
+    result["total_cost"] = evaluation["total_cost"]
+    result["unserved_customers"] = evaluation["unserved_customers"]
+
+    statuses = {(vid, n): status for vid, stops in prefixes.items() for n, status in stops}
+    plan_id = store.save_plan(result, inputs_hash, city=city, parent_plan_id=parent_plan_id, statuses=statuses)
+    if verbose:
+        print(f"💾 Đã lưu kế hoạch #{plan_id} vào {store.path}")
+    return plan_id, result
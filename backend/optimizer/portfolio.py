@@ -0,0 +1,196 @@
+# portfolio.py
+"""
+Chạy song song một "danh mục" chiến lược tìm kiếm (first solution × metaheuristic) trên cùng
+bài toán, mỗi chiến lược một worker process. Các worker chia sẻ chi phí tốt nhất qua bộ nhớ
+chung (multiprocessing.Value/Event, truyền qua initializer của pool) và cùng dừng sớm khi đạt
+mục tiêu (target_cost + target_gap). Mỗi chiến lược tự dừng khi chi phí tốt nhất không cải thiện
+trong stall_seconds giây kể từ lúc nó bắt đầu tìm kiếm; chiến lược đang chờ trong hàng đợi vẫn được
+chạy. Giữ lại nghiệm tốt nhất.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+import os
+import time
+
+from backend.optimizer.solve_vrp_ortools import (
+    build_problem,
+    build_routing_model,
+    extract_solution,
+    make_search_parameters,
+    print_solution,
+)
+
+# (first_solution_strategy, local_search_metaheuristic) mặc định, theo thứ tự ưu tiên
+DEFAULT_PORTFOLIO = (
+    ("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH"),
+    ("SAVINGS", "GUIDED_LOCAL_SEARCH"),
+    ("PARALLEL_CHEAPEST_INSERTION", "TABU_SEARCH"),
+    ("PATH_CHEAPEST_ARC", "SIMULATED_ANNEALING"),
+    ("LOCAL_CHEAPEST_INSERTION", "GUIDED_LOCAL_SEARCH"),
+    ("CHRISTOFIDES", "TABU_SEARCH"),
+)
+
+# Callback nghiệm kiểm tra cờ dừng / stall sau mỗi chừng ấy nghiệm (cải thiện cục bộ luôn được báo ngay)
+POLL_EVERY = 16
+
+# Trạng thái chung của worker process, gán bởi _init_worker
+_shared = {}
+
+
+def _init_worker(best_cost, best_strategy, last_improvement, stop_event):
+    """Initializer của pool: giữ các Value/Event dùng chung trong biến toàn cục của worker."""
+    _shared.update(best_cost=best_cost, best_strategy=best_strategy,
+                   last_improvement=last_improvement, stop_event=stop_event)
+
+
+def _strategy_name(strategy):
+    return "+".join(strategy)
+
+
+def _target_reached(best_cost, target_cost, target_gap):
+    return target_cost is not None and best_cost <= target_cost * (1.0 + target_gap)
+
+
+def _solve_strategy(data, strategy, strategy_index, time_limit,
+                    target_cost=None, target_gap=0.0, stall_seconds=None):
+    """
+    Hàm chạy trong worker process: dựng mô hình, giải với một chiến lược. Chi phí tốt nhất của
+    chiến lược được giữ cục bộ; chỉ khi cải thiện mới ghi vào trạng thái chung (best_cost,
+    best_strategy, last_improvement). Cờ dừng và stall được kiểm tra mỗi POLL_EVERY nghiệm.
+    Stall chỉ dừng chiến lược này, tính từ max(lần cải thiện chung gần nhất, lúc bắt đầu tìm kiếm);
+    chỉ đạt mục tiêu mới bật stop_event để dừng/bỏ qua mọi chiến lược.
+    """
+    t0 = time.perf_counter()
+    name = _strategy_name(strategy)
+    best_cost, best_strategy = _shared["best_cost"], _shared["best_strategy"]
+    last_improvement, stop_event = _shared["last_improvement"], _shared["stop_event"]
+    if stop_event.is_set():
+        return {"strategy": name, "status": "skipped", "objective": None, "wall_time_s": 0.0, "result": None}
+
+    manager, routing, time_transit, distance_transit = build_routing_model(data)
+    search_parameters = make_search_parameters(time_limit, *strategy)
+    num_solutions = [0]
+    local_best = [float("inf")]
+    started = [time.time()]
+
+    def on_solution():
+        num_solutions[0] += 1
+        cost = routing.CostVar().Value()
+        stop = stalled = False
+        if cost < local_best[0]:
+            local_best[0] = cost
+            with best_cost.get_lock():
+                if cost < best_cost.value:
+                    best_cost.value = cost
+                    best_strategy.value = strategy_index
+                    last_improvement.value = time.time()
+            stop = _target_reached(cost, target_cost, target_gap)
+        if not stop and num_solutions[0] % POLL_EVERY == 0:
+            stop = stop_event.is_set()
+            stalled = stall_seconds is not None and (
+                time.time() - max(last_improvement.value, started[0]) > stall_seconds
+            )
+        if stop:
+            stop_event.set()
+        if stop or stalled:
+            routing.solver().FinishCurrentSearch()
+
+    routing.AddAtSolutionCallback(on_solution)
+    started[0] = time.time()
+    solution = routing.SolveWithParameters(search_parameters)
+    if solution is None:
+        return {"strategy": name, "status": "no_solution", "objective": None,
+                "wall_time_s": round(time.perf_counter() - t0, 3), "result": None}
+    return {
+        "strategy": name,
+        "status": "ok",
+        "objective": solution.ObjectiveValue(),
+        "num_solutions": num_solutions[0],
+        "wall_time_s": round(time.perf_counter() - t0, 3),
+        "result": extract_solution(data, manager, routing, solution, time_transit, distance_transit),
+    }
+
+
+def solve_portfolio(city=None, process_dir=None, data=None, portfolio=DEFAULT_PORTFOLIO, time_limit=180,
+                    max_workers=None, target_cost=None, target_gap=0.0, stall_seconds=30, verbose=True):
+    """
+    Giải VRPTW bằng nhiều chiến lược song song và trả về kết quả tốt nhất (dict cùng cấu trúc
+    solve(), gồm "objective", kèm "strategy" thắng và "portfolio" = thống kê từng chiến lược).
+    - portfolio: các cặp (first_solution, metaheuristic), xem make_search_parameters
+    - time_limit: giới hạn (giây) của mỗi chiến lược
+    - max_workers: số process (mặc định min(số chiến lược, số CPU))
+    - target_cost / target_gap: dừng tất cả khi chi phí mục tiêu (objective của OR-Tools)
+      <= target_cost × (1 + target_gap), vd. objective của kế hoạch hôm trước
+    - stall_seconds: dừng một chiến lược khi chi phí tốt nhất không cải thiện sau chừng ấy giây kể từ
+      lúc chiến lược đó bắt đầu (None = tắt); không ảnh hưởng các chiến lược còn trong hàng đợi
+    """
+    if data is None:
+        data = build_problem(city=city, process_dir=process_dir)
+    portfolio = [tuple(s) for s in portfolio]
+    max_workers = max_workers or min(len(portfolio), os.cpu_count() or 1)
+
+    if verbose:
+        print(f"🏁 Chạy {len(portfolio)} chiến lược với tối đa {max_workers} process song song...")
+    t0 = time.perf_counter()
+    runs = []
+    best_cost = mp.Value("d", float("inf"))
+    best_strategy = mp.Value("i", -1, lock=False)
+    last_improvement = mp.Value("d", time.time(), lock=False)
+    stop_event = mp.Event()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(best_cost, best_strategy, last_improvement, stop_event)) as executor:
+        futures = [
+            executor.submit(_solve_strategy, data, strategy, i, time_limit,
+                            target_cost, target_gap, stall_seconds)
+            for i, strategy in enumerate(portfolio)
+        ]
+        for future in as_completed(futures):
+            run = future.result()
+            runs.append(run)
+            if verbose:
+                objective = "-" if run["objective"] is None else f"{run['objective']:,}"
+                print(f"   - {'✅' if run['status'] == 'ok' else '⚠️'} {run['strategy']}: {run['status']} "
+                      f"(objective {objective}, {run['wall_time_s']:.1f}s)")
+
+    solved = [r for r in runs if r["result"] is not None]
+    if not solved:
+        if verbose:
+            print("❌ Không chiến lược nào tìm thấy nghiệm khả thi.")
+        return None
+    best = min(solved, key=lambda r: r["objective"])
+    result = dict(best["result"])
+    result["strategy"] = best["strategy"]
+    result["objective"] = best["objective"]
+    result["portfolio"] = [{k: v for k, v in r.items() if k != "result"} for r in runs]
+    if verbose:
+        print(f"🏆 Chiến lược tốt nhất: {best['strategy']} (tổng {time.perf_counter() - t0:.1f}s)")
+        print_solution(result, data["num_vehicles"])
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Giải VRPTW bằng danh mục chiến lược chạy song song")
+    parser.add_argument("--city", help="Tên folder thành phố trong data/process (vd: Can_Tho); bỏ trống = toàn quốc")
+    parser.add_argument("--process-dir", help="Thư mục chứa các folder thành phố (mặc định data/process)")
+    parser.add_argument("--time-limit", type=int, default=180, help="Giới hạn thời gian mỗi chiến lược (giây)")
+    parser.add_argument("--workers", type=int, help="Số process song song")
+    parser.add_argument("--strategy", action="append", default=[], metavar="FIRST:META",
+                        help="Chiến lược, vd. SAVINGS:TABU_SEARCH; có thể lặp lại (mặc định DEFAULT_PORTFOLIO)")
+    parser.add_argument("--target-cost", type=int, help="Chi phí mục tiêu (objective) để dừng sớm")
+    parser.add_argument("--target-gap", type=float, default=0.0, help="Sai số tương đối cho phép so với --target-cost")
+    parser.add_argument("--stall", type=float, default=30, help="Dừng mỗi chiến lược khi không cải thiện sau chừng ấy giây")
+    args = parser.parse_args()
+
+    strategies = [tuple(s.split(":", 1)) for s in args.strategy] or DEFAULT_PORTFOLIO
+    solve_portfolio(
+        city=args.city,
+        process_dir=args.process_dir,
+        portfolio=strategies,
+        time_limit=args.time_limit,
+        max_workers=args.workers,
+        target_cost=args.target_cost,
+        target_gap=args.target_gap,
+        stall_seconds=args.stall,
+    )
@@ -0,0 +1,93 @@
+# reoptimize.py
+"""
+Tối ưu lại (warm start) khi đơn hàng thay đổi trong ngày: lấy kết quả solve() trước đó,
+bỏ khách hàng đã hủy, thêm khách hàng mới và khởi tạo OR-Tools từ các lộ trình cũ
+thay vì dựng nghiệm ban đầu từ đầu.
+"""
+from backend.optimizer.solve_vrp_ortools import (
+    build_problem,
+    build_routing_model,
+    extract_solution,
+    make_search_parameters,
+    print_solution,
+    subset_problem,
+)
+
+
+def previous_routes_for(data, previous, excluded=()):
+    """
+    Chuyển routes của kết quả trước (theo Vehicle_ID và Customer_ID) thành danh sách node
+    cục bộ cho từng xe của data, bỏ depot đầu/cuối, khách hàng bị loại và node không còn trong bài toán.
+    """
+    node_index = {node: i for i, node in enumerate(data["all_nodes"])}
+    excluded = set(excluded)
+    by_vehicle = {r["vehicle_id"]: r["route"] for r in previous.get("routes", [])}
+    routes = []
+    for vehicle_id in data["vehicle_ids"]:
+        stops = by_vehicle.get(vehicle_id, [])[1:-1]
+        routes.append([
+            node_index[n] for n in stops
+            if n in node_index and n not in excluded and str(n).startswith("C")
+        ])
+    return routes
+
+
+def reoptimize(previous, city=None, process_dir=None, data=None, added_customers=None,
+               cancelled_customers=None, time_limit=30, verbose=True):
+    """
+    Tối ưu lại kế hoạch previous (dict do solve() trả về) sau khi có thay đổi đơn hàng.
+    - data / city: dữ liệu hiện tại (đã gồm đơn mới); nếu data=None sẽ gọi build_problem(city)
+    - added_customers: Customer_ID mới; nếu truyền vào, bài toán chỉ gồm khách hàng của
+      kế hoạch cũ (đã/chưa phục vụ) cộng với danh sách này
+    - cancelled_customers: Customer_ID đã hủy, bị loại khỏi bài toán và khỏi lộ trình cũ
+    Lộ trình cũ được nạp bằng ReadAssignmentFromRoutes rồi giải tiếp bằng
+    SolveFromAssignmentWithParameters; khách hàng mới được local search chèn vào.
+    """
+    if data is None:
+        data = build_problem(city=city, process_dir=process_dir)
+    cancelled = set(cancelled_customers or ())
+
+    if added_customers is not None:
+        wanted = {n for r in previous.get("routes", []) for n in r["route"]}
+        wanted.update(previous.get("unserved_customers", []))
+        wanted.update(added_customers)
+    else:
+        wanted = None
+    keep_nodes = [
+        i for i, node in enumerate(data["all_nodes"])
+        if not str(node).startswith("C") or (node not in cancelled and (wanted is None or node in wanted))
+    ]
+    if len(keep_nodes) < data["num_nodes"]:
+        data = subset_problem(data, keep_nodes, range(data["num_vehicles"]))
+
+    manager, routing, time_transit, distance_transit = build_routing_model(data)
+    search_parameters = make_search_parameters(time_limit)
+    routing.CloseModelWithParameters(search_parameters)
+
+    # --- Nạp nghiệm cũ làm điểm xuất phát ---
+    initial_routes = [
+        [manager.NodeToIndex(node) for node in route]
+        for route in previous_routes_for(data, previous, excluded=cancelled)
+    ]
+    initial_assignment = routing.ReadAssignmentFromRoutes(initial_routes, True)
+
+    if verbose:
+        kept = sum(len(r) for r in initial_routes)
+        print(f"♻️ Warm start từ {kept} điểm dừng cũ, {len(cancelled)} đơn hủy, "
+              f"{len(added_customers or [])} đơn mới ...")
+    if initial_assignment is None:
+        if verbose:
+            print("⚠️ Lộ trình cũ không còn khả thi, giải lại từ đầu.")
+        solution = routing.SolveWithParameters(search_parameters)
+    else:
+        solution = routing.SolveFromAssignmentWithParameters(initial_assignment, search_parameters)
+
+    if solution is None:
+        if verbose:
+            print("❌ Không tìm thấy nghiệm khả thi.")
+        return
+
+    result = extract_solution(data, manager, routing, solution, time_transit, distance_transit)
+    if verbose:
+        print_solution(result, data["num_vehicles"])
+    return result
@@ -1,172 +1,556 @@
 # solve_vrp_ortools.py
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-from backend.data_processing.data import load_data, build_cost_lookup
-import math
-import sys
-
-def time_to_minutes(t):
-    """t is datetime.time or NaT; return minutes since midnight"""
-    if t is None or (hasattr(t, 'hour') and math.isnan(t.hour if hasattr(t, 'hour') else 0)):
-        return None
-    if t is pd.NaT:
-        return None
-    try:
-        return t.hour * 60 + t.minute
-    except Exception:
-        return None
-
+from backend import instrumentation
+from backend.instrumentation import timed
+from backend.optimizer.instance import VRPInstance, make_vehicles
+from backend.data_processing.data import (
+    DEFAULT_BASE_DIR,
+    DEFAULT_PROCESS_DIR,
+    MISSING_DISTANCE_KM,
+    MISSING_TIME_MIN,
+    TIME_BAND_STARTS,
+    SparseCostMatrix,
+    build_cost_matrices,
+    build_knn_neighbors,
+    build_time_band_matrices,
+    complete_cost_matrices,
+    cost_matrices_equal,
+    load_city_data,
+    load_data,
+    load_matrix_store,
+    matrix_store_key,
+    save_matrix_store,
+    vehicle_classes,
+)
+from pathlib import Path
+import json
+import os
+import time
+import numpy as np
 import pandas as pd
 
-def build_problem():
+DAY_MINUTES = 24 * 60
+# Giới hạn bộ nhớ (MB) cho ma trận transit đăng ký với OR-Tools: mỗi ma trận là một bản sao int64 N×N
+# trong C++. N lớn hơn (Hanoi, HCMC, toàn quốc) dùng callback Python tra theo cung (arc_transit_callback)
+# thay vì ma trận. Ghi đè bằng LASTMILE_MAX_TRANSIT_MB.
+MAX_TRANSIT_MEMORY_MB = float(os.environ.get("LASTMILE_MAX_TRANSIT_MB", 4096))
+VOLUME_SCALE = 1000  # m³ -> lít: Volume dimension dùng số nguyên
+VOLUME_COLUMNS = ("Order_Volume", "Demand_Volume")
+
+def clock_to_minutes(values, default):
+    """
+    Đổi cả cột giờ dạng "HH:MM" (hoặc "HH:MM:SS", datetime.time, Timestamp) sang số phút từ 0h.
+    Cột khung giờ chỉ có vài chục giá trị khác nhau nên chỉ tách chuỗi trên các giá trị duy nhất
+    (pd.factorize) rồi gán lại theo mã. Giá trị thiếu/sai định dạng nhận default. Trả về mảng int64.
+    """
+    series = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return (series.dt.hour * 60 + series.dt.minute).fillna(default).to_numpy(np.int64)
+    codes, uniques = pd.factorize(series)
+    parts = pd.Series(uniques).astype("string").str.extract(r"^\s*(\d{1,2}):(\d{2})")
+    hours, mins = parts[0].astype(float), parts[1].astype(float)
+    parsed = (hours * 60 + mins).where((hours < 24) & (mins < 60)).fillna(default).to_numpy(np.int64)
+    return np.where(codes >= 0, parsed[np.maximum(codes, 0)] if len(parsed) else default, default)
+
+@timed()
+def build_problem(city=None, process_dir=None, knn=None, complete_paths=False, path_workers=1,
+                  matrix_store=None, restrictions=False, time_dependent=False, base_dir=None):
+    """
+    Dựng dữ liệu bài toán VRPTW, trả về VRPInstance (chỉ giữ mảng NumPy, truy cập được kiểu dict).
+    - city=None: dùng toàn bộ dữ liệu quốc gia (load_data, đọc từ base_dir nếu có)
+    - city="Can_Tho": chỉ đọc folder data/process/<city> (load_city_data)
+    - knn=k: chỉ cho phép từ mỗi khách hàng đi tới k khách hàng gần nhất (theo thời gian)
+      hoặc về depot; lưu ở "neighbors" dạng mảng (N, k). Khi transit dùng callback theo cung
+      (bài toán lớn, xem build_routing_model) chỉ các cung này được tính sẵn, nên bộ nhớ ~ N×k
+    - complete_paths=True: điền cặp node thiếu cung bằng đường đi ngắn nhất trên đồ thị road
+      (complete_cost_matrices), cache trong processed/cache hoặc data/process/<city>/cache
+    - matrix_store: thư mục kho ma trận .npy; nếu đã có (cùng dữ liệu) thì mở bằng memory-map
+      để các process dùng chung, nếu chưa thì dựng ma trận rồi lưu vào đó
+    - restrictions=True: áp dụng Road_Restrictions — cung "One-Way" chỉ đi một chiều, cung
+      "No Heavy Trucks" bị cấm với lớp xe nặng. Mỗi lớp xe (vehicle_classes) có một cặp ma trận
+      riêng trong "class_time_matrices"/"class_distance_matrices"; "vehicle_classes" là lớp của từng xe.
+      "time_matrix"/"distance_matrix" luôn là ma trận của lớp đầu tiên.
+    - Ma trận chi phí là mảng float32 N×N, hoặc SparseCostMatrix khi N lớn (xem build_cost_matrices)
+    - demands / service_times (int32, N) và time_windows (int32, N×2, phút) là mảng NumPy
+      tính theo cả cột từ df_customers/df_depots; "volumes" (int32, lít) từ Order_Volume khi xe có
+      Capacity_Volume (thêm Volume dimension bên cạnh Weight); thuộc tính xe nằm trong "vehicles" (VEHICLE_DTYPE)
+    - time_dependent=True: thêm "time_band_matrices" [band, i, j] (build_time_band_matrices) và
+      "time_band_starts"; Time dimension dùng thời gian của khung giờ lúc xuất phát (xem departure_time_matrix)
+    """
     #tải lên dữ liệu sạch 
-    df_customers, df_depots, df_vehicles, df_roads_full = load_data()
-
-    # Build both time lookup (minutes) and distance lookup (kilometers)
-    time_lookup, all_nodes = build_cost_lookup(df_roads_full, df_depots, df_customers, mode="time")
-    distance_lookup, _ = build_cost_lookup(df_roads_full, df_depots, df_customers, mode="distance")
-
-    # Node index mapping (same order as all_nodes)
-    node_index = {node: i for i, node in enumerate(all_nodes)}
+    if city is None:
+        df_customers, df_depots, df_vehicles, df_roads_full = load_data(base_dir=base_dir)
+    else:
+        df_customers, df_depots, df_vehicles, df_roads_full = load_city_data(city, process_dir=process_dir)
+
+    if restrictions:
+        class_restrictions, vehicle_class = vehicle_classes(df_vehicles)
+    else:
+        class_restrictions, vehicle_class = {"all": ()}, [0] * len(df_vehicles)
+
+    class_time_matrices = []
+    class_distance_matrices = []
+    for class_name, forbidden in class_restrictions.items():
+        store_dir = None
+        if matrix_store is not None:
+            store_dir = Path(matrix_store) / class_name if restrictions else matrix_store
+        time_matrix, distance_matrix, all_nodes = _class_cost_matrices(
+            df_roads_full, df_depots, df_customers, city, process_dir,
+            forbidden=forbidden, one_way=restrictions, complete_paths=complete_paths,
+            path_workers=path_workers, store_dir=store_dir, base_dir=base_dir,
+        )
+        class_time_matrices.append(time_matrix)
+        class_distance_matrices.append(distance_matrix)
+    time_matrix, distance_matrix = class_time_matrices[0], class_distance_matrices[0]
+    if restrictions:
+        print(f"🔹 Lớp xe: " + ", ".join(
+            f"{name} ({vehicle_class.count(c)} xe)" for c, name in enumerate(class_restrictions)))
 
     num_vehicles = len(df_vehicles)
     num_nodes = len(all_nodes)
+    num_depots = len(df_depots)
+    node_index = pd.Index([str(node) for node in all_nodes])
+    if not node_index.is_unique:
+        duplicated = node_index[node_index.duplicated()].unique().tolist()
+        raise ValueError(f"ID depot/khách hàng bị trùng: {duplicated[:10]}")
+
+    # Thuộc tính theo node dạng mảng, gán theo chỉ số node của từng ID (không dựa vào thứ tự dòng)
+    customers = node_index.get_indexer(df_customers["Customer_ID"].astype(str))
+    depots = node_index.get_indexer(df_depots["Depot_ID"].astype(str))
+    if (customers < 0).any() or (depots < 0).any():
+        raise ValueError("Danh sách node của ma trận chi phí không khớp với bảng customers/depots "
+                         "(kho ma trận cũ hoặc dữ liệu đã thay đổi)")
+    demands = np.zeros(num_nodes, dtype=np.int32)
+    service_times = np.zeros(num_nodes, dtype=np.int32)
+    time_windows = np.zeros((num_nodes, 2), dtype=np.int32)
+    time_windows[:, 1] = DAY_MINUTES  # default whole day
+
+    if "Order_Weight" in df_customers.columns:
+        demands[customers] = np.rint(pd.to_numeric(df_customers["Order_Weight"], errors="coerce")
+                                     .fillna(0).to_numpy(np.float64))  # integer kg
+    # Thể tích đơn hàng (lít) chỉ dùng khi xe có Capacity_Volume; None = bỏ qua Volume dimension
+    volumes = None
+    volume_col = next((col for col in VOLUME_COLUMNS if col in df_customers.columns), None)
+    if volume_col is not None and "Capacity_Volume" in df_vehicles.columns:
+        volumes = np.zeros(num_nodes, dtype=np.int32)
+        volumes[customers] = np.rint(pd.to_numeric(df_customers[volume_col], errors="coerce")
+                                     .fillna(0).to_numpy(np.float64) * VOLUME_SCALE)
+    if "Service_Time" in df_customers.columns:
+        service_times[customers] = np.rint(pd.to_numeric(df_customers["Service_Time"], errors="coerce")
+                                           .fillna(0).to_numpy(np.float64))  # minutes
+    if "Time_Window_Start" in df_customers.columns:
+        time_windows[customers, 0] = clock_to_minutes(df_customers["Time_Window_Start"], 0)
+    if "Time_Window_End" in df_customers.columns:
+        time_windows[customers, 1] = clock_to_minutes(df_customers["Time_Window_End"], DAY_MINUTES)
+
+    # Depot: giờ hoạt động Open_Time/Close_Time (data.py tách từ Operating_Hours); thiếu giờ mở = cả ngày
+    if "Open_Time" in df_depots.columns:
+        open_min = clock_to_minutes(df_depots["Open_Time"], -1)
+        close_min = (clock_to_minutes(df_depots["Close_Time"], DAY_MINUTES)
+                     if "Close_Time" in df_depots.columns else np.full(num_depots, DAY_MINUTES))
+        has_open = open_min >= 0
+        time_windows[depots, 0] = np.where(has_open, open_min, 0)
+        time_windows[depots, 1] = np.where(has_open, close_min, DAY_MINUTES)
+
+    # Tọa độ (lat, lon) theo node, dùng khi chia cụm; None nếu thiếu cột
+    coordinates = None
+    if all(col in df.columns for df in (df_depots, df_customers) for col in ("Latitude", "Longitude")):
+        coordinates = np.full((num_nodes, 2), np.nan)
+        coordinates[depots] = df_depots[["Latitude", "Longitude"]].to_numpy(np.float64)
+        coordinates[customers] = df_customers[["Latitude", "Longitude"]].to_numpy(np.float64)
+
+    # Thuộc tính xe (structured array); depot không tồn tại -> node 0
+    vehicles = make_vehicles(
+        num_vehicles,
+        start=np.maximum(node_index.get_indexer(df_vehicles["Start_Depot_ID"].astype(str)), 0),
+        end=np.maximum(node_index.get_indexer(df_vehicles["End_Depot_ID"].astype(str)), 0),
+        capacity=df_vehicles["Capacity_Weight"].fillna(0).astype(int),
+        volume_capacity=(np.rint(df_vehicles["Capacity_Volume"].fillna(0).to_numpy(np.float64) * VOLUME_SCALE)
+                         if volumes is not None else 0),
+        max_distance_km=df_vehicles["Max_Distance"].fillna(1e9).astype(float),
+        max_working_hours=df_vehicles["Max_Working_Hours"].fillna(24).astype(float),
+        fixed_cost=df_vehicles["Fixed_Cost"].fillna(0).astype(float),
+        variable_cost=df_vehicles["Variable_Cost"].fillna(0).astype(float),
+        vehicle_class=vehicle_class,
+    )
 
-    # Build starts and ends (index in all_nodes) per vehicle
-    starts = [node_index.get(d, 0) for d in df_vehicles["Start_Depot_ID"]]
-    ends = [node_index.get(d, 0) for d in df_vehicles["End_Depot_ID"]]
-    cust_dict = df_customers.set_index("Customer_ID").to_dict("index")
-    depot_dict = df_depots.set_index("Depot_ID").to_dict("index")
-
-    demands = [0] * num_nodes
-    service_times = [0] * num_nodes
-    time_windows = [(0, 24*60)] * num_nodes  # default whole day
-
-    for idx, node in enumerate(all_nodes):
-        if str(node).startswith("C"):
-            # customer
-            c = cust_dict.get(node)
-            if c is None:
-                # if customer not in df_customers (shouldn't happen), leave defaults
-                continue
-            demands[idx] = int(round(c.get("Order_Weight", 0)))  # integer kg
-            service_times[idx] = int(round(c.get("Service_Time", 0)))  # minutes
-            # time windows
-            tws = c.get("Time_Window_Start")
-            twe = c.get("Time_Window_End")
-            # pandas time -> convert
-            try:
-                tstart = pd.to_datetime(tws, format="%H:%M", errors="coerce").time() if not pd.isna(tws) else None
-            except Exception:
-                tstart = tws
-            try:
-                tend = pd.to_datetime(twe, format="%H:%M", errors="coerce").time() if not pd.isna(twe) else None
-            except Exception:
-                tend = twe
-            ts_min = time_to_minutes(tstart) if tstart is not None else 0
-            te_min = time_to_minutes(tend) if tend is not None else 24*60
-            if ts_min is None: ts_min = 0
-            if te_min is None: te_min = 24*60
-            time_windows[idx] = (int(ts_min), int(te_min))
-        else:
-            # depot
-            d = depot_dict.get(node)
-            if d is not None:
-                # If depots have operating hours column parsed in data.py as Open_Time/Close_Time (datetime)
-                if "Open_Time" in d and pd.notna(d["Open_Time"]):
-                    ot = d["Open_Time"]
-                    ct = d.get("Close_Time", None)
-                    if pd.notna(ot):
-                        start_min = int(ot.hour*60 + ot.minute)
-                    else:
-                        start_min = 0
-                    if ct is not None and pd.notna(ct):
-                        end_min = int(ct.hour*60 + ct.minute)
-                    else:
-                        end_min = 24*60
-                    time_windows[idx] = (start_min, end_min)
-                else:
-                    time_windows[idx] = (0, 24*60)
-
-    # Vehicle properties lists
-    vehicle_capacities = df_vehicles["Capacity_Weight"].fillna(0).astype(int).tolist()
-    vehicle_max_distance_km = df_vehicles["Max_Distance"].fillna(1e9).astype(float).tolist()
-    vehicle_max_working_hours = df_vehicles["Max_Working_Hours"].fillna(24).astype(float).tolist()
-    vehicle_fixed_costs = df_vehicles["Fixed_Cost"].fillna(0).astype(float).tolist()
-    vehicle_variable_costs = df_vehicles["Variable_Cost"].fillna(0).astype(float).tolist()
-    vehicle_ids = df_vehicles["Vehicle_ID"].tolist()
-
-    return {
-        "num_vehicles": num_vehicles,
-        "num_nodes": num_nodes,
-        "starts": starts,
-        "ends": ends,
-        "all_nodes": all_nodes,
-        "time_lookup": time_lookup,
-        "distance_lookup": distance_lookup,
-        "demands": demands,
-        "service_times": service_times,
-        "time_windows": time_windows,
-        "vehicle_capacities": vehicle_capacities,
-        "vehicle_max_distance_km": vehicle_max_distance_km,
-        "vehicle_max_working_hours": vehicle_max_working_hours,
-        "vehicle_fixed_costs": vehicle_fixed_costs,
-        "vehicle_variable_costs": vehicle_variable_costs,
-        "vehicle_ids": vehicle_ids,
-        "df_customers": df_customers,
-        "df_vehicles": df_vehicles,
-        "df_depots": df_depots
-    }
+    time_band_matrices = None
+    if time_dependent:
+        time_band_matrices, _ = build_time_band_matrices(df_roads_full, df_depots, df_customers)
+
+    neighbors = None
+    if knn:
+        customer_nodes = np.sort(customers)
+        neighbors = build_knn_neighbors(time_matrix, knn, customer_nodes)
+
+    # Chỉ giữ mảng NumPy; các DataFrame được giải phóng khi hàm kết thúc
+    return VRPInstance(
+        all_nodes=list(all_nodes),
+        demands=demands,
+        volumes=volumes,
+        service_times=service_times,
+        time_windows=time_windows,
+        coordinates=coordinates,
+        time_matrix=time_matrix,
+        distance_matrix=distance_matrix,
+        class_names=list(class_restrictions),
+        class_time_matrices=class_time_matrices,
+        class_distance_matrices=class_distance_matrices,
+        time_band_matrices=time_band_matrices,
+        time_band_starts=list(TIME_BAND_STARTS),
+        neighbors=neighbors,
+        vehicles=vehicles,
+        vehicle_ids=df_vehicles["Vehicle_ID"].astype(str).tolist(),
+    )
 
-def solve():
-    data = build_problem()
+def _class_cost_matrices(df_roads_full, df_depots, df_customers, city, process_dir, forbidden=(),
+                         one_way=False, complete_paths=False, path_workers=1, store_dir=None, base_dir=None):
+    """
+    Dựng (hoặc mở từ kho store_dir) cặp ma trận thời gian/quãng đường của một lớp xe.
+    Trả về (time_matrix, distance_matrix, all_nodes).
+    """
+    stored = None
+    if store_dir is not None:
+        all_nodes = list(df_depots["Depot_ID"]) + list(df_customers["Customer_ID"])
+        store_key = matrix_store_key(df_roads_full, all_nodes, complete_paths=complete_paths,
+                                     forbidden=list(forbidden), one_way=one_way)
+        stored = load_matrix_store(store_dir, key=store_key)
+        if stored is not None:
+            print(f"⚡ Đã mở kho ma trận chi phí (memory-map): {store_dir}")
+            return stored
+
+    # Build both time matrix (minutes) and distance matrix (kilometers) in one pass
+    time_matrix, distance_matrix, all_nodes = build_cost_matrices(
+        df_roads_full, df_depots, df_customers, forbidden_restrictions=forbidden, one_way=one_way
+    )
+    if complete_paths:
+        if city is None:
+            cache_dir = Path(base_dir if base_dir is not None else DEFAULT_BASE_DIR) / "processed" / "cache"
+        else:
+            cache_dir = Path(process_dir if process_dir is not None else DEFAULT_PROCESS_DIR) / city / "cache"
+        time_matrix, distance_matrix = complete_cost_matrices(
+            time_matrix, distance_matrix, cache_dir=cache_dir, workers=path_workers
+        )
+    if store_dir is not None:
+        save_matrix_store(store_dir, time_matrix, distance_matrix, all_nodes, key=store_key)
+        return load_matrix_store(store_dir, key=store_key)
+    return time_matrix, distance_matrix, all_nodes
+
+# Các khóa theo node của VRPInstance (dùng khi cắt bài toán con)
+NODE_MATRIX_KEYS = ("time_matrix", "distance_matrix")
+CLASS_MATRIX_KEYS = ("class_time_matrices", "class_distance_matrices")
+NODE_ARRAY_KEYS = ("demands", "volumes", "service_times", "time_windows", "coordinates")
+
+def subset_problem(data, node_indices, vehicle_indices):
+    """
+    Cắt bài toán con gồm các node node_indices và các xe vehicle_indices (chỉ số toàn cục).
+    Depot xuất phát/kết thúc của các xe được giữ lại tự động. Trả về VRPInstance mới (mảng
+    được sao chép), kèm "node_map"/"vehicle_map" (chỉ số cục bộ -> chỉ số gốc).
+    """
+    vehicle_indices = [int(v) for v in vehicle_indices]
+    keep = set(int(n) for n in node_indices)
+    keep.update(int(data["starts"][v]) for v in vehicle_indices)
+    keep.update(int(data["ends"][v]) for v in vehicle_indices)
+    node_map = sorted(keep)
+    idx = np.asarray(node_map, dtype=np.int64)
+    # Chỉ số gốc -> chỉ số cục bộ (-1 nếu node bị loại; phần tử cuối dành cho chỉ số -1)
+    remap = np.full(data["num_nodes"] + 1, -1, dtype=np.int32)
+    remap[idx] = np.arange(len(idx), dtype=np.int32)
+
+    sub = data.copy()
+    sub["all_nodes"] = [data["all_nodes"][i] for i in node_map]
+    sub["vehicles"] = data["vehicles"][vehicle_indices]
+    sub["starts"] = remap[sub["starts"]]
+    sub["ends"] = remap[sub["ends"]]
+    sub["vehicle_ids"] = [data["vehicle_ids"][v] for v in vehicle_indices]
+    for key in NODE_MATRIX_KEYS:
+        sub[key] = _sub_matrix(data[key], idx)
+    for key, base in zip(CLASS_MATRIX_KEYS, NODE_MATRIX_KEYS):
+        sub[key] = [sub[base]] + [_sub_matrix(m, idx) for m in data[key][1:]]
+    for key in NODE_ARRAY_KEYS:
+        if data[key] is not None:
+            sub[key] = data[key][idx]
+    if data.get("time_band_matrices") is not None:
+        sub["time_band_matrices"] = data["time_band_matrices"][:, idx[:, None], idx[None, :]]
+    if data.get("neighbors") is not None:
+        # Đổi chỉ số láng giềng sang chỉ số cục bộ (-1 nếu node láng giềng bị loại)
+        sub["neighbors"] = remap[data["neighbors"][idx]]
+    sub["node_map"] = node_map
+    sub["vehicle_map"] = vehicle_indices
+    return sub
+
+def _sub_matrix(matrix, idx):
+    """Ma trận chi phí con trên các node idx (ma trận thưa giữ nguyên dạng thưa)."""
+    if isinstance(matrix, SparseCostMatrix):
+        return matrix.take(idx)
+    return matrix[np.ix_(idx, idx)]
+
+def class_cost_matrices(data, vehicle_class):
+    """
+    Ma trận (thời gian, quãng đường) của một lớp xe. Lớp 0 luôn đọc từ "time_matrix"/"distance_matrix"
+    để mọi chỉnh sửa trên hai khóa này (vd. bài toán con) vẫn có hiệu lực.
+    """
+    if vehicle_class == 0:
+        return data["time_matrix"], data["distance_matrix"]
+    return data["class_time_matrices"][vehicle_class], data["class_distance_matrices"][vehicle_class]
+
+def departure_time_matrix(data, time_matrix, rows=None, block_rows=512):
+    """
+    Thay thời gian di chuyển trong time_matrix bằng giá trị của khung giờ xuất phát lấy từ
+    data["time_band_matrices"][band, i, j] (nếu có). Giờ xuất phát của cung i -> j được ước lượng
+    max(đầu khung giờ i + phục vụ i, đầu khung giờ j - thời gian đi), nên mỗi cặp chỉ tra một lần
+    và transit vẫn là ma trận N×N (tra O(1) trong solver).
+    Cung bị cấm/thiếu trong time_matrix (>= MISSING_TIME_MIN) giữ nguyên, cặp chỉ có đường đi
+    ngắn nhất (complete_paths) giữ thời gian tĩnh.
+    rows: chỉ tính các dòng này (mặc định mọi node). Trả về mảng float32 mới (len(rows) × N).
+    """
+    if data.get("time_band_matrices") is None:
+        return time_matrix if rows is None else np.asarray(time_matrix[rows], dtype=np.float32)
+    rows = np.arange(data["num_nodes"]) if rows is None else np.asarray(rows, dtype=np.int64)
+    cols = np.arange(data["num_nodes"])
+
+    folded = np.empty((len(rows), len(cols)), dtype=np.float32)
+    for start in range(0, len(rows), block_rows):
+        block = rows[start:start + block_rows]
+        base = np.asarray(time_matrix[block], dtype=np.float32)
+        folded[start:start + len(block)] = departure_travel_times(data, base, block[:, None], cols[None, :])
+    return folded
+
+def departure_travel_times(data, base, origins, destinations):
+    """
+    Thời gian đi các cung origins -> destinations theo khung giờ xuất phát (xem departure_time_matrix);
+    base là thời gian tĩnh tương ứng, origins/destinations broadcast được với base.
+    Dùng cho cả ma trận (departure_time_matrix) lẫn từng cung riêng lẻ (evaluate_routes).
+    """
+    band_starts = np.asarray(data["time_band_starts"], dtype=np.float64)
+    window_start = np.asarray(data["time_windows"], dtype=np.float64)[:, 0]
+    ready = window_start + np.asarray(data["service_times"], dtype=np.float64)
+    depart = np.clip(np.maximum(ready[origins], window_start[destinations] - base), 0, 24 * 60 - 1)
+    band = np.searchsorted(band_starts, depart, side="right") - 1
+    value = data["time_band_matrices"][band, origins, destinations]
+    usable = (value < MISSING_TIME_MIN) & (base < MISSING_TIME_MIN)
+    return np.where(usable, value, base).astype(np.float32, copy=False)
+
+def build_transit_matrices(data, vehicle_class=0):
+    """
+    Tạo ma trận transit số nguyên (int64) cho OR-Tools của một lớp xe, đánh chỉ số theo node:
+    - time: travel_time + service_time tại node xuất phát (phút)
+    - distance: km -> mét
+    """
+    time_matrix, distance_matrix = (np.asarray(m) for m in class_cost_matrices(data, vehicle_class))
+    time_matrix = departure_time_matrix(data, time_matrix)
+    service_times = np.asarray(data["service_times"], dtype=np.float64)
+    time_transit = np.rint(time_matrix + service_times[:, None]).astype(np.int64)
+    distance_transit = np.rint(distance_matrix.astype(np.float64) * 1000.0).astype(np.int64)
+    return time_transit, distance_transit
+
+def transit_matrix_rows(data, vehicle_class, kind, block_rows=256):
+    """
+    Ma trận transit số nguyên của một lớp xe dạng list các dòng (đầu vào của RegisterTransitMatrix),
+    cùng cách làm tròn với build_transit_matrices:
+    - kind="time": travel_time (theo khung giờ nếu có) + service_time tại node xuất phát (phút)
+    - kind="distance": km -> mét
+    Dựng theo khối dòng từ ma trận float32 nên không có ma trận int64 N×N trung gian; trong mỗi dòng
+    các giá trị trùng nhau (vd. cung thiếu MISSING_TIME_MIN) dùng chung một object int của Python.
+    """
+    time_matrix, distance_matrix = class_cost_matrices(data, vehicle_class)
+    service_times = np.asarray(data["service_times"], dtype=np.float64)
+    num_nodes = data["num_nodes"]
+    rows = []
+    for start in range(0, num_nodes, block_rows):
+        block = np.arange(start, min(start + block_rows, num_nodes))
+        if kind == "time":
+            values = departure_time_matrix(data, time_matrix, rows=block) + service_times[block, None]
+        else:
+            values = np.asarray(distance_matrix[block], dtype=np.float64) * 1000.0
+        for row in np.rint(values).astype(np.int64):
+            unique, inverse = np.unique(row, return_inverse=True)
+            rows.append(list(map(unique.tolist().__getitem__, inverse.tolist())))
+    return rows
+
+def _distinct_class_matrices(data, classes, kind):
+    """{lớp xe: lớp đại diện}: các lớp có ma trận giống hệt nhau dùng chung một lớp đại diện."""
+    position = 0 if kind == "time" else 1
+    representative = {}
+    for c in classes:
+        matrix = class_cost_matrices(data, c)[position]
+        representative[c] = next(
+            (r for r in set(representative.values())
+             if cost_matrices_equal(class_cost_matrices(data, r)[position], matrix)),
+            c,
+        )
+    return representative
+
+def _matrix_arcs(matrix, missing_value, rows=None, block_rows=256):
+    """
+    Các cặp (rows, cols) khác đường chéo có giá trị < missing_value trong các dòng rows (mặc định mọi
+    dòng): lấy thẳng từ SparseCostMatrix, hoặc quét theo khối dòng với ma trận dày.
+    """
+    if isinstance(matrix, SparseCostMatrix):
+        if rows is None:
+            origins, destinations, values = matrix.arcs()
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            local, destinations, values = matrix.row_entries(rows)
+            origins = rows[local]
+        keep = values < missing_value
+        return origins[keep], destinations[keep]
+    rows = np.arange(matrix.shape[0]) if rows is None else np.asarray(rows, dtype=np.int64)
+    origins, destinations = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for start in range(0, len(rows), block_rows):
+        block = rows[start:start + block_rows]
+        local, cols = np.nonzero(np.asarray(matrix[block]) < missing_value)
+        keep = block[local] != cols
+        origins.append(block[local][keep])
+        destinations.append(cols[keep])
+    return np.concatenate(origins), np.concatenate(destinations)
+
+def transit_arcs(data, vehicle_class, kind):
+    """
+    Các cung (origins, destinations) cần giá trị transit riêng của một lớp xe: các cung có chi phí thật
+    (không phải MISSING_*). Khi có data["neighbors"], khách hàng bị thu hẹp NextVar (restrict_to_neighbors)
+    chỉ cần các cung láng giềng và cung về điểm kết thúc, nên số cung ~ N×(2k + số depot) kể cả khi
+    ma trận dày (vd. complete_paths); dòng của depot/điểm đầu-cuối vẫn lấy mọi cung có chi phí thật.
+    """
+    time_matrix, distance_matrix = class_cost_matrices(data, vehicle_class)
+    matrix, missing_value = (time_matrix, MISSING_TIME_MIN) if kind == "time" else (distance_matrix, MISSING_DISTANCE_KM)
+    if data.get("neighbors") is None:
+        return _matrix_arcs(matrix, missing_value)
+
+    origins, destinations, restricted = neighbor_arcs(data)
+    customers = np.flatnonzero(restricted)
+    ends = np.unique(data["ends"]).astype(np.int64)
+    free_origins, free_destinations = _matrix_arcs(matrix, missing_value, rows=np.flatnonzero(~restricted))
+    return (np.concatenate([origins, np.repeat(customers, len(ends)), free_origins]),
+            np.concatenate([destinations, np.tile(ends, len(customers)), free_destinations]))
+
+def arc_transit_callback(data, manager, vehicle_class, kind, arcs):
+    """
+    Hàm transit (from_index, to_index) cho RegisterTransitCallback khi ma trận transit N×N quá lớn:
+    giá trị của các cung arcs (origins, destinations) được tính sẵn theo đúng cách làm tròn của
+    transit_matrix_rows và giữ trong dict theo khóa i*N + j; cặp khác nhận giá trị cung thiếu
+    (MISSING_* , cộng phục vụ tại điểm đi với time), đường chéo = phục vụ tại điểm đi / 0.
+    Bộ nhớ tỉ lệ số cung thay vì N².
+    """
+    time_matrix, distance_matrix = class_cost_matrices(data, vehicle_class)
+    service_times = np.asarray(data["service_times"], dtype=np.float64)
+    num_nodes = data["num_nodes"]
+    origins, destinations = (np.asarray(a, dtype=np.int64) for a in arcs)
+    if kind == "time":
+        values = np.asarray(time_matrix[origins, destinations], dtype=np.float32)
+        if data.get("time_band_matrices") is not None:
+            values = departure_travel_times(data, values, origins, destinations)
+        values = values + service_times[origins]
+        missing = np.rint(np.float32(MISSING_TIME_MIN) + service_times).astype(np.int64).tolist()
+        diagonal = np.rint(service_times).astype(np.int64).tolist()
+    else:
+        values = np.asarray(distance_matrix[origins, destinations], dtype=np.float64) * 1000.0
+        missing = [int(np.rint(np.float64(np.float32(MISSING_DISTANCE_KM)) * 1000.0))] * num_nodes
+        diagonal = [0] * num_nodes
+    arc_values = dict(zip((origins * num_nodes + destinations).tolist(),
+                          np.rint(values).astype(np.int64).tolist()))
+
+    def transit(from_index, to_index):
+        i = manager.IndexToNode(from_index)
+        j = manager.IndexToNode(to_index)
+        value = arc_values.get(i * num_nodes + j)
+        if value is None:
+            return diagonal[i] if i == j else missing[i]
+        return value
+
+    return transit
+
+def _transit_plan(data):
+    """(lớp đại diện ma trận time, lớp đại diện ma trận distance, MB ước tính nếu đăng ký ma trận N×N)."""
+    num_nodes = data["num_nodes"]
+    classes = sorted(set(data["vehicle_classes"].tolist()))
+    time_classes = _distinct_class_matrices(data, classes, "time")
+    distance_classes = _distinct_class_matrices(data, classes, "distance")
+    num_matrices = len(set(time_classes.values())) + len(set(distance_classes.values()))
+    # Bản sao C++ của mỗi ma trận + list Python tạm thời của ma trận đang đăng ký (~8 byte/phần tử)
+    transit_mb = (num_matrices + 1) * num_nodes * num_nodes * 8 / 2**20
+    return time_classes, distance_classes, transit_mb
+
+
+def transit_memory_mb(data):
+    """Bộ nhớ (MB) build_routing_model cần để đăng ký transit dạng ma trận N×N cho data."""
+    return _transit_plan(data)[2]
+
+
+@timed()
+def build_routing_model(data):
+    """
+    Dựng RoutingIndexManager + RoutingModel (chi phí, Weight, Volume, Distance, Time, disjunction)
+    từ dữ liệu của build_problem.
+    Ma trận transit được đăng ký một lần cho mỗi ma trận khác nhau của các lớp xe đang có xe
+    (transit_matrix_rows); khi các ma trận N×N cần quá MAX_TRANSIT_MEMORY_MB thì chuyển sang callback
+    tra theo cung (arc_transit_callback), chậm hơn nhưng bộ nhớ chỉ tỉ lệ số cung.
+    Trả về (manager, routing, time_transit, distance_transit); transit không được giữ lại dạng
+    mảng nên time_transit/distance_transit là None (evaluate_routes tra lại từ ma trận chi phí).
+    """
     num_nodes = data["num_nodes"]
     num_vehicles = data["num_vehicles"]
     all_nodes = data["all_nodes"]
+    vehicle_class = data["vehicle_classes"].tolist()
+
+    # --- Ước lượng bộ nhớ transit trước khi cấp phát ---
+    time_classes, distance_classes, transit_mb = _transit_plan(data)
+    use_arcs = transit_mb > MAX_TRANSIT_MEMORY_MB
+    if use_arcs:
+        print(f"⚠️ Ma trận transit {num_nodes:,}×{num_nodes:,} cần ~{transit_mb:,.0f} MB (giới hạn "
+              f"{MAX_TRANSIT_MEMORY_MB:,.0f} MB, LASTMILE_MAX_TRANSIT_MB): dùng callback tra theo cung.")
 
     # Manager & Model
-    manager = pywrapcp.RoutingIndexManager(num_nodes, num_vehicles, data["starts"], data["ends"])
+    manager = pywrapcp.RoutingIndexManager(num_nodes, num_vehicles, data["starts"].tolist(), data["ends"].tolist())
     routing = pywrapcp.RoutingModel(manager)
 
-    # --- Callbacks ---
-    # Time callback: travel_time (minutes) + service_time at origin
-    def time_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        travel_time = data["time_lookup"].get((from_node, to_node), 10**7)
-        service_time = data["service_times"][from_node] if from_node < len(data["service_times"]) else 0
-        return int(round(travel_time + service_time))
+    # --- Transit matrices (lớp xe có ma trận giống nhau dùng chung một callback) ---
+    # Time: travel_time (minutes) + service_time at origin, đã làm tròn sẵn thành số nguyên
+    # Distance: km -> meters (int)
+    time_callbacks, distance_callbacks = {}, {}
+    for kind, representative, callbacks in (("time", time_classes, time_callbacks),
+                                            ("distance", distance_classes, distance_callbacks)):
+        for c in sorted(representative):
+            r = representative[c]
+            if r not in callbacks and use_arcs:
+                arcs = transit_arcs(data, r, kind)
+                callbacks[r] = routing.RegisterTransitCallback(arc_transit_callback(data, manager, r, kind, arcs))
+            elif r not in callbacks:
+                callbacks[r] = routing.RegisterTransitMatrix(transit_matrix_rows(data, r, kind))
+            callbacks[c] = callbacks[r]
+    vehicle_time_callbacks = [time_callbacks[c] for c in vehicle_class]
+    vehicle_distance_callbacks = [distance_callbacks[c] for c in vehicle_class]
 
-    time_callback_index = routing.RegisterTransitCallback(time_callback)
     # Set arc cost evaluator to time (objective minimize total travel+service time)
-    routing.SetArcCostEvaluatorOfAllVehicles(time_callback_index)
-
-    # Distance callback for distance dimension (in meters to use int)
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        # distance_lookup stored in km -> convert to meters and int
-        dist_km = data["distance_lookup"].get((from_node, to_node), 1e6)
-        return int(round(dist_km * 1000.0))
-
-    distance_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-    # --- Ràng buộc tải trọng (Capacity) ---
-    def demand_callback(from_index):
-        node = manager.IndexToNode(from_index)
-        return int(data["demands"][node])
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-
+    if len(set(vehicle_time_callbacks)) == 1:
+        routing.SetArcCostEvaluatorOfAllVehicles(vehicle_time_callbacks[0])
+    else:
+        for v, callback_index in enumerate(vehicle_time_callbacks):
+            routing.SetArcCostEvaluatorOfVehicle(callback_index, v)
+
+    # --- Ràng buộc tải trọng (Weight, kg) và thể tích (Volume, lít) ---
+    # Nhu cầu theo node đăng ký dạng vector nên solver tra trực tiếp, không gọi lại Python
+    demand_callback_index = routing.RegisterUnaryTransitVector(data["demands"].tolist())
     routing.AddDimensionWithVehicleCapacity(
         demand_callback_index,
         0,  # không có độ trễ
-        data["vehicle_capacities"],
+        data["vehicle_capacities"].tolist(),
         True,
         "Weight"
     )
+    if data.get("volumes") is not None:
+        volume_callback_index = routing.RegisterUnaryTransitVector(data["volumes"].tolist())
+        routing.AddDimensionWithVehicleCapacity(
+            volume_callback_index,
+            0,
+            data["vehicle_volume_capacities"].tolist(),
+            True,
+            "Volume"
+        )
 
     # --- Ràng buộc quãng đường (Max_Distance) ---
-    routing.AddDimension(
-        distance_callback_index,
+    routing.AddDimensionWithVehicleTransits(
+        vehicle_distance_callbacks,
         0,
         10**12,       # giới hạn toàn cục rất lớn
         True,
@@ -182,8 +566,8 @@ def solve():
 
     # --- Ràng buộc thời gian (Time Windows) ---
     horizon = 24 * 60  # thời gian tối đa 24h
-    routing.AddDimension(
-        time_callback_index,
+    routing.AddDimensionWithVehicleTransits(
+        vehicle_time_callbacks,
         horizon,  # cho phép chờ tối đa
         horizon,
         False,
@@ -197,108 +581,299 @@ def solve():
         tw = data["time_windows"][node]
         time_dimension.CumulVar(idx).SetRange(int(tw[0]), int(tw[1]))
 
-    # Thiết lập thời gian làm việc tối đa cho từng xe
+    # Thời gian làm việc tối đa cho từng xe: giới hạn span (giờ về depot - giờ xuất phát, gồm chờ)
     for v in range(num_vehicles):
-        start_index = routing.Start(v)
-        end_index = routing.End(v)
-        max_hours = data["vehicle_max_working_hours"][v]
-        max_minutes = int(max_hours * 60)
-        time_dimension.CumulVar(end_index).SetMax(
-            time_dimension.CumulVar(end_index).Max() + max_minutes
-        )
+        max_minutes = int(data["vehicle_max_working_hours"][v] * 60)
+        time_dimension.SetSpanUpperBoundForVehicle(max_minutes, v)
+
+    # --- Giới hạn láng giềng (k-NN): khách hàng chỉ đi tới k khách gần nhất hoặc về depot ---
+    if data.get("neighbors") is not None:
+        restrict_to_neighbors(data, manager, routing)
 
     # --- Cho phép bỏ qua khách hàng (với chi phí phạt cao) ---
+    # (bỏ qua node đang là điểm xuất phát/kết thúc của xe, vd. điểm dừng đang phục vụ khi giải cuốn chiếu)
     penalty = 1_000_000
+    terminal_nodes = set(data["starts"].tolist()) | set(data["ends"].tolist())
     for node_idx, node in enumerate(all_nodes):
-        if str(node).startswith("C"):
+        if str(node).startswith("C") and node_idx not in terminal_nodes:
             idx = manager.NodeToIndex(node_idx)
             routing.AddDisjunction([idx], penalty)
 
-    # --- Thông số tìm kiếm ---
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    search_parameters.time_limit.seconds = 180
-    search_parameters.log_search = False
+    return manager, routing, None, None
 
-    # --- Giải bài toán ---
-    print("🔎 Đang giải bài toán VRPTW ...")
-    solution = routing.SolveWithParameters(search_parameters)
 
-    if solution is None:
-        print("❌ Không tìm thấy nghiệm khả thi.")
-        return
+def neighbor_arcs(data):
+    """
+    Các cung láng giềng mà restrict_to_neighbors cho phép đi ra từ khách hàng: j là láng giềng của i
+    hoặc i là láng giềng của j trong data["neighbors"], j không phải điểm đầu/cuối của xe.
+    Trả về (origins, destinations, restricted): restricted[i] = True nếu NextVar của node i bị thu hẹp
+    (khách hàng không phải điểm đầu/cuối của xe); ngoài các cung này node đó chỉ được về điểm kết thúc.
+    """
+    num_nodes = data["num_nodes"]
+    terminal = np.zeros(num_nodes, dtype=bool)
+    terminal[data["starts"]] = True
+    terminal[data["ends"]] = True
+    is_customer = np.array([str(node).startswith("C") for node in data["all_nodes"]], dtype=bool)
+    restricted = is_customer & ~terminal
+
+    neighbors = data["neighbors"]
+    rows, cols = np.nonzero(neighbors >= 0)
+    targets = neighbors[rows, cols].astype(np.int64)
+    origins = np.concatenate([rows, targets])
+    destinations = np.concatenate([targets, rows])
+    keep = restricted[origins] & ~terminal[destinations] & (origins != destinations)
+    keys = np.unique(origins[keep] * num_nodes + destinations[keep])
+    return keys // num_nodes, keys % num_nodes, restricted
+
+def restrict_to_neighbors(data, manager, routing):
+    """
+    Thu hẹp miền NextVar của mỗi khách hàng về: các láng giềng trong data["neighbors"]
+    (lấy đối xứng, xem neighbor_arcs), mọi điểm kết thúc của xe (liên kết về depot) và chính nó
+    (khi bị bỏ qua). PATH_CHEAPEST_ARC và local search nhờ đó không xét các cung vô vọng.
+    """
+    origins, destinations, restricted = neighbor_arcs(data)
+    # origins đã sắp tăng dần (neighbor_arcs lấy từ khóa i*N + j đã sắp xếp)
+    bounds = np.searchsorted(origins, np.arange(data["num_nodes"] + 1))
+
+    end_indices = [routing.End(v) for v in range(data["num_vehicles"])]
+    for node_idx in np.flatnonzero(restricted).tolist():
+        index = manager.NodeToIndex(node_idx)
+        allowed = [index] + end_indices
+        allowed += [manager.NodeToIndex(m) for m in destinations[bounds[node_idx]:bounds[node_idx + 1]].tolist()]
+        routing.NextVar(index).SetValues(allowed)
+
+def make_search_parameters(time_limit=180, first_solution="PATH_CHEAPEST_ARC",
+                           metaheuristic="GUIDED_LOCAL_SEARCH"):
+    """
+    Thông số tìm kiếm (mặc định PATH_CHEAPEST_ARC + GUIDED_LOCAL_SEARCH).
+    first_solution / metaheuristic là tên trong FirstSolutionStrategy / LocalSearchMetaheuristic
+    của OR-Tools (vd. "SAVINGS", "TABU_SEARCH").
+    """
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution)
+    search_parameters.local_search_metaheuristic = getattr(
+        routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic
+    )
+    search_parameters.time_limit.seconds = int(time_limit)
+    search_parameters.log_search = False
+    return search_parameters
+
+
+class _CurrentAssignment:
+    """Bọc giá trị hiện tại của biến (trong AtSolutionCallback) theo giao diện Assignment.Value()."""
+
+    def Value(self, var):
+        return var.Value()
+
+
+class SolutionMonitor:
+    """
+    Theo dõi nghiệm trong lúc giải qua routing.AddAtSolutionCallback (chế độ anytime):
+    - history: [(giây kể từ lúc bắt đầu, objective)] của mỗi nghiệm cải thiện
+    - stall_window: nếu có, dừng tìm kiếm khi objective giảm ít hơn min_improvement (tương đối)
+      trong stall_window giây gần nhất; chỉ kiểm tra khi solver báo nghiệm mới
+    - on_solution(snapshot) / stream_path (JSON lines): nhận lộ trình tạm của mỗi nghiệm cải thiện,
+      snapshot = dict của extract_solution kèm "elapsed_s" và "objective"
+    """
+
+    def __init__(self, data, manager, routing, time_transit, distance_transit,
+                 stall_window=None, min_improvement=0.005, on_solution=None, stream_path=None):
+        self.data = data
+        self.manager = manager
+        self.routing = routing
+        self.time_transit = time_transit
+        self.distance_transit = distance_transit
+        self.stall_window = stall_window
+        self.min_improvement = min_improvement
+        self.on_solution = on_solution
+        self.stream_path = stream_path
+        self.history = []
+        self.stopped_early = False
+        self._t0 = time.perf_counter()
+        if stream_path is not None:
+            open(stream_path, "w", encoding="utf-8").close()
+
+    def __call__(self):
+        objective = self.routing.CostVar().Value()
+        elapsed = time.perf_counter() - self._t0
+        if not self.history or objective < self.history[-1][1]:
+            self.history.append((round(elapsed, 3), objective))
+            if self.on_solution is not None or self.stream_path is not None:
+                self._publish(elapsed, objective)
+        if self.stall_window is not None and self._stalled(elapsed):
+            self.stopped_early = True
+            self.routing.solver().FinishCurrentSearch()
+
+    def _stalled(self, elapsed):
+        """Objective tốt nhất cách đây stall_window giây so với hiện tại có giảm đủ min_improvement không."""
+        if elapsed < self.stall_window:
+            return False
+        reference = self.history[0][1]
+        for t, objective in self.history:
+            if t > elapsed - self.stall_window:
+                break
+            reference = objective
+        best = self.history[-1][1]
+        return reference - best < self.min_improvement * abs(reference)
+
+    def _publish(self, elapsed, objective):
+        snapshot = extract_solution(self.data, self.manager, self.routing, _CurrentAssignment(),
+                                    self.time_transit, self.distance_transit)
+        snapshot["elapsed_s"] = round(elapsed, 3)
+        snapshot["objective"] = objective
+        if self.on_solution is not None:
+            self.on_solution(snapshot)
+        if self.stream_path is not None:
+            with open(self.stream_path, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(snapshot, ensure_ascii=False, default=str) + "\n")
+
+
+def extract_solution(data, manager, routing, solution, time_transit, distance_transit):
+    """Trích xuất lộ trình, tổng quãng đường/thời gian/chi phí và khách hàng chưa phục vụ."""
+    from backend.optimizer.evaluate import evaluate_routes  # evaluate.py import module này
 
-    # --- Trích xuất kết quả ---
-    routes = []
-    total_distance_m = 0
-    total_time_min = 0
-    used_vehicles = set()
-    unserved = []
+    all_nodes = data["all_nodes"]
 
-    for v in range(num_vehicles):
+    # --- Trích xuất chuỗi node của các xe được sử dụng ---
+    index_routes, vehicles = [], []
+    for v in range(data["num_vehicles"]):
         index = routing.Start(v)
         if routing.IsEnd(solution.Value(routing.NextVar(index))):
             continue  # xe không được sử dụng
-
-        route_nodes = []
-        route_distance = 0
-        route_time = 0
-        used_vehicles.add(v)
-
+        route = [manager.IndexToNode(index)]
         while not routing.IsEnd(index):
-            node_idx = manager.IndexToNode(index)
-            route_nodes.append(all_nodes[node_idx])
-            next_index = solution.Value(routing.NextVar(index))
-            dist_m = distance_callback(index, next_index)
-            t_min = time_callback(index, next_index)
-            route_distance += dist_m
-            route_time += t_min
-            index = next_index
-
-        node_idx = manager.IndexToNode(index)
-        route_nodes.append(all_nodes[node_idx])
-
-        total_distance_m += route_distance
-        total_time_min += route_time
-        routes.append({
+            index = solution.Value(routing.NextVar(index))
+            route.append(manager.IndexToNode(index))
+        index_routes.append(np.array(route, dtype=np.int64))
+        vehicles.append(v)
+
+    # --- Quãng đường, thời gian, chi phí của mọi lộ trình (tra ma trận transit một lần) ---
+    evaluation = evaluate_routes(data, index_routes, vehicles, time_transit, distance_transit)
+    routes = [
+        {
             "vehicle_index": v,
             "vehicle_id": data["vehicle_ids"][v],
-            "route": route_nodes,
-            "distance_m": route_distance,
-            "time_min": route_time
-        })
+            "route": [all_nodes[n] for n in route.tolist()],
+            "distance_m": int(evaluation["distance_m"][r]),
+            "time_min": int(evaluation["time_min"][r]),
+        }
+        for r, (v, route) in enumerate(zip(vehicles, index_routes))
+    ]
 
     # --- Xác định khách hàng chưa phục vụ ---
-    served = {n for r in routes for n in r["route"] if str(n).startswith("C")}
-    unserved = [node for node in all_nodes if str(node).startswith("C") and node not in served]
-
-    # --- Tính chi phí ---
-    total_cost = 0.0
-    for r in routes:
-        vidx = r["vehicle_index"]
-        fixed = data["vehicle_fixed_costs"][vidx]
-        var = data["vehicle_variable_costs"][vidx]
-        dist_km = r["distance_m"] / 1000.0
-        total_cost += fixed + var * dist_km
+    served = set(evaluation["stops"]["node"].tolist())
+    unserved = [node for i, node in enumerate(all_nodes) if str(node).startswith("C") and i not in served]
 
+    return {
+        "routes": routes,
+        "total_distance_km": evaluation["total_distance_km"],
+        "total_time_min": evaluation["total_time_min"],
+        "total_cost": evaluation["total_cost"],
+        "unserved_customers": unserved
+    }
+
+
+def print_solution(result, num_vehicles):
+    """In tổng kết và lộ trình từng xe."""
     # --- Tổng kết ---
     print("\n--- TỔNG KẾT KẾT QUẢ ---")
-    print(f"Số xe được sử dụng: {len(used_vehicles)} / {num_vehicles}")
-    print(f"Tổng quãng đường (km): {total_distance_m/1000.0:.2f}")
-    print(f"Tổng thời gian (phút): {total_time_min:.1f}")
-    print(f"Tổng chi phí ước tính: {total_cost:.2f}")
-    print(f"Số khách hàng chưa phục vụ: {len(unserved)}")
+    print(f"Số xe được sử dụng: {len(result['routes'])} / {num_vehicles}")
+    print(f"Tổng quãng đường (km): {result['total_distance_km']:.2f}")
+    print(f"Tổng thời gian (phút): {result['total_time_min']:.1f}")
+    print(f"Tổng chi phí ước tính: {result['total_cost']:.2f}")
+    print(f"Số khách hàng chưa phục vụ: {len(result['unserved_customers'])}")
 
     # Hiển thị lộ trình từng xe
-    for r in routes:
+    for r in result['routes']:
         print(f"🚚 {r['vehicle_id']}: {' -> '.join(r['route'])}  | {r['distance_m']/1000.0:.2f} km, {r['time_min']:.1f} phút")
 
-    return {
-        "routes": routes,
-        "total_distance_km": total_distance_m/1000.0,
-        "total_time_min": total_time_min,
-        "total_cost": total_cost,
-        "unserved_customers": unserved
-    }
-if __name__ == "__main__": solve()
\ No newline at end of file
+
+@timed()
+def solve(city=None, process_dir=None, time_limit=180, data=None, verbose=True, matrix_store=None,
+          stall_window=None, min_improvement=0.005, on_solution=None, stream_path=None):
+    """
+    Giải VRPTW và trả về dict kết quả (routes, tổng quãng đường/thời gian/chi phí, khách chưa phục vụ).
+    data: dữ liệu đã dựng sẵn (vd. bài toán con); nếu None sẽ gọi build_problem(city, process_dir).
+    verbose=False để không in tiến trình và lộ trình (dùng trong worker process).
+    matrix_store: thư mục kho ma trận dùng chung (xem build_problem).
+    stall_window / min_improvement / on_solution / stream_path: chế độ anytime (SolutionMonitor);
+    khi bật, kết quả có thêm "search_history" và "stopped_early".
+    """
+    if data is None:
+        data = build_problem(city=city, process_dir=process_dir, matrix_store=matrix_store)
+
+    manager, routing, time_transit, distance_transit = build_routing_model(data)
+    search_parameters = make_search_parameters(time_limit)
+
+    monitor = None
+    if stall_window is not None or on_solution is not None or stream_path is not None:
+        monitor = SolutionMonitor(data, manager, routing, time_transit, distance_transit,
+                                  stall_window=stall_window, min_improvement=min_improvement,
+                                  on_solution=on_solution, stream_path=stream_path)
+        routing.AddAtSolutionCallback(monitor)
+
+    # --- Giải bài toán ---
+    if verbose:
+        print("🔎 Đang giải bài toán VRPTW ...")
+    with instrumentation.stage("search", time_limit_s=int(time_limit)) as metrics:
+        solution = routing.SolveWithParameters(search_parameters)
+        solver = routing.solver()
+        metrics.update(
+            branches=solver.Branches(),
+            failures=solver.Failures(),
+            solutions=solver.Solutions(),
+            accepted_neighbors=solver.AcceptedNeighbors(),
+            objective=solution.ObjectiveValue() if solution is not None else None,
+        )
+        if monitor is not None:
+            metrics["objective_history"] = monitor.history
+
+    if solution is None:
+        if verbose:
+            print("❌ Không tìm thấy nghiệm khả thi.")
+        return
+
+    result = extract_solution(data, manager, routing, solution, time_transit, distance_transit)
+    result["objective"] = solution.ObjectiveValue()
+    if monitor is not None:
+        result["search_history"] = monitor.history
+        result["stopped_early"] = monitor.stopped_early
+        if verbose and monitor.stopped_early:
+            print(f"⏹️ Dừng sớm sau {monitor.history[-1][0]:.1f}s do objective không còn cải thiện đáng kể.")
+    if verbose:
+        print_solution(result, data["num_vehicles"])
+    return result
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Giải bài toán VRPTW bằng OR-Tools")
+    parser.add_argument("--city", help="Tên folder thành phố trong data/process (vd: Can_Tho); bỏ trống = toàn quốc")
+    parser.add_argument("--process-dir", help="Thư mục chứa các folder thành phố (mặc định data/process)")
+    parser.add_argument("--time-limit", type=int, default=180, help="Giới hạn thời gian tìm kiếm (giây)")
+    parser.add_argument("--knn", type=int, help="Chỉ giữ k láng giềng gần nhất cho mỗi khách hàng")
+    parser.add_argument("--complete-paths", action="store_true",
+                        help="Điền cặp node thiếu cung bằng đường đi ngắn nhất (có cache)")
+    parser.add_argument("--path-workers", type=int, default=1, help="Số process tính đường đi ngắn nhất")
+    parser.add_argument("--matrix-store", help="Thư mục kho ma trận .npy dùng chung (memory-map)")
+    parser.add_argument("--restrictions", action="store_true",
+                        help="Áp dụng Road_Restrictions (một chiều, cấm xe nặng) theo lớp xe")
+    parser.add_argument("--time-dependent", action="store_true",
+                        help="Thời gian di chuyển theo khung giờ (cao điểm) và Traffic_Level")
+    parser.add_argument("--stall-window", type=float,
+                        help="Dừng khi objective giảm ít hơn --min-improvement trong chừng ấy giây gần nhất")
+    parser.add_argument("--min-improvement", type=float, default=0.005,
+                        help="Mức cải thiện tương đối tối thiểu trong cửa sổ --stall-window")
+    parser.add_argument("--stream", help="Ghi lộ trình tạm của mỗi nghiệm cải thiện ra file JSON lines")
+    parser.add_argument("--metrics-log", help="Ghi thời gian/bộ nhớ từng bước ra file JSON lines")
+    parser.add_argument("--trace-memory", action="store_true", help="Đo thêm đỉnh bộ nhớ bằng tracemalloc (chậm)")
+    parser.add_argument("--profile-dir", help="Chạy cProfile cho từng bước và lưu file .prof vào thư mục này")
+    args = parser.parse_args()
+    instrumentation.configure(log_path=args.metrics_log, trace_memory=args.trace_memory or None,
+                              profile_dir=args.profile_dir)
+    data = build_problem(city=args.city, process_dir=args.process_dir, knn=args.knn,
+                         complete_paths=args.complete_paths, path_workers=args.path_workers,
+                         matrix_store=args.matrix_store, restrictions=args.restrictions,
+                         time_dependent=args.time_dependent)
+    solve(data=data, time_limit=args.time_limit, stall_window=args.stall_window,
+          min_improvement=args.min_improvement, stream_path=args.stream)
\ No newline at end of file
@@ -1,19 +1,144 @@
 import pandas as pd
+import numpy as np
 from pathlib import Path
 import glob
 import os
 
-def filter_roads_by_city():
+from backend import instrumentation
+from backend.data_processing.data import ROAD_DTYPES, read_city_table
+from backend.instrumentation import timed
+
+# Số dòng road đọc mỗi lần; bộ nhớ đỉnh tỉ lệ với giá trị này thay vì kích thước file
+DEFAULT_CHUNKSIZE = 200_000
+
+
+def build_node_city_index(city_node_ids, city_names):
+    """
+    Tạo chỉ mục node -> thành phố: trả về (pd.Index các node_id, mảng mã thành phố tương ứng).
+    Mã thành phố là vị trí trong city_names; node thuộc nhiều thành phố lấy thành phố đầu tiên.
+    """
+    ids = []
+    codes = []
+    for code, city_name in enumerate(city_names):
+        nodes = sorted(city_node_ids[city_name])
+        ids.extend(nodes)
+        codes.extend([code] * len(nodes))
+    node_ids = pd.Index(ids)
+    first = ~node_ids.duplicated()
+    return node_ids[first], np.asarray(codes, dtype=np.int32)[first]
+
+
+def depot_of_road_file(road_file):
+    """Depot ID của file road (roads_D001_1.csv hoặc D001_1.csv -> D001_1)."""
+    stem = Path(road_file).stem.strip().upper()
+    return stem[len("ROADS_"):] if stem.startswith("ROADS_") else stem
+
+
+def iter_city_shards(road_file, customer_ids, customer_city, file_cities, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Đọc một file road theo từng chunk và yield (mã thành phố, DataFrame) theo quy tắc lọc gốc:
+    dòng thuộc thành phố c nếu có ít nhất một đầu mút là customer của c và không đầu mút nào là
+    customer của thành phố khác; chỉ xét các thành phố trong file_cities (thành phố có depot của file).
+    Dòng trùng trong cùng chunk bị loại ở đây, trùng giữa các chunk được loại khi hoàn tất file shard.
+    """
+    file_cities = np.asarray(sorted(file_cities), dtype=np.int32)
+    for df_chunk in pd.read_csv(road_file, chunksize=chunksize, dtype=ROAD_DTYPES):
+        df_chunk["Origin_Node_ID"] = df_chunk["Origin_Node_ID"].astype(str).str.strip().str.upper()
+        df_chunk["Destination_Node_ID"] = df_chunk["Destination_Node_ID"].astype(str).str.strip().str.upper()
+        origin_pos = customer_ids.get_indexer(df_chunk["Origin_Node_ID"])
+        dest_pos = customer_ids.get_indexer(df_chunk["Destination_Node_ID"])
+        origin_city = np.where(origin_pos >= 0, customer_city[origin_pos], -1)
+        dest_city = np.where(dest_pos >= 0, customer_city[dest_pos], -1)
+        row_city = np.where(origin_city >= 0, origin_city, dest_city)
+        row_city[(origin_city >= 0) & (dest_city >= 0) & (origin_city != dest_city)] = -1
+        row_city[~np.isin(row_city, file_cities)] = -1
+        for code in np.unique(row_city[row_city >= 0]):
+            yield int(code), df_chunk[row_city == code].drop_duplicates()
+
+
+def drop_duplicate_roads(path):
+    """Loại dòng trùng trong file shard roads.parquet của một thành phố; trả về số dòng còn lại."""
+    df_roads = pd.read_parquet(path)
+    deduplicated = df_roads.drop_duplicates(ignore_index=True)
+    if len(deduplicated) < len(df_roads):
+        deduplicated.to_parquet(path, index=False)
+    return len(deduplicated)
+
+
+class RoadsParquetWriter:
+    """
+    Ghi road ra file .parquet theo từng lô (mỗi lô là một row group) với schema cố định
+    theo ROAD_DTYPES, nên không cần giữ toàn bộ bảng trong bộ nhớ.
+    """
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.rows = 0
+        self._pa = pa
+        self._schema = pa.schema([
+            (col, pa.float64() if dtype == "float64" else pa.string())
+            for col, dtype in ROAD_DTYPES.items()
+        ])
+        self._writer = pq.ParquetWriter(str(path), self._schema)
+
+    def write(self, df):
+        if len(df) == 0:
+            return
+        table = self._pa.Table.from_pandas(df[self._schema.names], schema=self._schema, preserve_index=False)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        self._writer.close()
+
+
+class RoadsExcelWriter:
+    """
+    Ghi road ra file .xlsx theo từng lô bằng openpyxl ở chế độ write_only
+    (dòng được đẩy thẳng ra file tạm, không giữ toàn bộ bảng trong bộ nhớ).
+    """
+
+    def __init__(self, path):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.rows = 0
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet()
+        self._columns = None
+
+    def write(self, df):
+        if len(df) == 0:
+            return
+        if self._columns is None:
+            self._columns = list(df.columns)
+            self._sheet.append(self._columns)
+        values = df[self._columns].astype(object).where(df[self._columns].notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            self._sheet.append(row)
+        self.rows += len(df)
+
+    def close(self):
+        self._workbook.save(self.path)
+
+
+@timed()
+def filter_roads_by_city(chunksize=DEFAULT_CHUNKSIZE, export_excel=False):
     """
     Lọc các tuyến đường theo từng thành phố dựa trên customers đã được tách
     Logic:
-    1. Đọc customers từ mỗi thành phố trong data/process
-    2. Đọc tất cả các file road từ data/LMDO data_3i/roads
-    3. Với mỗi thành phố:
-       - Lấy danh sách Customer_ID
-       - Lọc các road có Origin_Node_ID hoặc Destination_Node_ID là customer trong thành phố đó
-       - Chỉ giữ lại road nếu cả Origin và Destination đều là customer trong thành phố đó
-       - Lưu vào folder của thành phố đó
+    1. Đọc customers và depots từ mỗi thành phố trong data/process
+    2. Xây chỉ mục customer -> thành phố và depot -> các thành phố
+    3. Duyệt mỗi file road (roads_<Depot_ID>.csv) đúng một lần, với các thành phố có depot đó:
+       - Giữ road có Origin_Node_ID hoặc Destination_Node_ID là customer của thành phố
+       - Loại road có đầu mút là customer của thành phố khác
+       - Ghi dòng đó vào shard (roads.parquet) trong folder của thành phố đó
+    4. Loại dòng trùng trên từng shard (và ghi roads.xlsx nếu export_excel=True, chậm)
+    File road được đọc theo từng chunk (chunksize dòng) và ghi dần ra output,
+    nên bộ nhớ đỉnh khi duyệt bị chặn bởi chunksize; bước 4 chỉ đọc lại road của một thành phố.
     """
     
     # Đường dẫn
@@ -51,12 +176,14 @@ def filter_roads_by_city():
     
     for city_folder in city_folders:
         city_name = city_folder.name
-        customers_file = city_folder / "customers.xlsx"
+        try:
+            df_city_customers = read_city_table(city_folder, "customers")
+        except Exception as e:
+            print(f"⚠️ {city_name}: Lỗi khi đọc customers - {str(e)}")
+            continue
         
-        if customers_file.exists():
+        if df_city_customers is not None:
             try:
-                df_city_customers = pd.read_excel(customers_file)
-                
                 # Tìm cột Customer_ID
                 customer_id_col = None
                 for col in df_city_customers.columns:
@@ -89,20 +216,15 @@ def filter_roads_by_city():
     print(f"✅ Đã đọc customers từ {len(all_city_customer_ids)} thành phố")
     print(f"   - Tổng số customers: {len(all_customers_all_cities)}")
     
-    # Xử lý từng thành phố
+    # Xác định tập node (customers + depots) của từng thành phố
     print("\n" + "="*60)
-    print("🔄 Đang lọc tuyến đường theo từng thành phố...")
+    print("🔄 Đang xây dựng chỉ mục node -> thành phố...")
+    city_node_ids = {}  # {city_name: set of node_ids}
+    city_folder_by_name = {}
     
     for city_folder in city_folders:
         city_name = city_folder.name
-        customers_file = city_folder / "customers.xlsx"
-        depots_file = city_folder / "depots.xlsx"
-        
-        # Kiểm tra file customers tồn tại
-        if not customers_file.exists():
-            print(f"\n⚠️ {city_name}: Không tìm thấy file customers.xlsx, bỏ qua")
-            continue
-        
+        # Kiểm tra dữ liệu customers tồn tại
         if city_name not in all_city_customer_ids:
             print(f"\n⚠️ {city_name}: Không có dữ liệu customers, bỏ qua")
             continue
@@ -116,10 +238,13 @@ def filter_roads_by_city():
             
             # Đọc depots của thành phố
             city_depot_ids = set()
-            if depots_file.exists():
+            df_city_depots = None
+            try:
+                df_city_depots = read_city_table(city_folder, "depots")
+            except Exception as e:
+                print(f"   ⚠️ Không đọc được depots: {str(e)}")
+            if df_city_depots is not None:
                 try:
-                    df_city_depots = pd.read_excel(depots_file)
-                    
                     # Tìm cột Depot_ID
                     depot_id_col = None
                     for col in df_city_depots.columns:
@@ -151,122 +276,87 @@ def filter_roads_by_city():
             print(f"   - Số lượng depots: {len(city_depot_ids)}")
             print(f"   - Depot IDs: {sorted(list(city_depot_ids))[:5]}{'...' if len(city_depot_ids) > 5 else ''}")
             
-            # Tìm và đọc file road liên quan đến depot của thành phố này
-            # Format: depot D001_1 -> file roads_D001_D002/roads_D001_1.csv
-            df_city_roads_list = []
-            
-            for depot_id in city_depot_ids:
-                # Tìm thư mục chứa depot này (ví dụ: D001_1 -> roads_D001_D002)
-                depot_prefix = depot_id.split('_')[0]  # D001 từ D001_1
-                
-                # Tìm thư mục road chứa depot này
-                matching_subdir = None
-                for subdir in road_subdirs:
-                    # Kiểm tra xem tên thư mục có chứa depot prefix không
-                    # Ví dụ: roads_D001_D002 chứa D001
-                    if depot_prefix in subdir.name:
-                        matching_subdir = subdir
-                        break
-                
-                if not matching_subdir:
-                    print(f"   ⚠️ Không tìm thấy thư mục road cho depot {depot_id} (prefix: {depot_prefix})")
-                    continue
-                
-                # Tìm file road cho depot này
-                # Format: roads_D001_1.csv, roads_D001_2.csv, etc.
-                road_file_pattern = matching_subdir / f"roads_{depot_id}.csv"
-                
-                if not road_file_pattern.exists():
-                    # Thử tìm file với format khác (có thể không có prefix "roads_")
-                    alt_pattern = matching_subdir / f"{depot_id}.csv"
-                    if alt_pattern.exists():
-                        road_file_pattern = alt_pattern
-                    else:
-                        print(f"   ⚠️ Không tìm thấy file road cho depot {depot_id}: {road_file_pattern.name}")
-                        # Liệt kê các file có sẵn trong thư mục để debug
-                        available_files = list(matching_subdir.glob("*.csv"))
-                        if len(available_files) > 0:
-                            print(f"      Các file có sẵn: {[f.name for f in available_files[:5]]}{'...' if len(available_files) > 5 else ''}")
-                        continue
-                
-                try:
-                    df_road = pd.read_csv(road_file_pattern)
-                    
-                    # Chuẩn hóa dữ liệu
-                    if "Origin_Node_ID" in df_road.columns and "Destination_Node_ID" in df_road.columns:
-                        df_road["Origin_Node_ID"] = df_road["Origin_Node_ID"].astype(str).str.strip().str.upper()
-                        df_road["Destination_Node_ID"] = df_road["Destination_Node_ID"].astype(str).str.strip().str.upper()
-                        df_road = df_road.dropna(subset=["Origin_Node_ID", "Destination_Node_ID"])
-                        
-                        # Lọc chỉ giữ lại road có customer thuộc thành phố này
-                        # Loại bỏ road có customer ngoài tỉnh
-                        customers_other_cities = all_customers_all_cities - city_customer_ids
-                        
-                        df_road_filtered = df_road[
-                            (
-                                (df_road["Origin_Node_ID"].isin(city_customer_ids)) |
-                                (df_road["Destination_Node_ID"].isin(city_customer_ids))
-                            ) &
-                            ~(
-                                (df_road["Origin_Node_ID"].isin(customers_other_cities)) |
-                                (df_road["Destination_Node_ID"].isin(customers_other_cities))
-                            )
-                        ].copy()
-                        
-                        if len(df_road_filtered) > 0:
-                            df_city_roads_list.append(df_road_filtered)
-                            print(f"   - ✅ Đọc {road_file_pattern.name}: {len(df_road_filtered)} tuyến đường")
-                        else:
-                            print(f"   - ⚠️ File {road_file_pattern.name} không có road nào phù hợp với customers của thành phố")
-                    else:
-                        print(f"   ⚠️ File {road_file_pattern.name} không có cột Origin_Node_ID hoặc Destination_Node_ID")
-                except Exception as e:
-                    print(f"   ⚠️ Lỗi khi đọc file {road_file_pattern}: {str(e)}")
-                    import traceback
-                    print(f"      Chi tiết: {traceback.format_exc()}")
-                    continue
-            
-            # Gộp tất cả road của thành phố
-            if len(df_city_roads_list) > 0:
-                df_city_roads = pd.concat(df_city_roads_list, ignore_index=True)
-                # Loại bỏ duplicate nếu có
-                df_city_roads = df_city_roads.drop_duplicates()
-            else:
-                df_city_roads = pd.DataFrame()
-            
-            print(f"   - Tổng số tuyến đường: {len(df_city_roads)}")
-            
-            # Lưu file road cho thành phố
-            roads_output = city_folder / "roads.xlsx"
-            
-            try:
-                if len(df_city_roads) > 0:
-                    df_city_roads.to_excel(roads_output, index=False, engine='openpyxl')
-                    print(f"   - ✅ Đã lưu {len(df_city_roads)} tuyến đường vào: {roads_output}")
-                else:
-                    # Tạo file rỗng nếu không có dữ liệu
-                    pd.DataFrame().to_excel(roads_output, index=False, engine='openpyxl')
-                    print(f"   - ⚠️ Không có tuyến đường nào, đã tạo file rỗng")
-            except ImportError:
-                # Nếu không có openpyxl, thử dùng mặc định
-                try:
-                    if len(df_city_roads) > 0:
-                        df_city_roads.to_excel(roads_output, index=False)
-                        print(f"   - ✅ Đã lưu {len(df_city_roads)} tuyến đường vào: {roads_output}")
-                    else:
-                        pd.DataFrame().to_excel(roads_output, index=False)
-                        print(f"   - ⚠️ Không có tuyến đường nào, đã tạo file rỗng")
-                except Exception as e:
-                    print(f"   - ❌ Lỗi khi lưu file: {str(e)}")
+            city_node_ids[city_name] = city_customer_ids | city_depot_ids
+            city_folder_by_name[city_name] = city_folder
             
         except Exception as e:
             print(f"\n❌ {city_name}: Lỗi khi xử lý - {str(e)}")
             continue
     
+    if len(city_node_ids) == 0:
+        print("\n❌ Không có thành phố nào đủ dữ liệu customers và depots để lọc road.")
+        return
+    
+    city_names = sorted(city_node_ids)
+    customer_ids, customer_city = build_node_city_index(
+        {city_name: all_city_customer_ids[city_name] for city_name in city_names}, city_names
+    )
+    depot_cities = {}  # {depot_id: set of city codes}
+    for code, city_name in enumerate(city_names):
+        for depot_id in city_node_ids[city_name] - all_city_customer_ids[city_name]:
+            depot_cities.setdefault(depot_id, set()).add(code)
+    
+    # Đọc mỗi file road đúng một lần, định tuyến từng dòng tới shard của thành phố tương ứng
+    road_files = sorted(f for d in road_subdirs for f in d.glob("*.csv"))
+    print("\n" + "="*60)
+    print(f"🔄 Đang phân tách {len(road_files)} file road cho {len(city_names)} thành phố (1 lượt đọc)...")
+    
+    writers = {
+        city_name: RoadsParquetWriter(city_folder_by_name[city_name] / "roads.parquet") for city_name in city_names
+    }
+    
+    for road_file in road_files:
+        file_cities = depot_cities.get(depot_of_road_file(road_file))
+        if not file_cities:
+            continue
+        try:
+            file_rows = 0
+            for city_code, df_shard in iter_city_shards(road_file, customer_ids, customer_city, file_cities,
+                                                        chunksize=chunksize):
+                writers[city_names[city_code]].write(df_shard)
+                file_rows += len(df_shard)
+            print(f"   - ✅ Đọc {road_file.parent.name}/{road_file.name}: {file_rows} tuyến đường được giữ lại")
+        except KeyError:
+            print(f"   ⚠️ File {road_file.name} không có cột Origin_Node_ID hoặc Destination_Node_ID")
+        except Exception as e:
+            print(f"   ⚠️ Lỗi khi đọc file {road_file}: {str(e)}")
+            import traceback
+            print(f"      Chi tiết: {traceback.format_exc()}")
+            continue
+    
+    # Hoàn tất file road cho từng thành phố: loại dòng trùng giữa các chunk/file
+    for city_name in city_names:
+        writer = writers[city_name]
+        try:
+            writer.close()
+            rows = drop_duplicate_roads(writer.path)
+            print(f"\n📊 {city_name}: Tổng số tuyến đường: {rows}")
+            if rows > 0:
+                print(f"   - ✅ Đã lưu {rows} tuyến đường vào: {writer.path}")
+            else:
+                print(f"   - ⚠️ Không có tuyến đường nào, đã tạo file rỗng: {writer.path}")
+            if export_excel:
+                excel_writer = RoadsExcelWriter(city_folder_by_name[city_name] / "roads.xlsx")
+                df_city_roads = pd.read_parquet(writer.path)
+                for start in range(0, rows, chunksize):
+                    excel_writer.write(df_city_roads.iloc[start:start + chunksize])
+                excel_writer.close()
+                print(f"   - ✅ Đã lưu thêm: {excel_writer.path}")
+        except Exception as e:
+            print(f"   - ❌ Lỗi khi lưu file {writer.path}: {str(e)}")
+    
     print("\n" + "="*60)
     print("✅ Hoàn thành! Đã lọc tuyến đường cho tất cả các thành phố.")
     print(f"📂 Dữ liệu được lưu trong các folder thành phố tại: {process_dir}")
 
 if __name__ == "__main__":
-    filter_roads_by_city()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lọc tuyến đường theo từng thành phố trong data/process")
+    parser.add_argument("--excel", action="store_true", help="Ghi thêm roads.xlsx (chậm)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Số dòng road đọc mỗi lần")
+    parser.add_argument("--metrics-log", help="Ghi thời gian/bộ nhớ ra file JSON lines")
+    args = parser.parse_args()
+    instrumentation.configure(log_path=args.metrics_log)
+    filter_roads_by_city(chunksize=args.chunksize, export_excel=args.excel)
 
@@ -2,10 +2,12 @@ import pandas as pd
 import os
 from pathlib import Path
 
-def split_excel_by_city():
+def split_excel_by_city(export_excel=False):
     """
     Tách các file Excel (customers, depots, vehicles) theo thành phố
-    Mỗi thành phố sẽ được lưu vào một folder riêng trong data/process
+    Mỗi thành phố sẽ được lưu vào một folder riêng trong data/process dưới dạng .parquet
+    (đọc lại bằng backend.data_processing.data.load_city_data).
+    export_excel=True để ghi thêm bản .xlsx như trước.
     """
     
     # Đường dẫn thư mục chứa file Excel (có thể chỉnh sửa đường dẫn này)
@@ -227,53 +229,40 @@ def split_excel_by_city():
                 df_city_vehicles = df_city_vehicles.drop(columns=['Start_Depot_ID_clean', 'End_Depot_ID_clean'])
             else:
                 print(f"   ⚠️ Không tìm thấy cột depot trong vehicles cho {city_name}")
-                df_city_vehicles = pd.DataFrame()
+                df_city_vehicles = df_vehicles.iloc[0:0].copy()
         else:
-            df_city_vehicles = pd.DataFrame()
-        
-        # Lưu file Excel cho từng thành phố (chỉ lưu nếu có dữ liệu)
-        customers_output = city_folder / "customers.xlsx"
-        depots_output = city_folder / "depots.xlsx"
-        vehicles_output = city_folder / "vehicles.xlsx"
+            # Giữ nguyên cột của file gốc để load_city_data đọc được cả khi rỗng
+            df_city_vehicles = df_vehicles.iloc[0:0].copy()
         
+        # Lưu file Parquet cho từng thành phố (file rỗng nếu không có dữ liệu)
         try:
-            if len(df_city_customers) > 0:
+            df_city_customers.to_parquet(city_folder / "customers.parquet", index=False)
+            df_city_depots.to_parquet(city_folder / "depots.parquet", index=False)
+            df_city_vehicles.to_parquet(city_folder / "vehicles.parquet", index=False)
+        except Exception as e:
+            print(f"   ❌ Lỗi khi lưu file Parquet cho {city_name}: {str(e)}")
+            continue
+        
+        # Lưu thêm file Excel nếu được yêu cầu (chậm với dữ liệu lớn)
+        if export_excel:
+            customers_output = city_folder / "customers.xlsx"
+            depots_output = city_folder / "depots.xlsx"
+            vehicles_output = city_folder / "vehicles.xlsx"
+        
+            # Bảng rỗng vẫn giữ tên cột của file gốc
+            try:
                 df_city_customers.to_excel(customers_output, index=False, engine='openpyxl')
-            else:
-                # Tạo file rỗng nếu không có dữ liệu
-                pd.DataFrame().to_excel(customers_output, index=False, engine='openpyxl')
-            
-            if len(df_city_depots) > 0:
                 df_city_depots.to_excel(depots_output, index=False, engine='openpyxl')
-            else:
-                # Tạo file rỗng nếu không có dữ liệu
-                pd.DataFrame().to_excel(depots_output, index=False, engine='openpyxl')
-            
-            if len(df_city_vehicles) > 0:
                 df_city_vehicles.to_excel(vehicles_output, index=False, engine='openpyxl')
-            else:
-                # Tạo file rỗng nếu không có dữ liệu
-                pd.DataFrame().to_excel(vehicles_output, index=False, engine='openpyxl')
-        except ImportError:
-            # Nếu không có openpyxl, thử dùng xlsxwriter hoặc mặc định
-            try:
-                if len(df_city_customers) > 0:
+            except ImportError:
+                # Nếu không có openpyxl, thử dùng xlsxwriter hoặc mặc định
+                try:
                     df_city_customers.to_excel(customers_output, index=False)
-                else:
-                    pd.DataFrame().to_excel(customers_output, index=False)
-                
-                if len(df_city_depots) > 0:
                     df_city_depots.to_excel(depots_output, index=False)
-                else:
-                    pd.DataFrame().to_excel(depots_output, index=False)
-                
-                if len(df_city_vehicles) > 0:
                     df_city_vehicles.to_excel(vehicles_output, index=False)
-                else:
-                    pd.DataFrame().to_excel(vehicles_output, index=False)
-            except Exception as e:
-                print(f"   ❌ Lỗi khi lưu file cho {city_name}: {str(e)}")
-                continue
+                except Exception as e:
+                    print(f"   ❌ Lỗi khi lưu file cho {city_name}: {str(e)}")
+                    continue
         
         print(f"\n✅ {city_name}:")
         print(f"   - Customers: {len(df_city_customers)} dòng")
@@ -286,4 +275,9 @@ def split_excel_by_city():
     print(f"📂 Dữ liệu được lưu tại: {output_base}")
 
 if __name__ == "__main__":
-    split_excel_by_city()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tách customers, depots, vehicles theo thành phố vào data/process")
+    parser.add_argument("--excel", action="store_true", help="Ghi thêm file .xlsx (chậm)")
+    args = parser.parse_args()
+    split_excel_by_city(export_excel=args.excel)